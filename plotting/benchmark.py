@@ -0,0 +1,199 @@
+#! /bin/env/python
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import statistics
+import subprocess
+
+import syntheticNtuples
+
+PLOTTINGDIR = os.path.dirname(os.path.abspath(__file__))
+
+# Run one of the plotting scripts as it would be run by hand, in a fresh
+# process so that its start up is included, and return its wall time or
+# None if it did not exit with the expected code. A script of None runs
+# the arguments as python code instead
+def timeScript(script, arguments, logFile, expectedCode=0):
+
+    if script is None:
+        command = [sys.executable, "-c"] + arguments
+    else:
+        command = [sys.executable, f"{PLOTTINGDIR}/{script}"] + [str(argument) for argument in arguments]
+
+    start = time.perf_counter()
+    with open(logFile, "w") as log:
+        log.write(" ".join(command) + "\n")
+        log.flush()
+        result = subprocess.run(command, cwd=PLOTTINGDIR, stdout=log, stderr=subprocess.STDOUT)
+    seconds = time.perf_counter() - start
+
+    if result.returncode != expectedCode:
+        print(f"\033[1;31mWARNING: \"{script or arguments[0]}\" failed with exit code {result.returncode}, see \"{logFile}\"\033[0m")
+        return None
+
+    return seconds
+
+# Make the synthetic ntuples unless the ones in ntupleDir were made with the same settings
+def prepareNtuples(ntupleDir, nFiles, nEvents, seed, pileup):
+
+    settings     = {"files" : nFiles, "events" : nEvents, "seed" : seed, "pileup" : pileup}
+    settingsFile = f"{ntupleDir}/settings.json"
+
+    if os.path.exists(settingsFile):
+        with open(settingsFile) as f:
+            if json.load(f) == settings:
+                print(f"Reusing the synthetic ntuples in \"{ntupleDir}\"")
+                return [f"{ntupleDir}/analyze_tps_{iFile}.root" for iFile in range(nFiles)]
+
+    shutil.rmtree(ntupleDir, ignore_errors=True)
+    inputFiles = syntheticNtuples.writeFiles(ntupleDir, nFiles, nEvents, seed, pileup)
+
+    with open(settingsFile, "w") as f:
+        json.dump(settings, f)
+
+    return inputFiles
+
+# A directory holding links to the given files only, as the scripts take all files of a directory
+def linkDir(path, links):
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+    for name, target in links.items():
+        os.symlink(os.path.abspath(target), f"{path}/{name}")
+
+    return path
+
+def timeRepeated(script, arguments, logFile, repeat, expectedCode=0):
+
+    times = [timeScript(script, arguments, logFile, expectedCode) for _ in range(repeat)]
+    if None in times:
+        return None
+
+    return times
+
+# Time how long the scripts take to show their help and to reject an options
+# file, neither of which should import ROOT, with importing ROOT for reference
+def benchmarkStartup(workDir, repeat):
+
+    cases = [("import ROOT",        None,             ["import ROOT; ROOT.gROOT.SetBatch(True)"], 0),
+             ("ttreeDrawer --help", "ttreeDrawer.py", ["--help"],                                 0),
+             ("plotter --help",     "plotter.py",     ["--help"],                                 0),
+             ("ttreeDrawer error",  "ttreeDrawer.py", ["--inputDir", workDir, "--outputFile", f"{workDir}/unused.root", "--options", "noSuchOptions"], 2),
+             ("plotter error",      "plotter.py",     ["--inpath", workDir, "--outpath", f"{workDir}/unused", "--options", "noSuchOptions"], 2)]
+
+    results = []
+    for name, script, arguments, expectedCode in cases:
+        times = timeRepeated(script, arguments, f"{workDir}/logs/{name.replace(' ', '_')}.log", repeat, expectedCode)
+        results.append({"step" : name, "engine" : None, "files" : None, "jobs" : None, "times" : times})
+
+    return results
+
+# Time ttreeDrawer with each engine over each number of input files and of
+# processes, returning the results and the output of the largest run per engine
+def benchmarkDrawing(workDir, inputFiles, fileCounts, jobCounts, engines, options, repeat):
+
+    results = []
+    outputs = {}
+    for engine in engines:
+        for nFiles in fileCounts:
+            inputDir = linkDir(f"{workDir}/inputs_{nFiles}", {os.path.basename(inputFile) : inputFile for inputFile in inputFiles[:nFiles]})
+
+            for nJobs in jobCounts:
+                name       = f"{engine}_{nFiles}files_{nJobs}jobs"
+                outputFile = f"{workDir}/histos/{name}.root"
+                os.makedirs(os.path.dirname(outputFile), exist_ok=True)
+
+                times = timeRepeated("ttreeDrawer.py", ["--inputDir", inputDir, "--outputFile", outputFile, "--options", options, "--engine", engine, "--jobs", nJobs], f"{workDir}/logs/{name}.log", repeat)
+                results.append({"step" : "ttreeDrawer", "engine" : engine, "files" : nFiles, "jobs" : nJobs, "times" : times})
+
+                if times is not None:
+                    outputs[engine] = outputFile
+
+    return results, outputs
+
+# Time plotter over each number of processes, taking the same histograms for
+# every category of the options file
+def benchmarkPlotting(workDir, histoFile, jobCounts, options, output, repeat):
+
+    categories = __import__(options).categories
+    inpath     = linkDir(f"{workDir}/plotInputs", {f"{categoryName}.root" : histoFile for categoryName in categories})
+
+    results = []
+    for nJobs in jobCounts:
+        name    = f"plotter_{nJobs}jobs"
+        outpath = f"{workDir}/plots/{name}"
+        shutil.rmtree(outpath, ignore_errors=True)
+
+        times = timeRepeated("plotter.py", ["--inpath", inpath, "--outpath", outpath, "--options", options, "--output", output, "--jobs", nJobs, "--doRatio"], f"{workDir}/logs/{name}.log", repeat)
+        results.append({"step" : "plotter", "engine" : None, "files" : None, "jobs" : nJobs, "times" : times})
+
+    return results
+
+# Table of the best and median wall times, with the speed up with respect to
+# the same step, engine and number of files run with the fewest processes
+def summary(results):
+
+    lines = [f"{'step':<20} {'engine':>7} {'files':>6} {'jobs':>5} {'best [s]':>9} {'median [s]':>11} {'speedup':>8}"]
+
+    baselines = {}
+    for result in results:
+        key = (result["step"], result["engine"], result["files"])
+        if result["times"] is None:
+            lines.append(f"{result['step']:<20} {str(result['engine'] or '-'):>7} {str(result['files'] or '-'):>6} {str(result['jobs'] or '-'):>5} {'failed':>9}")
+            continue
+
+        best = min(result["times"])
+        baselines.setdefault(key, best)
+        lines.append(f"{result['step']:<20} {str(result['engine'] or '-'):>7} {str(result['files'] or '-'):>6} {str(result['jobs'] or '-'):>5} {best:>9.2f} {statistics.median(result['times']):>11.2f} {baselines[key] / best:>7.2f}x")
+
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workDir",         dest="workDir",         help="where to put ntuples and outputs",  default="benchmark"                                  )
+    parser.add_argument("--events",          dest="events",          help="events per synthetic file",         default=200,      type=int                            )
+    parser.add_argument("--files",           dest="files",           help="numbers of input files",            default=[1, 4],   type=int, nargs="+"                 )
+    parser.add_argument("--jobs",            dest="jobs",            help="numbers of processes",              default=[1, 4],   type=int, nargs="+"                 )
+    parser.add_argument("--engines",         dest="engines",         help="ttreeDrawer engines",               default=["rdf"],  nargs="+", choices=["rdf", "draw", "numpy"])
+    parser.add_argument("--pileup",          dest="pileup",          help="mean number of vertices",           default=55.0,     type=float                          )
+    parser.add_argument("--seed",            dest="seed",            help="seed of the synthetic ntuples",     default=0,        type=int                            )
+    parser.add_argument("--repeat",          dest="repeat",          help="runs of each configuration",        default=1,        type=int                            )
+    parser.add_argument("--drawerOptions",   dest="drawerOptions",   help="ttreeDrawer options file",          default="ttreeDrawer_aux"                            )
+    parser.add_argument("--plotterOptions",  dest="plotterOptions",  help="plotter options file",              default="plotter_aux"                                )
+    parser.add_argument("--output",          dest="output",          help="plotter output format",             default="pdf",    choices=["pdf", "book", "png", "svg"])
+    parser.add_argument("--noPlotting",      dest="noPlotting",      help="only time ttreeDrawer",             default=False,    action="store_true"                 )
+    parser.add_argument("--startupOnly",     dest="startupOnly",     help="only time the start up",            default=False,    action="store_true"                 )
+    args = parser.parse_args()
+
+    workDir = os.path.abspath(args.workDir)
+    os.makedirs(f"{workDir}/logs", exist_ok=True)
+
+    fileCounts = sorted(set(args.files))
+    jobCounts  = sorted(set(args.jobs))
+
+    results = benchmarkStartup(workDir, args.repeat)
+
+    if not args.startupOnly:
+        inputFiles = prepareNtuples(f"{workDir}/ntuples", max(fileCounts), args.events, args.seed, args.pileup)
+
+        drawing, outputs = benchmarkDrawing(workDir, inputFiles, fileCounts, jobCounts, args.engines, args.drawerOptions, args.repeat)
+        results += drawing
+
+        if not args.noPlotting:
+            if outputs:
+                results += benchmarkPlotting(workDir, outputs[args.engines[0]] if args.engines[0] in outputs else list(outputs.values())[0], jobCounts, args.plotterOptions, args.output, args.repeat)
+            else:
+                print("\033[1;31mWARNING: No ttreeDrawer run succeeded, not timing plotter\033[0m")
+
+    print(summary(results))
+
+    with open(f"{workDir}/results.json", "w") as f:
+        json.dump({"settings" : vars(args), "python" : sys.version, "cpus" : os.cpu_count(), "results" : results}, f, indent=1)
+
+    print(f"Wrote results to \"{workDir}/results.json\"")
@@ -0,0 +1,350 @@
+#! /bin/env/python
+
+import numpy as np
+
+import profiling
+from formulaParser import FormulaError, compileFormula, splitVariable
+
+# Number of fine grain bits AnalyzeTPs stores per TP, as fg0..5_packed and fg0..5_reemul
+NFG = 6
+
+# This class is a light-weight stand-in for a ROOT TH1D/TH2D/TH3D that
+# is filled with whole NumPy arrays at a time. Bin contents and the sum
+# of squared weights are kept with the same under/overflow convention as
+# ROOT so that the conversion to a ROOT histogram is a simple copy
+#    name : name of the histogram
+#    axes : list of (nbins, min, max) tuples ordered x, y, z
+class BinnedHisto:
+
+    def __init__(self, name, axes):
+
+        self.name    = name
+        self.axes    = [(int(nbins), float(low), float(high)) for nbins, low, high in axes]
+        self.shape   = tuple(nbins + 2 for nbins, _, _ in self.axes)
+        self.sumw    = np.zeros(self.shape)
+        self.sumw2   = np.zeros(self.shape)
+        self.entries = 0
+
+    # Build from a ROOT histogram with uniform binning, copying its contents
+    @classmethod
+    def fromROOT(cls, histo, name=None):
+
+        rootAxes = [histo.GetXaxis(), histo.GetYaxis(), histo.GetZaxis()][:histo.GetDimension()]
+        binned   = cls(histo.GetName() if name is None else name, [(axis.GetNbins(), axis.GetXmin(), axis.GetXmax()) for axis in rootAxes])
+
+        nCells = histo.GetNcells()
+        sumw   = histo.GetArray()
+        sumw.reshape((nCells,))
+        binned.sumw = np.array(sumw, dtype=np.float64).reshape(binned.shape, order="F")
+
+        if histo.GetSumw2N() > 0:
+            sumw2 = histo.GetSumw2().GetArray()
+            sumw2.reshape((nCells,))
+            binned.sumw2 = np.array(sumw2, dtype=np.float64).reshape(binned.shape, order="F")
+        else:
+            binned.sumw2 = binned.sumw.copy()
+
+        binned.entries = int(histo.GetEntries())
+
+        return binned
+
+    # Same bin finding as TAxis::FindBin, bin 0 is the underflow and
+    # bin nbins+1 the overflow. Entries with NaN values are dropped
+    @staticmethod
+    def findBins(values, nbins, low, high):
+
+        bins = np.floor(nbins * (values - low) / (high - low))
+        bins = np.clip(bins, -1, nbins) + 1
+        return np.nan_to_num(bins, nan=-1).astype(np.int64)
+
+    def fill(self, values, weights):
+
+        indices = [self.findBins(value, *axis) for value, axis in zip(values, self.axes)]
+        keep = np.logical_and.reduce([index >= 0 for index in indices]) & (weights != 0.0)
+        if not np.any(keep):
+            return
+
+        flat = np.ravel_multi_index([index[keep] for index in indices], self.shape)
+        w    = weights[keep]
+
+        self.sumw  += np.bincount(flat, weights=w,     minlength=self.sumw.size).reshape(self.shape)
+        self.sumw2 += np.bincount(flat, weights=w * w, minlength=self.sumw.size).reshape(self.shape)
+        self.entries += int(np.count_nonzero(keep))
+
+    def copy(self):
+
+        copied = BinnedHisto(self.name, self.axes)
+        copied.sumw    = self.sumw.copy()
+        copied.sumw2   = self.sumw2.copy()
+        copied.entries = self.entries
+
+        return copied
+
+    # Merge the contents of another histogram with identical binning
+    def add(self, other):
+
+        if self.axes != other.axes:
+            raise ValueError(f"Cannot add histograms \"{self.name}\" and \"{other.name}\" with different binning")
+
+        self.sumw    += other.sumw
+        self.sumw2   += other.sumw2
+        self.entries += other.entries
+
+    # Sum the contents of the bins firstBin..lastBin of one axis, giving a histogram
+    # of the remaining axes like TH2::ProjectionX/Y or TH3::Project3D would
+    def project(self, axis, name, firstBin, lastBin):
+
+        if axis >= len(self.axes):
+            raise ValueError(f"Cannot project axis {'XYZ'[axis]} of {len(self.axes)}D histogram \"{self.name}\"")
+
+        index = [slice(None)] * len(self.axes)
+        index[axis] = slice(max(firstBin, 0), lastBin + 1)
+
+        projected = BinnedHisto(name, [ax for iAxis, ax in enumerate(self.axes) if iAxis != axis])
+        projected.sumw  = self.sumw[tuple(index)].sum(axis=axis)
+        projected.sumw2 = self.sumw2[tuple(index)].sum(axis=axis)
+
+        # As done by ROOT for projections, the number of entries is the effective one
+        sumw2 = projected.sumw2.sum()
+        projected.entries = int(round(projected.sumw.sum()**2 / sumw2)) if sumw2 > 0.0 else 0
+
+        return projected
+
+    # Convert into a ROOT histogram, ROOT stores x as the fastest running
+    # index hence the Fortran ordering when flattening the arrays
+    def toROOT(self, name=None):
+
+        import ROOT
+
+        name = self.name if name is None else name
+        args = [value for axis in self.axes for value in axis]
+        if   len(self.axes) == 1:
+            histo = ROOT.TH1D(name, "", *args)
+        elif len(self.axes) == 2:
+            histo = ROOT.TH2D(name, "", *args)
+        elif len(self.axes) == 3:
+            histo = ROOT.TH3D(name, "", *args)
+
+        histo.Sumw2()
+        histo.SetContent(np.ravel(self.sumw, order="F"))
+        sumw2 = np.ravel(self.sumw2, order="F")
+        histo.GetSumw2().Set(len(sumw2), sumw2)
+        histo.ResetStats()
+        histo.SetEntries(self.entries)
+
+        return histo
+
+# The binning of a histogram from the side car file, in x, y, z order
+def histoAxes(histOps, nDim):
+
+    return [(histOps[f"{axis}bins"], histOps[f"{axis}min"], histOps[f"{axis}max"]) for axis in "xyz"[:nDim]]
+
+# Unpack a projection string of the form "Z;HB;[1,16]" or "Z;ieta;2" into
+# the index of the axis to project, the name of the projected histogram
+# and the inclusive range of bins along the axis to sum over
+def parseProjection(projection, basename):
+
+    unpack   = projection.replace(" ", "").split(";")
+    axis     = "XYZ".index(unpack[0].upper())
+    label    = unpack[1]
+    binRange = unpack[2]
+
+    labelExt = ""
+    if "," in binRange:
+        unpackRange = binRange.split(",")
+        firstBin = int(unpackRange[0][1:])
+        lastBin  = int(unpackRange[1][:-1])
+
+        if unpackRange[0][0] == "(":
+            firstBin += 1
+        if unpackRange[1][-1] == ")":
+            lastBin -= 1
+    else:
+        firstBin = int(binRange)
+        lastBin  = int(binRange)
+        labelExt = str(binRange)
+
+    return axis, basename + f"_{label}{labelExt}", firstBin, lastBin
+
+# Check the entries of a ttreeDrawer side car file without running anything,
+# returning a list of the problems found: missing keys, bad binning,
+# expressions that do not parse and projections that do not fit
+def validateHistograms(histograms):
+
+    problems = []
+    for iEntry, histOps in enumerate(histograms):
+        if not isinstance(histOps, dict):
+            problems.append(f"Entry {iEntry} is not a dictionary")
+            continue
+
+        name    = histOps.get("basename", f"entry {iEntry}")
+        missing = [key for key in ["basename", "weight", "selection", "variable"] if key not in histOps]
+        if missing:
+            problems.append(f"Histogram \"{name}\" has no {', '.join(missing)}")
+            continue
+
+        try:
+            variables = splitVariable(histOps["variable"])
+            for expression in variables + [histOps["weight"], histOps["selection"]]:
+                compileFormula(expression)
+        except FormulaError as error:
+            problems.append(f"Histogram \"{name}\": {error}")
+            continue
+
+        if not 1 <= len(variables) <= 3:
+            problems.append(f"Histogram \"{name}\" has {len(variables)} variables, only 1 to 3 are possible")
+            continue
+
+        axes = "xyz"[:len(variables)]
+        missing = [f"{axis}{key}" for axis in axes for key in ["bins", "min", "max"] if f"{axis}{key}" not in histOps]
+        if missing:
+            problems.append(f"Histogram \"{name}\" has no {', '.join(missing)}")
+            continue
+
+        for axis in axes:
+            if not isinstance(histOps[f"{axis}bins"], int) or histOps[f"{axis}bins"] < 1 or not histOps[f"{axis}min"] < histOps[f"{axis}max"]:
+                problems.append(f"Histogram \"{name}\" has bad {axis} binning ({histOps[f'{axis}bins']}, {histOps[f'{axis}min']}, {histOps[f'{axis}max']})")
+
+        for projection in histOps.get("projections", []):
+            try:
+                axis, _, _, _ = parseProjection(projection, name)
+            except (ValueError, IndexError):
+                problems.append(f"Histogram \"{name}\" has malformed projection \"{projection}\"")
+                continue
+            if axis >= len(variables):
+                problems.append(f"Histogram \"{name}\" cannot project axis {'XYZ'[axis]} of a {len(variables)}D histogram")
+
+    return problems
+
+# The final histograms to be written for one histogram of the side car file,
+# either the projections or the full histogram under its basename
+def finalHistos(histo, histOps):
+
+    if "projections" in histOps and len(histo.axes) > 1:
+        return [histo.project(*parseProjection(projection, histOps["basename"])) for projection in histOps["projections"]]
+
+    return [histo]
+
+# Compile all expressions once and group the histograms by tree. Each booked
+# histogram carries the axis and bin range to select on (None if no slicing)
+def bookHistos(histograms, defaultTree, directProjections=False):
+
+    perTree  = {}
+    perHisto = []
+    for histOps in histograms:
+        treeName  = histOps.get("tree", defaultTree)
+        variables = [compileFormula(expression) for expression in splitVariable(histOps["variable"])]
+        weight    = compileFormula(f"({histOps['weight']})*({histOps['selection']})")
+        axes      = histoAxes(histOps, len(variables))
+
+        booked = []
+        if directProjections and "projections" in histOps and len(axes) > 1:
+            for projection in histOps["projections"]:
+                axis, name, firstBin, lastBin = parseProjection(projection, histOps["basename"])
+                if axis >= len(axes):
+                    raise ValueError(f"Cannot project axis {'XYZ'[axis]} of {len(axes)}D histogram \"{histOps['basename']}\"")
+                kept = [iAxis for iAxis in range(len(axes)) if iAxis != axis]
+                booked.append((BinnedHisto(name, [axes[iAxis] for iAxis in kept]), kept, (axis, firstBin, lastBin)))
+        else:
+            booked.append((BinnedHisto(histOps["basename"], axes), list(range(len(axes))), None))
+
+        perHisto.append((booked, histOps))
+        perTree.setdefault(treeName, []).append((booked, axes, variables, weight, histOps["basename"]))
+
+    return perTree, perHisto
+
+# The branches needed to fill the histograms booked for one tree
+def treeBranches(entries):
+
+    branches = set()
+    for _, _, variables, weight, _ in entries:
+        for formula in variables + [weight]:
+            branches |= formula.branches
+
+    return branches
+
+# Number of entries of each chunk between entryStart and entryStop, for trees
+# from which no branch is read because the expressions only use constants
+def entryChunks(entryStart, entryStop, chunkSize):
+
+    for first in range(entryStart, entryStop, max(chunkSize, 1)):
+        yield min(chunkSize, entryStop - first)
+
+# Fill the histograms booked for one tree from a chunk of its branches
+#    label : input the chunk comes from, for profiling
+def fillChunk(entries, chunk, nEntries, label=None):
+
+    columns = {name : np.asarray(array, dtype=np.float64) for name, array in chunk.items()}
+    if columns:
+        nEntries = len(next(iter(columns.values())))
+
+    for booked, axes, variables, weight, basename in entries:
+        with profiling.stage("fill", label, basename):
+            values  = [variable.evaluate(columns, nEntries) for variable in variables]
+            weights = weight.evaluate(columns, nEntries)
+
+            bins = {}
+            for histo, kept, sliced in booked:
+                if sliced is None:
+                    histo.fill(values, weights)
+                    continue
+
+                axis, firstBin, lastBin = sliced
+                if axis not in bins:
+                    bins[axis] = BinnedHisto.findBins(values[axis], *axes[axis])
+                inSlice = (bins[axis] >= firstBin) & (bins[axis] <= lastBin)
+                histo.fill([values[iAxis][inSlice] for iAxis in kept], weights[inSlice])
+
+# Turn the filled histograms into the final ones, with projections made where
+# they were not filled directly, as one dictionary per side car entry
+def finishHistos(perHisto, label=None):
+
+    histos = []
+    for booked, histOps in perHisto:
+        final = {}
+        with profiling.stage("project", label, histOps["basename"]):
+            for histo, _, sliced in booked:
+                for finalHisto in (finalHistos(histo, histOps) if sliced is None else [histo]):
+                    final[finalHisto.name] = finalHisto
+        histos.append(final)
+
+    return histos
+
+# Fill every histogram in the histograms list with a single pass over each
+# needed tree of inputFile. The tree is read in chunks of chunkSize entries
+# containing only the union of the branches used by the expressions, so the
+# memory needed is bounded by the chunk size and not by the tree size.
+# For each entry of histograms, the returned list holds a dictionary of the final
+# (possibly projected) histograms by the name they are to be written with.
+# With directProjections, the full
+# N-dimensional histogram is never booked and entries are routed straight
+# into the projections they belong to
+def fillHistos(inputFile, histograms, defaultTree, chunkSize, entryStart=None, entryStop=None, directProjections=False):
+
+    import uproot
+
+    perTree, perHisto = bookHistos(histograms, defaultTree, directProjections)
+
+    with uproot.open(inputFile) as file:
+        for treeName, entries in perTree.items():
+            tree     = file[treeName]
+            branches = sorted(treeBranches(entries))
+
+            # Nothing to read, but every entry of the range still has to be counted
+            if not branches:
+                first = 0 if entryStart is None else entryStart
+                last  = tree.num_entries if entryStop is None else min(entryStop, tree.num_entries)
+                for nChunk in entryChunks(first, last, chunkSize):
+                    fillChunk(entries, {}, nChunk, inputFile)
+                continue
+
+            chunks = tree.iterate(branches, step_size=chunkSize, library="np", entry_start=entryStart, entry_stop=entryStop)
+            while True:
+                with profiling.stage("read", inputFile):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+
+                fillChunk(entries, chunk, tree.num_entries, inputFile)
+
+    return finishHistos(perHisto, inputFile)
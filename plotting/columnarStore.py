@@ -0,0 +1,212 @@
+#! /bin/env/python
+
+import os
+import json
+import time
+import shutil
+import argparse
+
+import numpy as np
+
+import rootLoader
+import columnarEngine
+
+# A flat tree of fixed-width scalars, like analyzeTPs/tps, stored as one raw
+# .npy file per branch and per input file, in native byte order, next to a
+# schema.json manifest with the type of every column and the input files and
+# their number of entries. Columns are read back as memory maps, so only the
+# pages of the columns that are actually used get read from disk
+#    outputDir/schema.json
+#    outputDir/<input file name>/<branch>.npy
+SCHEMAFILE = "schema.json"
+
+# Name of the directory holding the columns of one input file
+def fileKey(inputFile):
+    return os.path.splitext(os.path.basename(inputFile))[0]
+
+# Convert the tree of one input file, writing the columns to a temporary
+# directory that is renamed once complete, so that interrupted conversions
+# never leave partial columns behind
+def convertFile(inputFile, treeName, outputDir, chunkSize):
+
+    import uproot
+
+    start   = time.time()
+    key     = fileKey(inputFile)
+    tempDir = f"{outputDir}/{key}.tmp"
+
+    shutil.rmtree(tempDir, ignore_errors=True)
+    os.makedirs(tempDir)
+
+    with uproot.open(inputFile) as file:
+        tree     = file[treeName]
+        nEntries = tree.num_entries
+
+        columns = {}
+        for branch in tree.branches:
+            dtype = np.dtype(branch.interpretation.to_dtype)
+            columns[branch.name] = np.lib.format.open_memmap(f"{tempDir}/{branch.name}.npy", mode="w+", dtype=dtype.newbyteorder("="), shape=(nEntries,))
+
+        first = 0
+        for chunk in tree.iterate(list(columns), step_size=chunkSize, library="np"):
+            nChunk = len(next(iter(chunk.values())))
+            for name, array in chunk.items():
+                columns[name][first:first + nChunk] = array
+            first += nChunk
+
+        schema = {name : column.dtype.str for name, column in columns.items()}
+        for column in columns.values():
+            column.flush()
+        del columns
+
+    shutil.rmtree(f"{outputDir}/{key}", ignore_errors=True)
+    os.rename(tempDir, f"{outputDir}/{key}")
+
+    return inputFile, schema, nEntries, time.time() - start
+
+def loadSchema(outputDir):
+
+    schemaFile = f"{outputDir}/{SCHEMAFILE}"
+    if not os.path.exists(schemaFile):
+        return None
+
+    with open(schemaFile) as f:
+        return json.load(f)
+
+# Convert all input files in parallel, in the given order. Files already converted with the same
+# size and modification time are kept, unless force is given, and the
+# columns of files that are no longer inputs are removed
+def convertFiles(inputFiles, treeName, outputDir, chunkSize, nJobs, force=False):
+
+    os.makedirs(outputDir, exist_ok=True)
+
+    schema = loadSchema(outputDir)
+    if schema is None or schema["tree"] != treeName or force:
+        schema = {"tree" : treeName, "columns" : None, "files" : {}}
+
+    # Files no longer among the inputs are dropped from the dataset
+    keys = {fileKey(inputFile) for inputFile in inputFiles}
+    for key in [key for key in schema["files"] if key not in keys]:
+        shutil.rmtree(f"{outputDir}/{key}", ignore_errors=True)
+        del schema["files"][key]
+
+    toConvert = []
+    for inputFile in inputFiles:
+        stat  = os.stat(inputFile)
+        entry = schema["files"].get(fileKey(inputFile))
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime and os.path.isdir(f"{outputDir}/{fileKey(inputFile)}"):
+            continue
+        toConvert.append(inputFile)
+
+    print(f"Converting {len(toConvert)} of {len(inputFiles)} input files")
+
+    for inputFile, columns, nEntries, seconds in rootLoader.mapFiles(convertFile, toConvert, (treeName, outputDir, chunkSize), nJobs):
+        if schema["columns"] is None:
+            schema["columns"] = columns
+        elif columns != schema["columns"]:
+            print(f"\033[1;31mWARNING: Branches of \"{inputFile}\" differ from the other input files, it is left out\033[0m")
+            shutil.rmtree(f"{outputDir}/{fileKey(inputFile)}", ignore_errors=True)
+            continue
+
+        stat = os.stat(inputFile)
+        schema["files"][fileKey(inputFile)] = {"source" : inputFile, "entries" : nEntries, "size" : stat.st_size, "mtime" : stat.st_mtime}
+        print(f"Converted \"{inputFile}\" with {nEntries} entries in {seconds:.1f} s")
+
+    with open(f"{outputDir}/{SCHEMAFILE}", "w") as f:
+        json.dump(schema, f, indent=1)
+
+    return schema
+
+# Read access to a converted tree. Columns are memory maps of the .npy files,
+# so slicing them gives views without any copy and nothing is read from disk
+# before the data is used
+#    path : directory holding schema.json
+class ColumnarDataset:
+
+    def __init__(self, path):
+
+        self.path   = path
+        self.schema = loadSchema(path)
+        if self.schema is None:
+            raise FileNotFoundError(f"No \"{SCHEMAFILE}\" in \"{path}\"")
+
+        self.tree    = self.schema["tree"]
+        self.columns = {name : np.dtype(dtype) for name, dtype in (self.schema["columns"] or {}).items()}
+        self.files   = sorted(self.schema["files"])
+
+    @property
+    def numEntries(self):
+        return sum(self.schema["files"][key]["entries"] for key in self.files)
+
+    # Memory map one column of one file
+    def column(self, key, name):
+
+        if name not in self.columns:
+            raise KeyError(f"No column \"{name}\" in \"{self.path}\"")
+
+        return np.load(f"{self.path}/{key}/{name}.npy", mmap_mode="r")
+
+    # The named columns of one file, by name
+    def arrays(self, key, names):
+
+        return {name : self.column(key, name) for name in names}
+
+    # Walk over all files, chunkSize entries at a time (one chunk per file if
+    # None), yielding the file and the views of the named columns
+    def iterate(self, names, chunkSize=None):
+
+        for key in self.files:
+            columns  = self.arrays(key, names)
+            nEntries = self.schema["files"][key]["entries"]
+            step     = nEntries if chunkSize is None else chunkSize
+            for first in range(0, nEntries, max(step, 1)):
+                yield key, {name : column[first:first + step] for name, column in columns.items()}
+
+    # One column over all files as a single array, which is a copy
+    def concatenate(self, name):
+
+        return np.concatenate([self.column(key, name) for key in self.files]) if self.files else np.zeros(0, self.columns[name])
+
+# Fill the histograms of a ttreeDrawer options file from a dataset, the same
+# way columnarEngine.fillHistos does from a tree, returning for each entry of
+# histograms a dictionary of the final histograms summed over all files
+def fillHistos(dataset, histograms, chunkSize=None, directProjections=False):
+
+    perTree, perHisto = columnarEngine.bookHistos(histograms, dataset.tree, directProjections)
+
+    for treeName, entries in perTree.items():
+        if treeName != dataset.tree:
+            raise ValueError(f"Dataset \"{dataset.path}\" holds \"{dataset.tree}\" and not \"{treeName}\"")
+
+        branches = sorted(columnarEngine.treeBranches(entries))
+
+        # Nothing to read, but every entry still has to be counted
+        if not branches:
+            for key in dataset.files:
+                nEntries = dataset.schema["files"][key]["entries"]
+                for nChunk in columnarEngine.entryChunks(0, nEntries, nEntries if chunkSize is None else chunkSize):
+                    columnarEngine.fillChunk(entries, {}, nChunk, key)
+            continue
+
+        for key, chunk in dataset.iterate(branches, chunkSize):
+            columnarEngine.fillChunk(entries, chunk, dataset.schema["files"][key]["entries"], key)
+
+    return columnarEngine.finishHistos(perHisto, dataset.path)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--inputDir",   dest="inputDir",   help="Path to ntuples",           required=True            )
+    parser.add_argument("--outputDir",  dest="outputDir",  help="path for columnar dataset", required=True            )
+    parser.add_argument("--tree",       dest="tree",       help="TTree name to convert",     default="analyzeTPs/tps" )
+    parser.add_argument("--chunkSize",  dest="chunkSize",  help="entries per chunk",         default=5000000, type=int)
+    parser.add_argument("--jobs",       dest="jobs",       help="number of processes",       default=os.cpu_count(), type=int)
+    parser.add_argument("--force",      dest="force",      help="convert all files again",   default=False, action="store_true")
+    args = parser.parse_args()
+
+    inputFiles = rootLoader.inputFiles(args.inputDir)
+    if not inputFiles:
+        quit()
+
+    schema = convertFiles(inputFiles, args.tree, args.outputDir, args.chunkSize, args.jobs, args.force)
+    print(f"Dataset \"{args.outputDir}\" holds {sum(entry['entries'] for entry in schema['files'].values())} entries of {len(schema['columns'] or {})} columns from {len(schema['files'])} files")
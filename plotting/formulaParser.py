@@ -0,0 +1,244 @@
+#! /bin/env/python
+
+import re
+import operator
+import functools
+
+import numpy as np
+
+# Small parser for the TFormula-like expressions used in the "variable",
+# "selection" and "weight" entries of the ttreeDrawer side car files.
+# An expression is turned into a tree of nodes that can be evaluated on
+# a dictionary of NumPy arrays (one per branch), which allows to histogram
+# whole chunks of a TTree at once instead of entry-by-entry with TTreeFormula
+
+# As in TTreeFormula, all arithmetic is done with doubles, and & and | are
+# bitwise on the values truncated to integers as in both TTreeFormula and C++.
+# The ^ operator is rejected: it is a power for TTree::Draw but a xor for the
+# C++ of RDataFrame, so no single meaning matches both other engines
+FUNCTIONS = {
+    "abs"   : np.abs,    "fabs"  : np.abs,    "sqrt"  : np.sqrt,
+    "exp"   : np.exp,    "log"   : np.log,    "log10" : np.log10,
+    "sin"   : np.sin,    "cos"   : np.cos,    "tan"   : np.tan,
+    "floor" : np.floor,  "ceil"  : np.ceil,   "round" : np.round,
+    "atan2" : np.arctan2, "pow"  : np.power,
+    "min"   : np.minimum, "max"  : np.maximum,
+}
+for name in ["Abs", "Sqrt", "Exp", "Log", "Log10", "Sin", "Cos", "Tan", "Floor", "Ceil", "ATan2", "Power", "Min", "Max"]:
+    FUNCTIONS[f"TMath::{name}"] = FUNCTIONS[{"ATan2" : "atan2", "Power" : "pow"}.get(name, name.lower())]
+
+CONSTANTS = {"true" : 1.0, "false" : 0.0, "kTRUE" : 1.0, "kFALSE" : 0.0}
+
+def _logical(function):
+    return lambda a, b: function(a != 0, b != 0)
+
+def _bitwise(function):
+    return lambda a, b: function(np.trunc(a).astype(np.int64), np.trunc(b).astype(np.int64))
+
+# Binary operators from lowest to highest precedence
+BINARY = [
+    {"||" : _logical(np.logical_or)},
+    {"&&" : _logical(np.logical_and)},
+    {"|"  : _bitwise(np.bitwise_or)},
+    {"&"  : _bitwise(np.bitwise_and)},
+    {"==" : operator.eq, "!=" : operator.ne},
+    {"<"  : operator.lt, "<=" : operator.le, ">" : operator.gt, ">=" : operator.ge},
+    {"+"  : operator.add, "-" : operator.sub},
+    {"*"  : operator.mul, "/" : operator.truediv, "%" : lambda a, b: np.fmod(np.trunc(a), np.trunc(b))},
+]
+
+TOKENS = re.compile(r"""\s*(?:
+    (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)|
+    (?P<name>[A-Za-z_]\w*(?:::[A-Za-z_]\w*)*)|
+    (?P<op>\|\||&&|==|!=|<=|>=|[-+*/%<>!^&|(),])
+)""", re.VERBOSE)
+
+class FormulaError(Exception):
+    pass
+
+# Nodes of the parsed expression, each one knows how to evaluate itself
+# on a dictionary of columns and which identifiers it depends on
+class Number:
+    def __init__(self, value):
+        self.value = float(value)
+
+    def names(self):
+        return set()
+
+    def evaluate(self, columns):
+        return self.value
+
+class Name:
+    def __init__(self, name):
+        self.name = name
+
+    def names(self):
+        return {self.name}
+
+    def evaluate(self, columns):
+        return np.asarray(columns[self.name], dtype=np.float64)
+
+class Call:
+    def __init__(self, name, args):
+        if name not in FUNCTIONS:
+            raise FormulaError(f"Unknown function \"{name}\"")
+        self.name     = name
+        self.function = FUNCTIONS[name]
+        self.args     = args
+
+    def names(self):
+        return set().union(*[arg.names() for arg in self.args])
+
+    def evaluate(self, columns):
+        return self.function(*[arg.evaluate(columns) for arg in self.args])
+
+class Unary:
+    def __init__(self, op, operand):
+        self.op      = op
+        self.operand = operand
+
+    def names(self):
+        return self.operand.names()
+
+    def evaluate(self, columns):
+        value = self.operand.evaluate(columns)
+        if self.op == "!":
+            return np.logical_not(value != 0)
+        if self.op == "-":
+            return -1.0 * value
+        return value
+
+class Binary:
+    def __init__(self, op, left, right, level):
+        self.op       = op
+        self.function = BINARY[level][op]
+        self.left     = left
+        self.right    = right
+
+    def names(self):
+        return self.left.names() | self.right.names()
+
+    def evaluate(self, columns):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.function(self.left.evaluate(columns), self.right.evaluate(columns))
+
+# Recursive descent parser over the list of tokens, one level per
+# entry in the BINARY precedence table
+class _Parser:
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens     = []
+
+        position = 0
+        expression = expression.rstrip()
+        while position < len(expression):
+            match = TOKENS.match(expression, position)
+            if not match or match.end() == position:
+                raise FormulaError(f"Cannot parse \"{expression}\" at position {position}")
+            self.tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            position = match.end()
+
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        kind, token = self.peek()
+        if kind is None or (value is not None and token != value):
+            raise FormulaError(f"Expected \"{value}\" in \"{self.expression}\"")
+        self.position += 1
+        return token
+
+    def parse(self):
+        if ("op", "^") in self.tokens:
+            raise FormulaError(f"\"^\" in \"{self.expression}\" is a power with --engine draw but a xor with --engine rdf, use pow(a, b) or (a != 0) != (b != 0) instead")
+        node = self.binary(0)
+        if self.position != len(self.tokens):
+            raise FormulaError(f"Unexpected \"{self.peek()[1]}\" in \"{self.expression}\"")
+        return node
+
+    def binary(self, level):
+        if level == len(BINARY):
+            return self.unary()
+
+        node = self.binary(level + 1)
+        while self.peek()[0] == "op" and self.peek()[1] in BINARY[level]:
+            op = self.take()
+            node = Binary(op, node, self.binary(level + 1), level)
+        return node
+
+    def unary(self):
+        kind, token = self.peek()
+        if kind == "op" and token in ["!", "-", "+"]:
+            self.take()
+            return Unary(token, self.unary())
+        return self.primary()
+
+    def primary(self):
+        kind, token = self.peek()
+        if kind == "number":
+            self.take()
+            return Number(token)
+        if kind == "name":
+            self.take()
+            if self.peek()[1] == "(":
+                self.take("(")
+                args = []
+                if self.peek()[1] != ")":
+                    args.append(self.binary(0))
+                    while self.peek()[1] == ",":
+                        self.take(",")
+                        args.append(self.binary(0))
+                self.take(")")
+                return Call(token, args)
+            if token in CONSTANTS:
+                return Number(CONSTANTS[token])
+            return Name(token)
+        if token == "(":
+            self.take("(")
+            node = self.binary(0)
+            self.take(")")
+            return node
+        raise FormulaError(f"Unexpected \"{token}\" in \"{self.expression}\"")
+
+# A compiled expression, holding the parsed tree and the set of
+# branches needed to evaluate it
+class Formula:
+    def __init__(self, expression):
+        self.expression = expression
+        self.node       = _Parser(expression).parse()
+        self.branches   = self.node.names()
+
+    # Evaluate on a chunk of columns, always returning an array of nEntries
+    def evaluate(self, columns, nEntries):
+        return np.broadcast_to(np.asarray(self.node.evaluate(columns), dtype=np.float64), (nEntries,))
+
+# Split a TTree::Draw style variable expression on the axis separators
+# while leaving C++ scope operators (e.g. TMath::Abs) intact. The returned
+# list is ordered x, y, z i.e. reversed with respect to the Draw string
+def splitVariable(variable):
+
+    return re.split(r"(?<!:):(?!:)", variable)[::-1]
+
+# Parsing is done once per expression string and shared by all histograms,
+# files and (being filled before the pool is forked) pool processes
+@functools.lru_cache(maxsize=None)
+def compileFormula(expression):
+
+    return Formula(expression)
+
+# The branches needed to evaluate all expressions, resolved against the actual
+# branches of the tree. Identifiers that are not branches are returned separately
+def resolveBranches(expressions, branchNames):
+
+    names = set()
+    for expression in expressions:
+        names |= compileFormula(expression).branches
+
+    return names & set(branchNames), names - set(branchNames)
+
+# All expressions of one histogram of a ttreeDrawer side car file
+def specExpressions(histOps):
+
+    return splitVariable(histOps["variable"]) + [f"({histOps['weight']})*({histOps['selection']})"]
@@ -0,0 +1,83 @@
+#! /bin/env/python
+
+import os
+import json
+import pickle
+import hashlib
+
+# On-disk cache of the histograms filled from one input file for one entry
+# of a ttreeDrawer side car file. An entry is keyed by the path, size and
+# modification time of the input file together with a hash of the histogram
+# specification, so a new or rewritten input file or an edited specification
+# simply misses the cache. Entries are pickled dictionaries of BinnedHisto by
+# name and the least recently used ones are evicted beyond maxBytes
+#    cacheDir : directory holding the cache entries
+#    maxBytes : total size of the cache entries to keep at most
+class HistoCache:
+
+    def __init__(self, cacheDir, maxBytes):
+
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+
+        os.makedirs(self.cacheDir, exist_ok=True)
+
+    @staticmethod
+    def specHash(histOps, defaultTree):
+
+        spec = dict(histOps)
+        spec.setdefault("tree", defaultTree)
+
+        return hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()
+
+    def path(self, inputFile, histOps, defaultTree):
+
+        stat = os.stat(inputFile)
+        key  = f"{os.path.abspath(inputFile)}:{stat.st_size}:{stat.st_mtime_ns}:{self.specHash(histOps, defaultTree)}"
+        key  = hashlib.sha256(key.encode()).hexdigest()
+
+        return f"{self.cacheDir}/{key[:2]}/{key}.pkl"
+
+    # Return the cached histograms or None, a hit refreshes the entry for the LRU eviction
+    def get(self, inputFile, histOps, defaultTree):
+
+        path = self.path(inputFile, histOps, defaultTree)
+        try:
+            with open(path, "rb") as cacheFile:
+                histos = pickle.load(cacheFile)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+        os.utime(path)
+
+        return histos
+
+    # Store the histograms, written to a temporary file first so that
+    # concurrent pool processes never see a partially written entry
+    def put(self, inputFile, histOps, defaultTree, histos):
+
+        path = self.path(inputFile, histOps, defaultTree)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tempPath = f"{path}.{os.getpid()}.tmp"
+        with open(tempPath, "wb") as cacheFile:
+            pickle.dump(histos, cacheFile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tempPath, path)
+
+    # Remove the least recently used entries until the cache fits in maxBytes
+    def evict(self):
+
+        entries = []
+        for directory, _, fileNames in os.walk(self.cacheDir):
+            for fileName in fileNames:
+                if fileName.endswith(".pkl"):
+                    path = f"{directory}/{fileName}"
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+        totalBytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if totalBytes <= self.maxBytes:
+                break
+            os.remove(path)
+            totalBytes -= size
@@ -0,0 +1,334 @@
+#! /bin/env/python
+
+import io
+import os
+import json
+import time
+import socket
+import argparse
+import threading
+import http.client
+import http.server
+import socketserver
+import collections
+
+import numpy as np
+
+import rootLoader
+import columnarEngine
+import columnarStore
+from formulaParser import FormulaError
+
+# Long-lived process answering histogram requests for one or more tags, where
+# a tag is either a directory of ntuples or a columnar dataset made with
+# columnarStore.py. Each branch is read only once when first needed and kept in
+# memory, the least recently used ones being dropped beyond a memory budget, so
+# trying a new selection takes a pass over in-memory arrays instead of starting
+# ROOT, a pool of processes and reading the files again. Requests are the dicts
+# of ttreeDrawer_aux.histograms, sent as JSON over HTTP on localhost or on a
+# Unix socket, and the histograms are returned as a .npz of their contents
+
+# Columns of all tags resident in memory, by (tag, tree, branch)
+#    tags     : dictionary of tag name to path
+#    maxBytes : memory budget for the columns
+class ColumnStore:
+
+    def __init__(self, tags, maxBytes):
+
+        self.tags     = tags
+        self.maxBytes = maxBytes
+        self.columns  = collections.OrderedDict()
+        self.lock     = threading.Lock()
+        self.datasets = {}
+
+        for tag, path in tags.items():
+            if os.path.exists(f"{path}/{columnarStore.SCHEMAFILE}"):
+                self.datasets[tag] = columnarStore.ColumnarDataset(path)
+
+    @property
+    def nBytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+    # Read one branch of a tag over all its files
+    def read(self, tag, treeName, branch):
+
+        if tag in self.datasets:
+            dataset = self.datasets[tag]
+            if treeName != dataset.tree:
+                raise ValueError(f"Dataset of tag \"{tag}\" holds \"{dataset.tree}\" and not \"{treeName}\"")
+            return dataset.concatenate(branch)
+
+        import uproot
+
+        arrays = []
+        for inputFile in rootLoader.inputFiles(self.tags[tag]):
+            with uproot.open(inputFile) as file:
+                arrays.append(file[treeName][branch].array(library="np"))
+
+        if not arrays:
+            raise ValueError(f"No input files found for tag \"{tag}\" in \"{self.tags[tag]}\"")
+
+        return np.concatenate(arrays)
+
+    # Number of entries of a tree of a tag, from the metadata only
+    def numEntries(self, tag, treeName):
+
+        if tag not in self.tags:
+            raise ValueError(f"Unknown tag \"{tag}\"")
+
+        if tag in self.datasets:
+            return self.datasets[tag].numEntries
+
+        import uproot
+
+        inputFiles = rootLoader.inputFiles(self.tags[tag])
+        if not inputFiles:
+            raise ValueError(f"No input files found for tag \"{tag}\" in \"{self.tags[tag]}\"")
+
+        nEntries = 0
+        for inputFile in inputFiles:
+            with uproot.open(inputFile) as file:
+                nEntries += file[treeName].num_entries
+
+        return nEntries
+
+    # The named branches of a tag, reading the missing ones and evicting the least
+    # recently used others so that all columns fit in the budget if possible
+    def get(self, tag, treeName, branches):
+
+        if tag not in self.tags:
+            raise ValueError(f"Unknown tag \"{tag}\"")
+
+        with self.lock:
+            keys = [(tag, treeName, branch) for branch in branches]
+            for key in keys:
+                if key in self.columns:
+                    self.columns.move_to_end(key)
+                    continue
+
+                column = self.read(*key)
+                while self.columns and self.nBytes + column.nbytes > self.maxBytes:
+                    oldest = next(iter(self.columns))
+                    if oldest in keys:
+                        break
+                    del self.columns[oldest]
+                self.columns[key] = column
+
+            if self.nBytes > self.maxBytes:
+                print(f"\033[1;31mWARNING: Columns needed for the request take {self.nBytes / 1024**2:.0f} MB, more than the memory budget\033[0m")
+
+            return {branch : self.columns[(tag, treeName, branch)] for branch in branches}
+
+# Fill the histograms of a request from the resident columns, chunkSize
+# entries at a time to bound the memory of the temporary float arrays
+def fillHistos(store, tag, histograms, defaultTree, chunkSize, directProjections=False):
+
+    perTree, perHisto = columnarEngine.bookHistos(histograms, defaultTree, directProjections)
+
+    for treeName, entries in perTree.items():
+        columns  = store.get(tag, treeName, sorted(columnarEngine.treeBranches(entries)))
+        nEntries = len(next(iter(columns.values()))) if columns else store.numEntries(tag, treeName)
+        for first, nChunk in zip(range(0, nEntries, chunkSize), columnarEngine.entryChunks(0, nEntries, chunkSize)):
+            chunk = {name : column[first:first + chunkSize] for name, column in columns.items()}
+            columnarEngine.fillChunk(entries, chunk, nChunk, tag)
+
+    return columnarEngine.finishHistos(perHisto, tag)
+
+# Histograms as one .npz, holding the contents of each and a JSON header with
+# their names, binning and entries, in the order of the request
+def packHistos(histos):
+
+    header = []
+    arrays = {}
+    for iEntry, final in enumerate(histos):
+        entry = []
+        for iHisto, (name, histo) in enumerate(final.items()):
+            entry.append({"name" : name, "axes" : histo.axes, "entries" : histo.entries})
+            arrays[f"sumw_{iEntry}_{iHisto}"]  = histo.sumw
+            arrays[f"sumw2_{iEntry}_{iHisto}"] = histo.sumw2
+        header.append(entry)
+
+    arrays["header"] = np.frombuffer(json.dumps(header).encode(), dtype=np.uint8)
+
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+
+    return buffer.getvalue()
+
+def unpackHistos(payload):
+
+    arrays = np.load(io.BytesIO(payload), allow_pickle=False)
+    header = json.loads(arrays["header"].tobytes().decode())
+
+    histos = []
+    for iEntry, entry in enumerate(header):
+        final = {}
+        for iHisto, info in enumerate(entry):
+            histo = columnarEngine.BinnedHisto(info["name"], info["axes"])
+            histo.sumw    = arrays[f"sumw_{iEntry}_{iHisto}"]
+            histo.sumw2   = arrays[f"sumw2_{iEntry}_{iHisto}"]
+            histo.entries = info["entries"]
+            final[info["name"]] = histo
+        histos.append(final)
+
+    return histos
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+
+    # Set on the server class before serving
+    store       = None
+    defaultTree = "analyzeTPs/tps"
+    chunkSize   = 5000000
+
+    # Clients on a Unix socket have no address
+    def address_string(self):
+        return self.client_address[0] if self.client_address else "local"
+
+    def reply(self, code, body, contentType="application/json"):
+
+        self.send_response(code)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+
+        if self.path != "/status":
+            self.reply(404, json.dumps({"error" : f"Unknown path \"{self.path}\""}).encode())
+            return
+
+        with self.store.lock:
+            status = {"tags"     : self.store.tags,
+                      "columns"  : [list(key) for key in self.store.columns],
+                      "bytes"    : self.store.nBytes,
+                      "maxBytes" : self.store.maxBytes}
+
+        self.reply(200, json.dumps(status).encode())
+
+    # The body is {"tag" : ..., "histograms" : [...], "directProjections" : false}
+    def do_POST(self):
+
+        if self.path != "/histograms":
+            self.reply(404, json.dumps({"error" : f"Unknown path \"{self.path}\""}).encode())
+            return
+
+        start = time.perf_counter()
+        try:
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            histos  = fillHistos(self.store, request["tag"], request["histograms"], self.defaultTree, self.chunkSize, request.get("directProjections", False))
+        except (ValueError, KeyError, OSError, FormulaError) as error:
+            self.reply(400, json.dumps({"error" : str(error)}).encode())
+            return
+
+        self.reply(200, packHistos(histos), "application/octet-stream")
+        print(f"Filled {sum(len(final) for final in histos)} histograms for tag \"{request['tag']}\" in {1000 * (time.perf_counter() - start):.0f} ms")
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, path):
+
+        super().__init__("localhost")
+        self.socketPath = path
+
+    def connect(self):
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socketPath)
+
+def connection(port, socketPath):
+
+    return UnixHTTPConnection(socketPath) if socketPath else http.client.HTTPConnection("127.0.0.1", port)
+
+# Ask a running server for the histograms of the given side car entries,
+# returning a list of dictionaries of BinnedHisto like columnarEngine.fillHistos,
+# or of ROOT histograms with root
+def query(tag, histograms, port=8765, socketPath=None, directProjections=False, root=False):
+
+    conn = connection(port, socketPath)
+    conn.request("POST", "/histograms", json.dumps({"tag" : tag, "histograms" : histograms, "directProjections" : directProjections}), {"Content-Type" : "application/json"})
+    response = conn.getresponse()
+    payload  = response.read()
+    conn.close()
+
+    if response.status != 200:
+        raise RuntimeError(json.loads(payload)["error"])
+
+    histos = unpackHistos(payload)
+    if root:
+        histos = [{name : histo.toROOT() for name, histo in final.items()} for final in histos]
+
+    return histos
+
+def status(port=8765, socketPath=None):
+
+    conn = connection(port, socketPath)
+    conn.request("GET", "/status")
+    response = conn.getresponse()
+    payload  = json.loads(response.read())
+    conn.close()
+
+    return payload
+
+def serve(tags, maxBytes, port, socketPath, defaultTree, chunkSize):
+
+    RequestHandler.store       = ColumnStore(tags, maxBytes)
+    RequestHandler.defaultTree = defaultTree
+    RequestHandler.chunkSize   = chunkSize
+
+    if socketPath:
+        if os.path.exists(socketPath):
+            os.remove(socketPath)
+        server = UnixHTTPServer(socketPath, RequestHandler)
+        where  = f"\"{socketPath}\""
+    else:
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", port), RequestHandler)
+        where  = f"http://127.0.0.1:{port}"
+
+    print(f"Serving histograms of tags {', '.join(tags)} on {where}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socketPath and os.path.exists(socketPath):
+            os.remove(socketPath)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode",                             help="run the server or query it",   choices=["serve", "query", "status"])
+    parser.add_argument("--tag",        dest="tags",        help="tag=path to ntuples or dataset (serve), tag (query)", action="append", default=[])
+    parser.add_argument("--port",       dest="port",        help="port on localhost",            default=8765, type=int  )
+    parser.add_argument("--socket",     dest="socket",      help="Unix socket instead of port",  default=None            )
+    parser.add_argument("--memory",     dest="memory",      help="MB of columns to keep",        default=8192, type=float)
+    parser.add_argument("--tree",       dest="tree",        help="default TTree name",           default="analyzeTPs/tps")
+    parser.add_argument("--chunkSize",  dest="chunkSize",   help="entries per chunk",            default=5000000, type=int)
+    parser.add_argument("--options",    dest="options",     help="histo options file",           default="ttreeDrawer_aux")
+    parser.add_argument("--outputFile", dest="outputFile",  help="path for output file",         default=None            )
+    parser.add_argument("--directProjections", dest="directProjections", help="fill projections directly", default=False, action="store_true")
+    args = parser.parse_args()
+
+    if args.mode == "serve":
+        tags = dict(tag.split("=", 1) for tag in args.tags)
+        if not tags:
+            parser.error("serve needs at least one --tag tag=path")
+        serve(tags, int(args.memory * 1024**2), args.port, args.socket, args.tree, args.chunkSize)
+
+    elif args.mode == "status":
+        print(json.dumps(status(args.port, args.socket), indent=1))
+
+    else:
+        if len(args.tags) != 1 or args.outputFile is None:
+            parser.error("query needs one --tag and an --outputFile")
+
+        start  = time.perf_counter()
+        histos = query(args.tags[0], __import__(args.options).histograms, args.port, args.socket, args.directProjections)
+        print(f"Received {sum(len(final) for final in histos)} histograms in {1000 * (time.perf_counter() - start):.0f} ms")
+
+        rootLoader.writeHistos(args.outputFile, [histo for final in histos for histo in final.values()])
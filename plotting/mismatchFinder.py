@@ -0,0 +1,236 @@
+#! /bin/env/python
+
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+
+import rootLoader
+from columnarEngine import NFG, BinnedHisto
+
+# Streams the tps tree and counts, per (ieta, iphi) tower, the TPs where the
+# packed and re-emulated TPs disagree: in ET or in one of the fine grain bits
+# (compared only when both TPs were found) or in whether they were found at
+# all. For every tower a uniform sample of at most sampleSize disagreeing TPs
+# is kept, with the run, lumi and event to go back to, by giving each a random
+# key and keeping the ones with the smallest keys. That keeps memory bounded
+# and lets the summaries of separate files be merged exactly
+#    sampleSize : number of disagreeing TPs to keep per tower
+#    seed       : seed of the random keys
+class MismatchSummary:
+
+    IETAMIN = -41
+    NIETA   = 83
+    NIPHI   = 73
+
+    KINDS = ["any", "et", "found"] + [f"fg{i}" for i in range(NFG)]
+
+    BRANCHES = ["run", "lumi", "event", "ieta", "iphi", "et_packed", "et_reemul", "found_packed", "found_reemul"] + \
+               [f"fg{i}_{kind}" for i in range(NFG) for kind in ["packed", "reemul"]]
+
+    # Columns kept for each sampled TP
+    SAMPLE = {"tower" : np.int64, "key" : np.float64, "file" : np.int32, "run" : np.uint32, "lumi" : np.uint16, "event" : np.uint64,
+              "kinds" : np.uint16, "et_packed" : np.float32, "et_reemul" : np.float32}
+
+    def __init__(self, sampleSize=10, seed=0):
+
+        self.sampleSize = sampleSize
+        self.rng        = np.random.default_rng(seed)
+
+        self.total      = np.zeros(self.NIETA * self.NIPHI, dtype=np.int64)
+        self.mismatches = np.zeros((len(self.KINDS), self.NIETA * self.NIPHI), dtype=np.int64)
+        self.sample     = {name : np.zeros(0, dtype=dtype) for name, dtype in self.SAMPLE.items()}
+
+    # Keep the sampleSize rows with the smallest keys of each tower
+    def keepSmallest(self, rows):
+
+        order = np.lexsort((rows["key"], rows["tower"]))
+        rows  = {name : column[order] for name, column in rows.items()}
+
+        tower  = rows["tower"]
+        starts = np.flatnonzero(np.r_[True, tower[1:] != tower[:-1]])
+        rank   = np.arange(len(tower)) - np.repeat(starts, np.diff(np.r_[starts, len(tower)]))
+        keep   = rank < self.sampleSize
+
+        return {name : column[keep] for name, column in rows.items()}
+
+    # Accumulate one chunk of the tps tree given as a dictionary of arrays
+    #    fileIndex : index of the input file the chunk comes from
+    def fill(self, chunk, fileIndex=0):
+
+        nRows = len(chunk["ieta"])
+        if nRows == 0:
+            return
+
+        tower     = (chunk["ieta"].astype(np.int64) - self.IETAMIN) * self.NIPHI + chunk["iphi"].astype(np.int64)
+        bothFound = (chunk["found_packed"] != 0) & (chunk["found_reemul"] != 0)
+
+        masks = {"et" : bothFound & (chunk["et_packed"] != chunk["et_reemul"]), "found" : (chunk["found_packed"] != 0) != (chunk["found_reemul"] != 0)}
+        for i in range(NFG):
+            masks[f"fg{i}"] = bothFound & (chunk[f"fg{i}_packed"] != chunk[f"fg{i}_reemul"])
+
+        kinds = np.zeros(nRows, dtype=np.uint16)
+        for bit, kind in enumerate(self.KINDS[1:]):
+            kinds |= masks[kind].astype(np.uint16) << bit
+        masks["any"] = kinds != 0
+
+        self.total += np.bincount(tower, minlength=len(self.total))
+        for iKind, kind in enumerate(self.KINDS):
+            self.mismatches[iKind] += np.bincount(tower[masks[kind]], minlength=len(self.total))
+
+        isMismatch = masks["any"]
+        if self.sampleSize <= 0 or not np.any(isMismatch):
+            return
+
+        rows = {"tower"     : tower[isMismatch],
+                "key"       : self.rng.random(int(np.count_nonzero(isMismatch))),
+                "file"      : np.full(int(np.count_nonzero(isMismatch)), fileIndex, dtype=np.int32),
+                "run"       : chunk["run"][isMismatch],
+                "lumi"      : chunk["lumi"][isMismatch],
+                "event"     : chunk["event"][isMismatch],
+                "kinds"     : kinds[isMismatch],
+                "et_packed" : chunk["et_packed"][isMismatch],
+                "et_reemul" : chunk["et_reemul"][isMismatch]}
+        rows = {name : rows[name].astype(dtype) for name, dtype in self.SAMPLE.items()}
+
+        self.sample = self.keepSmallest({name : np.concatenate([self.sample[name], rows[name]]) for name in self.SAMPLE})
+
+    def add(self, other):
+
+        self.total      += other.total
+        self.mismatches += other.mismatches
+        self.sample      = self.keepSmallest({name : np.concatenate([self.sample[name], other.sample[name]]) for name in self.SAMPLE})
+
+    # Towers with at least minTPs TPs, by decreasing rate of disagreement of any
+    # kind and then by number of disagreements, each with its counts and sampled TPs
+    #    inputFiles : input files, by the index the sample refers to them with
+    def ranking(self, inputFiles, minTPs=1, nTop=None):
+
+        anyMismatch = self.mismatches[0]
+        rate        = np.divide(anyMismatch, self.total, out=np.zeros(len(self.total)), where=self.total > 0)
+
+        towers = np.flatnonzero((anyMismatch > 0) & (self.total >= minTPs))
+        towers = towers[np.lexsort((-anyMismatch[towers], -rate[towers]))][:nTop]
+
+        sampled = {}
+        for iRow, tower in enumerate(self.sample["tower"]):
+            sampled.setdefault(int(tower), []).append(iRow)
+
+        ranking = []
+        for tower in towers:
+            events = []
+            for iRow in sampled.get(int(tower), []):
+                kinds = [kind for bit, kind in enumerate(self.KINDS[1:]) if int(self.sample["kinds"][iRow]) >> bit & 1]
+                events.append({"run"       : int(self.sample["run"][iRow]),
+                               "lumi"      : int(self.sample["lumi"][iRow]),
+                               "event"     : int(self.sample["event"][iRow]),
+                               "file"      : inputFiles[self.sample["file"][iRow]],
+                               "kinds"     : kinds,
+                               "et_packed" : float(self.sample["et_packed"][iRow]),
+                               "et_reemul" : float(self.sample["et_reemul"][iRow])})
+            events.sort(key=lambda event: (event["run"], event["lumi"], event["event"]))
+
+            ranking.append({"ieta"       : int(tower // self.NIPHI + self.IETAMIN),
+                            "iphi"       : int(tower % self.NIPHI),
+                            "tps"        : int(self.total[tower]),
+                            "rate"       : float(rate[tower]),
+                            "mismatches" : {kind : int(self.mismatches[iKind][tower]) for iKind, kind in enumerate(self.KINDS)},
+                            "events"     : events})
+
+        return ranking
+
+    # Maps of the number of disagreements of each kind and of the rate of any
+    # disagreement, binned like h_TP_ET_mismatch_map
+    def histograms(self):
+
+        axes = [(self.NIETA, self.IETAMIN - 0.5, self.IETAMIN + self.NIETA - 0.5), (self.NIPHI, -0.5, self.NIPHI - 0.5)]
+
+        histos = []
+        for iKind, kind in enumerate(self.KINDS):
+            counts = BinnedHisto(f"h_TP_mismatch_{kind}_map", axes)
+            counts.sumw[1:-1, 1:-1]  = self.mismatches[iKind].reshape(self.NIETA, self.NIPHI)
+            counts.sumw2[1:-1, 1:-1] = counts.sumw[1:-1, 1:-1]
+            counts.entries = int(self.mismatches[iKind].sum())
+            histos.append(counts)
+
+        total = self.total.reshape(self.NIETA, self.NIPHI)
+        rate  = np.divide(self.mismatches[0].reshape(self.NIETA, self.NIPHI), total, out=np.zeros(total.shape), where=total > 0)
+
+        rates = BinnedHisto("h_TP_mismatch_rate_map", axes)
+        rates.sumw[1:-1, 1:-1]  = rate
+        rates.sumw2[1:-1, 1:-1] = np.divide(rate * (1.0 - rate), total, out=np.zeros(total.shape), where=total > 0)
+        rates.entries = int(np.count_nonzero(total))
+        histos.append(rates)
+
+        return histos
+
+# Scan the tps tree of one input file, reading chunkSize entries at a time.
+# The sample refers to the file by its index in inputFiles
+def scanFile(inputFile, inputFiles, treeName, chunkSize, sampleSize, seed):
+
+    import uproot
+
+    start     = time.time()
+    fileIndex = inputFiles.index(inputFile)
+    summary = MismatchSummary(sampleSize, [seed, fileIndex])
+    with uproot.open(inputFile) as file:
+        tree = file[treeName]
+        for chunk in tree.iterate(MismatchSummary.BRANCHES, step_size=chunkSize, library="np"):
+            summary.fill(chunk, fileIndex)
+
+    return inputFile, summary, time.time() - start
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--inputDir",   dest="inputDir",   help="Path to ntuples",             required=True            )
+    parser.add_argument("--outputFile", dest="outputFile", help="path for ranking .json file", required=True            )
+    parser.add_argument("--rootFile",   dest="rootFile",   help="path for mismatch maps file", default=None             )
+    parser.add_argument("--tree",       dest="tree",       help="TTree name to scan",          default="analyzeTPs/tps" )
+    parser.add_argument("--chunkSize",  dest="chunkSize",  help="entries per chunk",           default=5000000, type=int)
+    parser.add_argument("--jobs",       dest="jobs",       help="number of processes",         default=os.cpu_count(), type=int)
+    parser.add_argument("--sampleSize", dest="sampleSize", help="events kept per tower",       default=10, type=int     )
+    parser.add_argument("--minTPs",     dest="minTPs",     help="TPs needed to rank a tower",  default=1, type=int      )
+    parser.add_argument("--top",        dest="top",        help="towers to print",             default=20, type=int     )
+    parser.add_argument("--seed",       dest="seed",       help="seed of the event sampling",  default=0, type=int      )
+    args = parser.parse_args()
+
+    inputFiles = rootLoader.inputFiles(args.inputDir)
+    if not inputFiles:
+        quit()
+
+    # The random keys of a file do not depend on the order the files are scanned in
+    sortedFiles = sorted(inputFiles)
+
+    start   = time.time()
+    summary = MismatchSummary(args.sampleSize)
+    for inputFile, fileSummary, seconds in rootLoader.mapFiles(scanFile, inputFiles, (sortedFiles, args.tree, args.chunkSize, args.sampleSize, args.seed), args.jobs):
+        summary.add(fileSummary)
+        print(f"Scanned \"{inputFile}\" with {fileSummary.total.sum()} TPs in {seconds:.1f} s")
+
+    ranking = summary.ranking(sortedFiles, args.minTPs)
+
+    nTPs = int(summary.total.sum())
+    print(f"Found {summary.mismatches[0].sum()} disagreeing TPs out of {nTPs} in {len(ranking)} towers in {time.time() - start:.1f} s")
+    print(", ".join(f"{kind}: {summary.mismatches[iKind].sum()}" for iKind, kind in enumerate(summary.KINDS[1:], 1)))
+
+    print(f"{'ieta':>5} {'iphi':>5} {'TPs':>10} {'any':>8} {'et':>8} {'found':>6} {'fg':>8} {'rate':>9}  example (run:lumi:event)")
+    for tower in ranking[:args.top]:
+        mismatches = tower["mismatches"]
+        fg         = sum(mismatches[f"fg{i}"] for i in range(NFG))
+        example    = ":".join(str(tower["events"][0][key]) for key in ["run", "lumi", "event"]) if tower["events"] else ""
+        print(f"{tower['ieta']:>5} {tower['iphi']:>5} {tower['tps']:>10} {mismatches['any']:>8} {mismatches['et']:>8} {mismatches['found']:>6} {fg:>8} {tower['rate']:>9.2e}  {example}")
+
+    rootLoader.makeParentDir(args.outputFile)
+
+    with open(args.outputFile, "w") as f:
+        json.dump({"tps"        : nTPs,
+                   "mismatches" : {kind : int(summary.mismatches[iKind].sum()) for iKind, kind in enumerate(summary.KINDS)},
+                   "towers"     : ranking}, f, indent=1)
+
+    print(f"Wrote ranking of {len(ranking)} towers to \"{args.outputFile}\"")
+
+    if args.rootFile:
+        rootLoader.writeHistos(args.rootFile, summary.histograms())
@@ -0,0 +1,188 @@
+#! /bin/env/python
+
+import os
+import time
+import argparse
+
+import numpy as np
+
+import rootLoader
+from columnarEngine import BinnedHisto
+
+# The occ tree of AnalyzeTPs has, for every event, one entry per ET threshold
+# and per tower ieta ring (plus the HB, HE and HF pseudo-rings stored as ieta
+# 42, 43 and 44) with the number of TPs at or above the threshold. This class
+# reduces it into dense arrays indexed [nVtx, ieta, et_thresh] holding, summed
+# over events, the occupancy and the squared occupancy for the packed and the
+# re-emulated TPs, together with the number of events per nVtx
+#    nVtxBins : initial number of nVtx bins, starting at nVtx = -1 (no vertices collection)
+class OccupancyCurves:
+
+    IETAMIN     = -41
+    IETAMAX     = 44
+    NIETABINS   = IETAMAX - IETAMIN + 1
+    NTHRESHBINS = 2 * 128 + 1
+    NVTXMIN     = -1
+
+    # Thresholds are in steps of the 0.5 GeV TP ET LSB
+    THRESHOLDS  = np.arange(NTHRESHBINS) / 2.0
+
+    # The HB pseudo-ring is filled for every event and every threshold,
+    # so its entry at threshold 0 is used to count events
+    EVENTIETA   = 42
+
+    KINDS = ["packed", "reemul"]
+
+    def __init__(self, nVtxBins=1):
+
+        self.sums    = {kind : np.zeros((nVtxBins, self.NIETABINS, self.NTHRESHBINS), dtype=np.int64) for kind in self.KINDS}
+        self.sums2   = {kind : np.zeros((nVtxBins, self.NIETABINS, self.NTHRESHBINS), dtype=np.int64) for kind in self.KINDS}
+        self.nEvents = np.zeros(nVtxBins, dtype=np.int64)
+
+    @property
+    def nVtxBins(self):
+        return len(self.nEvents)
+
+    # Extend the nVtx axis so that it holds at least nVtxBins bins
+    def grow(self, nVtxBins):
+
+        if nVtxBins <= self.nVtxBins:
+            return
+
+        extra = nVtxBins - self.nVtxBins
+        for kind in self.KINDS:
+            self.sums[kind]  = np.concatenate([self.sums[kind],  np.zeros((extra,) + self.sums[kind].shape[1:],  dtype=np.int64)])
+            self.sums2[kind] = np.concatenate([self.sums2[kind], np.zeros((extra,) + self.sums2[kind].shape[1:], dtype=np.int64)])
+        self.nEvents = np.concatenate([self.nEvents, np.zeros(extra, dtype=np.int64)])
+
+    # Accumulate one chunk of the occ tree given as a dictionary of arrays
+    def fill(self, chunk):
+
+        iVtx    = chunk["nVtx"].astype(np.int64) - self.NVTXMIN
+        iEta    = chunk["ieta"].astype(np.int64) - self.IETAMIN
+        iThresh = np.rint(2.0 * chunk["et_thresh"]).astype(np.int64)
+
+        if len(iVtx) == 0:
+            return
+
+        self.grow(int(iVtx.max()) + 1)
+
+        shape = (self.nVtxBins, self.NIETABINS, self.NTHRESHBINS)
+        size  = self.nVtxBins * self.NIETABINS * self.NTHRESHBINS
+        flat  = np.ravel_multi_index([iVtx, iEta, iThresh], shape)
+        for kind in self.KINDS:
+            occupancy = chunk[f"occu_{kind}"].astype(np.int64)
+            self.sums[kind]  += np.bincount(flat, weights=occupancy,             minlength=size).astype(np.int64).reshape(shape)
+            self.sums2[kind] += np.bincount(flat, weights=occupancy * occupancy, minlength=size).astype(np.int64).reshape(shape)
+
+        isEvent = (iEta == self.EVENTIETA - self.IETAMIN) & (iThresh == 0)
+        self.nEvents += np.bincount(iVtx[isEvent], minlength=self.nVtxBins)
+
+    def add(self, other):
+
+        self.grow(other.nVtxBins)
+        for kind in self.KINDS:
+            self.sums[kind][:other.nVtxBins]  += other.sums[kind]
+            self.sums2[kind][:other.nVtxBins] += other.sums2[kind]
+        self.nEvents[:other.nVtxBins] += other.nEvents
+
+    # Store the arrays as a single compressed .npz file
+    def save(self, outputFile):
+
+        arrays = {"nEvents" : self.nEvents, "thresholds" : self.THRESHOLDS, "axes" : np.array([self.NVTXMIN, self.IETAMIN, 0])}
+        for kind in self.KINDS:
+            arrays[f"sum_{kind}"]  = self.sums[kind]
+            arrays[f"sum2_{kind}"] = self.sums2[kind]
+
+        np.savez_compressed(outputFile, **arrays)
+
+    @classmethod
+    def load(cls, inputFile):
+
+        arrays = np.load(inputFile)
+
+        curves = cls(len(arrays["nEvents"]))
+        curves.nEvents = arrays["nEvents"]
+        for kind in cls.KINDS:
+            curves.sums[kind]  = arrays[f"sum_{kind}"]
+            curves.sums2[kind] = arrays[f"sum2_{kind}"]
+
+        return curves
+
+    # The histograms to be written to a ROOT file: for each TP kind, the summed
+    # occupancy versus threshold, ieta and nVtx and the mean occupancy per event
+    # versus threshold and ieta, plus the number of events versus nVtx
+    def histograms(self):
+
+        thresholdAxis = (self.NTHRESHBINS, -0.25, self.THRESHOLDS[-1] + 0.25)
+        ietaAxis      = (self.NIETABINS, self.IETAMIN - 0.5, self.IETAMAX + 0.5)
+        nVtxAxis      = (self.nVtxBins, self.NVTXMIN - 0.5, self.NVTXMIN + self.nVtxBins - 0.5)
+
+        histos = []
+
+        events = BinnedHisto("h_nEvents_nVtx", [nVtxAxis])
+        events.sumw[1:-1]  = self.nEvents
+        events.sumw2[1:-1] = self.nEvents
+        events.entries     = int(self.nEvents.sum())
+        histos.append(events)
+
+        nEvents = max(int(self.nEvents.sum()), 1)
+        for kind in self.KINDS:
+            # Arrays are [nVtx, ieta, threshold] while histogram axes are x, y, z
+            summed = BinnedHisto(f"h_occupancy_{kind}_thresh_ieta_nVtx", [thresholdAxis, ietaAxis, nVtxAxis])
+            summed.sumw[1:-1, 1:-1, 1:-1]  = self.sums[kind].transpose(2, 1, 0)
+            summed.sumw2[1:-1, 1:-1, 1:-1] = self.sums2[kind].transpose(2, 1, 0)
+            summed.entries = int(self.nEvents.sum())
+            histos.append(summed)
+
+            total  = self.sums[kind].sum(axis=0).transpose()
+            total2 = self.sums2[kind].sum(axis=0).transpose()
+            mean   = total / nEvents
+
+            average = BinnedHisto(f"h_occupancy_{kind}_thresh_ieta", [thresholdAxis, ietaAxis])
+            average.sumw[1:-1, 1:-1]  = mean
+            average.sumw2[1:-1, 1:-1] = np.maximum(total2 / nEvents - mean**2, 0.0) / nEvents
+            average.entries = int(self.nEvents.sum())
+            histos.append(average)
+
+        return histos
+
+# Reduce the occ tree of one input file, reading chunkSize entries at a time
+def convertFile(inputFile, treeName, chunkSize):
+
+    import uproot
+
+    start  = time.time()
+    curves = OccupancyCurves()
+    with uproot.open(inputFile) as file:
+        tree = file[treeName]
+        for chunk in tree.iterate(["nVtx", "ieta", "et_thresh", "occu_packed", "occu_reemul"], step_size=chunkSize, library="np"):
+            curves.fill(chunk)
+
+    return inputFile, curves, time.time() - start
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--inputDir",   dest="inputDir",   help="Path to ntuples",       required=True            )
+    parser.add_argument("--outputFile", dest="outputFile", help="path for .npz file",    required=True            )
+    parser.add_argument("--rootFile",   dest="rootFile",   help="path for histos file",  default=None             )
+    parser.add_argument("--tree",       dest="tree",       help="occupancy TTree name",  default="analyzeTPs/occ" )
+    parser.add_argument("--chunkSize",  dest="chunkSize",  help="entries per chunk",     default=5000000, type=int)
+    parser.add_argument("--jobs",       dest="jobs",       help="number of processes",   default=os.cpu_count(), type=int)
+    args = parser.parse_args()
+
+    inputFiles = rootLoader.inputFiles(args.inputDir)
+    if not inputFiles:
+        quit()
+
+    curves = OccupancyCurves()
+    for inputFile, fileCurves, seconds in rootLoader.mapFiles(convertFile, inputFiles, (args.tree, args.chunkSize), args.jobs):
+        curves.add(fileCurves)
+        print(f"Converted \"{inputFile}\" with {fileCurves.nEvents.sum()} events in {seconds:.1f} s")
+
+    rootLoader.makeParentDir(args.outputFile)
+    curves.save(args.outputFile)
+
+    if args.rootFile:
+        rootLoader.writeHistos(args.rootFile, curves.histograms())
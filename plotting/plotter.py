@@ -1,22 +1,69 @@
 #! /usr/bin/env python
 
 import os
+import html
+import json
 import math
+import hashlib
 import copy
 import string
-import random
 import argparse
 
-import ROOT
-ROOT.PyConfig.IgnoreCommandLineOptions = True
-ROOT.gROOT.SetBatch(True)
-ROOT.gStyle.SetOptStat("")
-ROOT.gStyle.SetPaintTextFormat("3.3f")
-ROOT.gStyle.SetFrameLineWidth(2)
-ROOT.gStyle.SetEndErrorSize(0)
-ROOT.TGaxis.SetMaxDigits(3)
-ROOT.TH1.SetDefaultSumw2()
-ROOT.TH2.SetDefaultSumw2()
+import profiling
+import rootLoader
+
+def setupROOT(ROOT):
+
+    ROOT.gStyle.SetOptStat("")
+    ROOT.gStyle.SetPaintTextFormat("3.3f")
+    ROOT.gStyle.SetFrameLineWidth(2)
+    ROOT.gStyle.SetEndErrorSize(0)
+    ROOT.TGaxis.SetMaxDigits(3)
+    ROOT.TH1.SetDefaultSumw2()
+    ROOT.TH2.SetDefaultSumw2()
+
+# Only imported once actually used, so that --help and mistakes in the
+# arguments or the options file are reported right away
+ROOT = rootLoader.LazyROOT(setupROOT)
+
+# Colors in the options file are either ROOT color indices or "#RRGGBB" strings
+def rootColor(color):
+
+    return ROOT.TColor.GetColor(color) if isinstance(color, str) else color
+
+# Check the histograms and categories of the options file without drawing
+# anything, returning a list of the problems found
+def validateOptions(histograms, categories):
+
+    problems = []
+    for histoName, histoInfo in histograms.items():
+        if histoInfo.get("dim") not in [1, 2]:
+            problems.append(f"Histogram \"{histoName}\" has dim {histoInfo.get('dim')}, only 1 or 2 are possible")
+        for axis in ["X", "Y"]:
+            if "title" not in histoInfo.get(axis, {}):
+                problems.append(f"Histogram \"{histoName}\" has no {axis} title")
+        for axis in ["X", "Y", "Z"]:
+            if "rebin" in histoInfo.get(axis, {}) and not (isinstance(histoInfo[axis]["rebin"], int) and histoInfo[axis]["rebin"] >= 1):
+                problems.append(f"Histogram \"{histoName}\" has bad {axis} rebin {histoInfo[axis]['rebin']}")
+
+    for categoryName, drawInfo in categories.items():
+        if "draw" not in drawInfo:
+            problems.append(f"Category \"{categoryName}\" has no draw option")
+        if "legend" in drawInfo and "ldraw" not in drawInfo:
+            problems.append(f"Category \"{categoryName}\" has a legend but no ldraw option")
+        for key in ["color", "lcolor"]:
+            color = drawInfo.get(key, 0)
+            if isinstance(color, str) and (len(color) != 7 or color[0] != "#" or any(digit not in string.hexdigits for digit in color[1:])):
+                problems.append(f"Category \"{categoryName}\" has {key} \"{color}\", not of the form \"#RRGGBB\"")
+            elif not isinstance(color, (str, int)):
+                problems.append(f"Category \"{categoryName}\" has {key} {color}, neither a ROOT color nor \"#RRGGBB\"")
+        if drawInfo.get("ratio", "num") not in ["num", "den"]:
+            problems.append(f"Category \"{categoryName}\" has ratio \"{drawInfo['ratio']}\", only \"num\" or \"den\" are possible")
+
+    if [drawInfo.get("ratio") for drawInfo in categories.values()].count("den") > 1:
+        problems.append("More than one category is the denominator of the ratio")
+
+    return problems
 
 # This class owns a histogram and can take a ROOT TH1 or
 # a path to extract the histogram from
@@ -133,11 +180,11 @@ class Histogram:
             self.histogram.GetYaxis().SetTitle(self.info["Y"]["title"])
 
             if "lcolor" in self.info:
-                self.histogram.SetLineColor(self.info["lcolor"])
-                self.histogram.SetMarkerColor(self.info["lcolor"])
+                self.histogram.SetLineColor(rootColor(self.info["lcolor"]))
+                self.histogram.SetMarkerColor(rootColor(self.info["lcolor"]))
             elif "color" in self.info:
-                self.histogram.SetLineColor(self.info["color"])
-                self.histogram.SetMarkerColor(self.info["color"])
+                self.histogram.SetLineColor(rootColor(self.info["color"]))
+                self.histogram.SetMarkerColor(rootColor(self.info["color"]))
 
             if "msize" in self.info:
                 self.histogram.SetMarkerSize(self.info["msize"])
@@ -149,7 +196,7 @@ class Histogram:
                 self.histogram.SetLineStyle(self.info["lstyle"])
     
             if "fill" in self.info and self.info["fill"] > 0.0 and "color" in self.info:
-                self.histogram.SetFillColorAlpha(self.info["color"], self.info["fill"])
+                self.histogram.SetFillColorAlpha(rootColor(self.info["color"]), self.info["fill"])
 
             if "fstyle" in self.info:
                 self.histogram.SetFillStyle(self.info["fstyle"])
@@ -176,6 +223,94 @@ class Histogram:
         else:
             self.histogram = -1
 
+# This class opens the ROOT file of each category once, indexes its keys
+# and hands out Histogram objects. Raw histograms are only read when first
+# asked for and the styled (and, if requested, normalized) Histogram objects
+# are memoized, so the same object is used for computing the maximum and
+# for drawing. Open files are not to be shared across processes, each pool
+# process makes its own store
+#    inpath    : path to the ROOT files, one per category
+#    normalize : normalize the histograms to unity area
+class HistogramStore:
+
+    def __init__(self, inpath, normalize):
+
+        self.inpath    = inpath
+        self.normalize = normalize
+
+        self.files      = {}
+        self.keys       = {}
+        self.histograms = {}
+
+    # Open the category file on first use and index the names of its keys
+    def open(self, categoryName):
+
+        if categoryName not in self.files:
+            filePath = f"{self.inpath}/{categoryName}.root"
+
+            with profiling.stage("open", filePath):
+                file = ROOT.TFile.Open(filePath, "READONLY")
+                if not file or file.IsZombie():
+                    print(f"\033[1;31mWARNING: Could not open file \"{filePath}\"\033[0m")
+                    file = None
+
+                self.files[categoryName] = file
+                self.keys[categoryName]  = {key.GetName() for key in file.GetListOfKeys()} if file else set()
+
+        return self.files[categoryName]
+
+    # The raw histogram, detached from its file, or None if it cannot be found.
+    # Only the top level keys are indexed, names with a directory or a cycle
+    # (dir/h, h;2) are left to the file to resolve
+    def raw(self, categoryName, histoName):
+
+        file = self.open(categoryName)
+        if file is None:
+            return None
+
+        if histoName not in self.keys[categoryName] and not any(separator in histoName for separator in "/;"):
+            print(f"\033[1;31mWARNING: Histo \"{histoName}\" not found in file \"{file.GetName()}\"\033[0m")
+            return None
+
+        with profiling.stage("read", file.GetName(), histoName):
+            histo = file.Get(histoName)
+            if histo == None:
+                print(f"\033[1;31mWARNING: Histo \"{histoName}\" not found in file \"{file.GetName()}\"\033[0m")
+                return None
+            histo.SetDirectory(0)
+
+        return histo
+
+    # The styled Histogram for a category, built once per panel scale
+    def get(self, categoryName, histoName, histoInfo, drawInfo, scale=1.0):
+
+        key = (categoryName, histoName, scale)
+        if key not in self.histograms:
+            histo = self.raw(categoryName, histoName)
+            if histo is None:
+                self.histograms[key] = None
+                return None
+
+            Hobj = Histogram(histo=histo, scale=scale, histoInfo=histoInfo, drawInfo=drawInfo)
+
+            integral = Hobj.Integral()
+            if self.normalize and integral != 0.0:
+                Hobj.Scale(1.0 / integral)
+
+            self.histograms[key] = Hobj
+
+        return self.histograms[key]
+
+    def close(self):
+
+        for file in self.files.values():
+            if file:
+                file.Close()
+
+        self.files      = {}
+        self.keys       = {}
+        self.histograms = {}
+
 # The Plotter class oversees the creation of all histograms
 #     official   : string are these plots approved, preliminary, wip, internal
 #     doRatio    : compute a ratio with the two specified histograms
@@ -185,8 +320,12 @@ class Histogram:
 #     normalize  : normalize all categories to unity area
 #     histograms : dictionary containing config info for desired histos
 #     categories : dictionary containing config info for desired categories
+#     jobs       : number of processes to render plots with
+#     output     : "pdf" for one PDF per plot, "book" for all plots as pages of
+#                  a single PDF or "png"/"svg" for images with an HTML index
+#     incremental: only render plots whose inputs or settings changed since the last run
 class Plotter:
-    def __init__(self, official, doRatio, year, outpath, inpath, normalize, histograms, categories):
+    def __init__(self, official, doRatio, year, outpath, inpath, normalize, histograms, categories, jobs=1, output="pdf", incremental=False):
 
         self.official   = official
         self.doRatio    = doRatio
@@ -196,6 +335,11 @@ class Plotter:
         self.normalize  = normalize
         self.histograms = histograms
         self.categories = categories
+        self.jobs       = jobs
+        self.output     = output
+        self.incremental = incremental
+        self.book       = None
+        self.store      = HistogramStore(self.inpath, self.normalize)
       
         os.makedirs(self.outpath, exist_ok=True)
 
@@ -211,11 +355,9 @@ class Plotter:
     # Create a canvas and determine if it should be split for a ratio plot
     # Margins are scaled on-the-fly so that distances are the same in either
     # scenario.
-    def makeCanvas(self, options):
-
-        randStr = f"{random.random():.8f}".replace(".","p")
+    def makeCanvas(self, options, name):
 
-        canvas = ROOT.TCanvas(randStr, randStr, 900, 900)
+        canvas = ROOT.TCanvas(f"c_{name}", f"c_{name}", 900, 900)
 
         # Split the canvas 70 / 30 by default if doing ratio
         # scale parameter keeps text sizes in ratio panel the
@@ -320,19 +462,14 @@ class Plotter:
         mark.DrawLatex(1 - self.RightMargin, 1 - (self.TopMargin - 0.017), f"{self.year} (13.6 TeV)")
 
 
-    def preProcess(self, histoCategories, histoName, histoInfo, theMax):
+    def preProcess(self, histoCategories, histoName, histoInfo, theMax, scale=1.0):
 
         newMax = theMax
-        # Preemptively get data counts to be used for normalzing the histograms later
+        # Preemptively get the (normalized) histograms, the same objects are drawn later
         for categoryName, drawInfo in histoCategories.items():
 
-            rootFile = "%s/%s.root"%(self.inpath, categoryName)
-
-            Hobj = Histogram(rootFile=rootFile, histoName=histoName, histoInfo=histoInfo, drawInfo=drawInfo)
-            if Hobj.IsGood():
-                if self.normalize:
-                    Hobj.Scale(1.0 / Hobj.Integral())
-
+            Hobj = self.store.get(categoryName, histoName, histoInfo, drawInfo, scale)
+            if Hobj:
                 tempMax = Hobj.histogram.GetMaximum()
                 if tempMax > newMax:
                     newMax = tempMax
@@ -340,141 +477,335 @@ class Plotter:
         return newMax
 
 
-    # Main function to compose the full stack plots
-    # with or without a ratio panel or two dimensional plost
-    def makePlots(self):
+    # Draw a two dimensional histogram for a single category
+    def makePlot2D(self, histoName, histoInfo, categoryName, drawInfo):
 
-        # Top loop begins going over each histo-to-be-plotted
-        for histoName, histoInfo in self.histograms.items():
+        Hobj = self.store.get(categoryName, histoName, histoInfo, drawInfo)
 
-            if histoInfo["dim"] == 2: 
-                # For a given histo, loop over all categories to plot
-                for categoryName, drawInfo in self.categories.items(): 
-                    rootFile = f"{self.inpath}/{categoryName}.root"
-    
-                    Hobj = Histogram(rootFile=rootFile, histoName=histoName, histoInfo=histoInfo, drawInfo=drawInfo)
+        if not Hobj: 
+            return None
 
-                    if Hobj.IsGood(): 
-                        if self.normalize:
-                            Hobj.Scale(1.0 / Hobj.Integral())
+        canvas = self.makeCanvas(histoInfo, f"{categoryName}_{histoName}")
+        canvas.cd()
 
-                        canvas = self.makeCanvas(histoInfo)
-                        canvas.cd()
+        Hobj.histogram.SetContour(255)
+        Hobj.Draw(canvas)
+        self.addCMSlogo(canvas)
+        saved = self.save(canvas, self.plotName(histoName, categoryName))
 
-                        Hobj.histogram.SetContour(255)
-                        Hobj.Draw(canvas)
-                        self.addCMSlogo(canvas)
-                        saveName = f"{self.outpath}/{categoryName}_{histoName}"
-                        if self.normalize:
-                            saveName += "_norm"
-                        canvas.SaveAs(f"{saveName}.pdf")
+        canvas.Close()
 
-            elif histoInfo["dim"] == 1:
-                canvas = self.makeCanvas(histoInfo)
-                if self.doRatio:
-                    canvas.cd(1)
+        return saved
+
+    # Compose the full stack plot of a one dimensional histogram
+    # for all categories, with or without a ratio panel
+    def makePlot1D(self, histoName, histoInfo):
+
+        canvas = self.makeCanvas(histoInfo, histoName)
+        if self.doRatio:
+            canvas.cd(1)
+        else:
+            canvas.cd()
+
+        firstDraw = False
+        dummy     = None
+
+        nLegendEntries = 0
+
+        theMax = 0.0
+        theMax = self.preProcess(self.categories, histoName, histoInfo, theMax, self.upperSplit)
+        theMin = histoInfo["Y"]["min"] if "min" in histoInfo["Y"] else 0.0
+
+        # Loop over histos that could be stacked and get their respective histo, scale if necessary
+        option = "HIST"; loption = "F"
+        histos = []
+        aStack = ROOT.THStack(f"{histoName}_stack", f"{histoName}_stack")
+        histosToRatio = {"num" : None, "den" : None}
+        for categoryName, drawInfo in self.categories.items(): 
+
+            if "option"  not in drawInfo: drawInfo["option"]  = option
+            if "loption" not in drawInfo: drawInfo["loption"] = loption
+
+            Hobj = self.store.get(categoryName, histoName, histoInfo, drawInfo, self.upperSplit)
+
+            if Hobj: 
+                if "stack" in drawInfo and drawInfo["stack"]:
+                    aStack.Add(Hobj.histogram)
                 else:
-                    canvas.cd()
+                    histos.append(Hobj)
+                    if "ratio" in drawInfo:
+                        histosToRatio[drawInfo["ratio"]] = Hobj
+                dummy = Hobj.Clone("dummy%s"%(histoName))
+                dummy.Reset("ICESM")
+                dummy.SetLineWidth(0)
+                dummy.SetMarkerStyle(8)
+                dummy.SetMarkerSize(0)
 
-                firstDraw = False
-                dummy     = None
-    
-                nLegendEntries = 0
+            nLegendEntries += 1
 
-                theMax = 0.0
-                theMax = self.preProcess(self.categories, histoName, histoInfo, theMax)
-                theMin = histoInfo["Y"]["min"] if "min" in histoInfo["Y"] else 0.0
+        legend, yMax = self.makeLegend(len(self.categories), theMin, theMax, histoInfo["logY"])
 
-                # Loop over histos that could be stacked and get their respective histo, scale if necessary
-                option = "HIST"; loption = "F"
-                histos = []
-                aStack = ROOT.THStack(f"{histoName}_stack", f"{histoName}_stack")
-                histosToRatio = {"num" : None, "den" : None}
-                for categoryName, drawInfo in self.categories.items(): 
+        if "max" not in histoInfo["Y"]:
+            dummy.SetMaximum(yMax)
+        else:
+            dummy.SetMaximum(histoInfo["Y"]["max"])
+        dummy.SetMinimum(theMin)
+        dummy.Draw()
 
-                    rootFile = "%s/%s.root"%(self.inpath, categoryName)
-    
-                    if "option"  not in drawInfo: drawInfo["option"]  = option
-                    if "loption" not in drawInfo: drawInfo["loption"] = loption
-
-                    Hobj = Histogram(rootFile=rootFile, scale=self.upperSplit, histoName=histoName, histoInfo=histoInfo, drawInfo=drawInfo)
-
-                    if Hobj.IsGood(): 
-                        scale = Hobj.Integral()
-                        if self.normalize and scale != 0.0:
-                            Hobj.Scale(1.0 / scale)
-
-                        if "stack" in drawInfo and drawInfo["stack"]:
-                            aStack.Add(Hobj.histogram)
-                        else:
-                            histos.append(Hobj)
-                            if "ratio" in drawInfo:
-                                histosToRatio[drawInfo["ratio"]] = Hobj
-                        dummy = Hobj.Clone("dummy%s"%(histoName))
-                        dummy.Reset("ICESM")
-                        dummy.SetLineWidth(0)
-                        dummy.SetMarkerStyle(8)
-                        dummy.SetMarkerSize(0)
-    
-                    nLegendEntries += 1
+        drewAlready = True 
+        if aStack.GetNhists() > 0:
+            aStack.Draw("HIST")
+            drewAlready = True
+
+        for histo in histos:
+            drewAlready = histo.Draw(canvas, drewAlready, legend)
+
+        if nLegendEntries != 0:
+            legend.Draw("SAME")
+
+        self.addCMSlogo(canvas)
+
+        # Here we go into bottom panel if drawing the ratio
+        if self.doRatio:
+
+            ratio = histosToRatio["num"].Clone(f"{histosToRatio['num'].histogram.GetName()}_ratio")
+            #ratio.Reset()
+            #ratio.Add(histosToRatio["num"].histogram, histosToRatio["den"].histogram, 1.0, -1.0)
+            ratio.Divide(histosToRatio["den"].histogram)
+            rDrawInfo = {"color" : ROOT.kBlack,  "lstyle" : 1, "mstyle" : 8, "lsize" : 3, "msize" : 1 / self.upperSplit}
+            rHistoInfo = copy.deepcopy(histoInfo)
+            rHistoInfo["Y"]["title"] = histoInfo["Y"]["rtitle"]
+
+            line = ROOT.TLine(ratio.GetXaxis().GetXmin(), 1.0, ratio.GetXaxis().GetXmax(), 1.0)
+            line.SetLineColor(ROOT.kBlue+3)
+            line.SetLineWidth(2)
+            line.SetLineStyle(2)
+
+            canvas.cd(2)
+            ROOT.gPad.SetLogy()
+            ROOT.gPad.SetGridy()
+            ratio = Histogram(histo=ratio, scale=self.upperSplit/self.scale, lowerSplit=self.lowerSplit/self.scale, histoInfo=rHistoInfo, drawInfo=rDrawInfo).histogram
+
+            if "rmin" in histoInfo["Y"]:
+                ratio.SetMinimum(histoInfo["Y"]["rmin"])
+            if "rmax" in histoInfo["Y"]:
+                ratio.SetMaximum(histoInfo["Y"]["rmax"])
+            ratio.GetYaxis().SetNdivisions(5, 5, 0)
+
+            ratio.Draw("E0P")
+            line.Draw("SAME")
+            ratio.Draw("E0P SAME")
+
+        saved = self.save(canvas, self.plotName(histoName))
+
+        canvas.Close()
+
+        return saved
+
+    # The name of a plot, 2D histograms are plotted per category
+    def plotName(self, histoName, categoryName=None):
+
+        plotName = histoName if categoryName is None else f"{categoryName}_{histoName}"
+        if self.normalize:
+            plotName += "_norm"
+
+        return plotName
+
+    # The file a plot is written to
+    def savePath(self, plotName):
+
+        if self.output == "book":
+            return f"{self.outpath}/plots{'_norm' if self.normalize else ''}.pdf"
+
+        return f"{self.outpath}/{plotName}.{self.output}"
+
+    # Write the canvas either to its own file in the output format
+    # or as a new page, titled with the plot name, of the open PDF book
+    def save(self, canvas, plotName):
+
+        if self.book:
+            with profiling.stage("save", spec=plotName):
+                canvas.Print(self.book, f"Title:{plotName}")
+            return plotName
+
+        saveName = self.savePath(plotName)
+        with profiling.stage("save", spec=plotName):
+            canvas.Print(saveName)
 
-                legend, yMax = self.makeLegend(len(self.categories), theMin, theMax, histoInfo["logY"])
+        return saveName
 
-                if "max" not in histoInfo["Y"]:
-                    dummy.SetMaximum(yMax)
+    # Hash of everything a plot depends on: the size and modification time of the
+    # input files, the histogram and category settings and the command line flags
+    def fingerprint(self, histoName, categoryName):
+
+        categories = self.categories if categoryName is None else {categoryName : self.categories[categoryName]}
+
+        inputs = {}
+        for name in categories:
+            try:
+                stat = os.stat(f"{self.inpath}/{name}.root")
+                inputs[name] = [stat.st_size, stat.st_mtime_ns]
+            except OSError:
+                inputs[name] = None
+
+        state = {"histoInfo" : self.histograms[histoName],
+                 "drawInfo"  : categories,
+                 "inputs"    : inputs,
+                 "flags"     : [self.official, self.doRatio, self.year, self.normalize, self.output]}
+
+        return hashlib.sha256(json.dumps(state, sort_keys=True, default=str).encode()).hexdigest()
+
+    def fingerprintsPath(self):
+        return f"{self.outpath}/.fingerprints.json"
+
+    def loadFingerprints(self):
+
+        try:
+            with open(self.fingerprintsPath()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def saveFingerprints(self, fingerprints):
+
+        with open(self.fingerprintsPath(), "w") as f:
+            json.dump(fingerprints, f, indent=1, sort_keys=True)
+
+    # Write an HTML page showing all images, in the order they were made
+    def writeIndex(self, saved):
+
+        indexName = f"{self.outpath}/index.html"
+        with open(indexName, "w") as index:
+            index.write("<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n")
+            index.write(f"<title>{html.escape(self.outpath)}</title>\n")
+            index.write("<style>figure { display: inline-block; margin: 8px; } img { width: 450px; }</style>\n")
+            index.write("</head>\n<body>\n")
+            for saveName in saved:
+                if saveName is None:
+                    continue
+                fileName = html.escape(os.path.basename(saveName))
+                plotName = html.escape(os.path.splitext(os.path.basename(saveName))[0])
+                index.write(f"<figure><a href=\"{fileName}\"><img src=\"{fileName}\" alt=\"{plotName}\"></a><figcaption>{plotName}</figcaption></figure>\n")
+            index.write("</body>\n</html>\n")
+
+        return indexName
+
+    # Render one job, either a 1D histogram (categoryName is None)
+    # or a 2D histogram for a single category
+    # When profiling, the "plot" stage includes the "read" and "save" stages of the plot
+    def makePlot(self, histoName, categoryName):
+
+        histoInfo = self.histograms[histoName]
+        with profiling.stage("plot", spec=self.plotName(histoName, categoryName)):
+            if categoryName is None:
+                return self.makePlot1D(histoName, histoInfo)
+
+            return self.makePlot2D(histoName, histoInfo, categoryName, self.categories[categoryName])
+
+    # Main function to compose the full stack plots
+    # with or without a ratio panel or two dimensional plost.
+    # Every 1D histogram and every (2D histogram, category) pair is an
+    # independent job and, with more than one job, they are spread over a
+    # pool of processes each holding its own copy of this Plotter
+    def makePlots(self):
+
+        jobs = []
+        for histoName, histoInfo in self.histograms.items():
+            if histoInfo["dim"] == 2: 
+                jobs += [(histoName, categoryName) for categoryName in self.categories]
+            elif histoInfo["dim"] == 1:
+                jobs.append((histoName, None))
+
+        # In incremental mode, the plots whose fingerprint is the same as when they
+        # were last written, and whose file is still there, are not rendered again.
+        # Fingerprints are taken before rendering, which can add defaults to drawInfo
+        previous     = self.loadFingerprints() if self.incremental else {}
+        fingerprints = {}
+        toRender     = []
+        for job in jobs:
+            key = f"{self.plotName(*job)}.{self.output}"
+            if self.incremental:
+                fingerprints[key] = self.fingerprint(*job)
+            if not self.incremental or previous.get(key) != fingerprints[key] or not os.path.exists(self.savePath(self.plotName(*job))):
+                toRender.append(job)
+
+        # The book is a single file, so it is written again as a whole if any page changed
+        if self.output == "book" and toRender:
+            toRender = jobs
+
+        if self.incremental:
+            print(f"Rendering {len(toRender)} of {len(jobs)} plots, the others are unchanged")
+
+        rendered = dict(zip(toRender, self.renderJobs(toRender)))
+        saved    = [rendered[job] if job in rendered else (self.plotName(*job) if self.output == "book" else self.savePath(self.plotName(*job))) for job in jobs]
+
+        if self.incremental:
+            for job in jobs:
+                key = f"{self.plotName(*job)}.{self.output}"
+                if job in rendered and rendered[job] is None:
+                    previous.pop(key, None)
                 else:
-                    dummy.SetMaximum(histoInfo["Y"]["max"])
-                dummy.SetMinimum(theMin)
-                dummy.Draw()
+                    previous[key] = fingerprints[key]
+            self.saveFingerprints(previous)
+
+        if self.output in ["png", "svg"]:
+            self.writeIndex(saved)
+
+        if profiling.enabled():
+            profiling.report(f"{self.outpath}/profile.json")
+
+        return saved
+
+    def renderJobs(self, jobs):
 
-                drewAlready = True 
-                if aStack.GetNhists() > 0:
-                    aStack.Draw("HIST")
-                    drewAlready = True
+        # All pages of the book are written in turn to the same file by this process
+        if self.output == "book":
+            if not jobs:
+                return []
 
-                for histo in histos:
-                    drewAlready = histo.Draw(canvas, drewAlready, legend)
+            self.book = self.savePath(None)
 
-                if nLegendEntries != 0:
-                    legend.Draw("SAME")
+            canvas = ROOT.TCanvas("c_book", "c_book", 900, 900)
+            canvas.Print(f"{self.book}[")
+            saved = [self.makePlot(*job) for job in jobs]
+            canvas.Print(f"{self.book}]")
+            canvas.Close()
 
-                self.addCMSlogo(canvas)
+            self.store.close()
+            self.book = None
+            return saved
 
-                # Here we go into bottom panel if drawing the ratio
-                if self.doRatio:
+        if self.jobs <= 1 or len(jobs) <= 1:
+            saved = [self.makePlot(*job) for job in jobs]
+            self.store.close()
+            return saved
 
-                    ratio = histosToRatio["num"].Clone(f"{histosToRatio['num'].histogram.GetName()}_ratio")
-                    #ratio.Reset()
-                    #ratio.Add(histosToRatio["num"].histogram, histosToRatio["den"].histogram, 1.0, -1.0)
-                    ratio.Divide(histosToRatio["den"].histogram)
-                    rDrawInfo = {"color" : ROOT.kBlack,  "lstyle" : 1, "mstyle" : 8, "lsize" : 3, "msize" : 1 / self.upperSplit}
-                    rHistoInfo = copy.deepcopy(histoInfo)
-                    rHistoInfo["Y"]["title"] = histoInfo["Y"]["rtitle"]
+        with rootLoader.pool(min(self.jobs, len(jobs)), initializer=initWorker, initargs=(self,)) as pool:
+            results = pool.starmap(renderJob, jobs)
 
-                    line = ROOT.TLine(ratio.GetXaxis().GetXmin(), 1.0, ratio.GetXaxis().GetXmax(), 1.0)
-                    line.SetLineColor(ROOT.kBlue+3)
-                    line.SetLineWidth(2)
-                    line.SetLineStyle(2)
+        saved = []
+        for plotSaved, records in results:
+            saved.append(plotSaved)
+            profiling.add(records)
 
-                    canvas.cd(2)
-                    ROOT.gPad.SetLogy()
-                    ROOT.gPad.SetGridy()
-                    ratio = Histogram(histo=ratio, scale=self.upperSplit/self.scale, lowerSplit=self.lowerSplit/self.scale, histoInfo=rHistoInfo, drawInfo=rDrawInfo).histogram
+        return saved
 
-                    if "rmin" in histoInfo["Y"]:
-                        ratio.SetMinimum(histoInfo["Y"]["rmin"])
-                    if "rmax" in histoInfo["Y"]:
-                        ratio.SetMaximum(histoInfo["Y"]["rmax"])
-                    ratio.GetYaxis().SetNdivisions(5, 5, 0)
+# Each pool process gets its own Plotter and fresh ROOT batch state
+_workerPlotter = None
 
-                    ratio.Draw("E0P")
-                    line.Draw("SAME")
-                    ratio.Draw("E0P SAME")
+def initWorker(plotter):
 
-                saveName = f"{self.outpath}/{histoName}"
-                if self.normalize:
-                    saveName += "_norm"
-                canvas.Print(f"{saveName}.pdf")
+    global _workerPlotter
+    _workerPlotter = plotter
+    _workerPlotter.store = HistogramStore(plotter.inpath, plotter.normalize)
+
+    ROOT.gROOT.SetBatch(True)
+    ROOT.gROOT.GetListOfCanvases().Delete()
+
+# The profiling records of the job are returned along with the saved plot
+def renderJob(histoName, categoryName):
+
+    return _workerPlotter.makePlot(histoName, categoryName), profiling.collect()
 
 
 if __name__ == "__main__":
@@ -488,18 +819,37 @@ if __name__ == "__main__":
     parser.add_argument("--outpath",      dest="outpath",      help="Where to put plots",     default="NULL",        required=True)
     parser.add_argument("--year",         dest="year",         help="which year",             default="Run3",        type=str)
     parser.add_argument("--options",      dest="options",      help="options file",           default="plotter_aux", type=str)
+    parser.add_argument("--jobs",         dest="jobs",         help="processes for plotting", default=os.cpu_count(), type=int)
+    parser.add_argument("--output",       dest="output",       help="output format",          default="pdf",         choices=["pdf", "book", "png", "svg"])
+    parser.add_argument("--incremental",  dest="incremental",  help="only redo changed plots", default=False,        action="store_true")
+    parser.add_argument("--profile",      dest="profile",      help="report time per stage",  default=False,         action="store_true")
     args = parser.parse_args()
 
+    if args.profile:
+        profiling.enable()
+
     # The auxiliary file contains many "hardcoded" items
     # describing which histograms to get and how to draw
     # them. These things are changed often by the user
     # and thus are kept in separate sidecar file.
-    importedGoods = __import__(args.options)
+    try:
+        importedGoods = __import__(args.options)
+    except (ImportError, SyntaxError) as e:
+        parser.error(f"Could not import options file \"{args.options}\" with reason {e}")
 
     # Names of histograms, rebinning, titles, ranges, etc.
-    histograms      = importedGoods.histograms
+    histograms      = getattr(importedGoods, "histograms", None)
+
+    categories = getattr(importedGoods, "categories", None)
+
+    if not isinstance(histograms, dict) or not isinstance(categories, dict):
+        parser.error(f"Options file \"{args.options}\" needs histograms and categories dictionaries")
 
-    categories = importedGoods.categories
+    problems = validateOptions(histograms, categories)
+    for problem in problems:
+        print(f"\033[1;31mWARNING: {problem}\033[0m")
+    if problems:
+        parser.error(f"Options file \"{args.options}\" has {len(problems)} problems")
 
-    plotter = Plotter(args.official, args.doRatio, args.year, args.outpath, args.inpath, args.normalize, histograms, categories)
+    plotter = Plotter(args.official, args.doRatio, args.year, args.outpath, args.inpath, args.normalize, histograms, categories, args.jobs, args.output, args.incremental)
     plotter.makePlots()
@@ -0,0 +1,125 @@
+#! /bin/env/python
+
+import json
+import time
+import resource
+import contextlib
+
+# Opt-in instrumentation shared by ttreeDrawer and plotter. Code is wrapped in
+# named stages, optionally labelled with the input file and the histogram (spec)
+# they work on, and for each one the wall and CPU time, the bytes read by the
+# process and its peak RSS are recorded. Records are plain dictionaries so that
+# pool processes can ship them back to the parent, which aggregates them all.
+# While profiling is not enabled, stages record nothing
+_enabled = False
+_records = []
+
+def enable():
+
+    global _enabled
+    _enabled = True
+
+def enabled():
+    return _enabled
+
+# Total bytes read by this process, including those read over the network, or
+# None where /proc is not available
+def bytesRead():
+
+    try:
+        with open("/proc/self/io") as io:
+            for line in io:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return None
+
+# Peak resident set size of this process in bytes
+def peakRSS():
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+@contextlib.contextmanager
+def stage(name, inputFile=None, spec=None):
+
+    if not _enabled:
+        yield
+        return
+
+    startWall  = time.perf_counter()
+    startCPU   = time.process_time()
+    startBytes = bytesRead()
+    try:
+        yield
+    finally:
+        stopBytes = bytesRead()
+        _records.append({"stage"   : name,
+                         "file"    : inputFile,
+                         "spec"    : spec,
+                         "wall"    : time.perf_counter() - startWall,
+                         "cpu"     : time.process_time() - startCPU,
+                         "bytes"   : stopBytes - startBytes if startBytes is not None and stopBytes is not None else 0,
+                         "peakRSS" : peakRSS()})
+
+# Hand over the records made so far in this process, e.g. to return them from a pool process
+def collect():
+
+    global _records
+    records, _records = _records, []
+
+    return records
+
+# Add the records collected in another process
+def add(records):
+
+    _records.extend(records)
+
+# Sum the records by the given key (stage, file or spec), the peak RSS is the largest seen
+def aggregate(records, key):
+
+    totals = {}
+    for record in records:
+        if record[key] is None:
+            continue
+        total = totals.setdefault(record[key], {"calls" : 0, "wall" : 0.0, "cpu" : 0.0, "bytes" : 0, "peakRSS" : 0})
+        total["calls"]   += 1
+        total["wall"]    += record["wall"]
+        total["cpu"]     += record["cpu"]
+        total["bytes"]   += record["bytes"]
+        total["peakRSS"]  = max(total["peakRSS"], record["peakRSS"])
+
+    return dict(sorted(totals.items(), key=lambda item: -item[1]["wall"]))
+
+# Readable tables of the time spent per stage and in the slowest files and histograms
+def summary(records, nTop=10):
+
+    lines = []
+    for key, title in [("stage", "stage"), ("file", "input file"), ("spec", "histogram")]:
+        totals = aggregate(records, key)
+        if not totals:
+            continue
+
+        width = min(max([len(title)] + [len(str(name)) for name in totals]), 60)
+        lines.append(f"{title:<{width}} {'calls':>7} {'wall [s]':>10} {'cpu [s]':>10} {'read [MB]':>10} {'peak RSS [MB]':>14}")
+        for name, total in list(totals.items())[:nTop if key != "stage" else None]:
+            name = str(name) if len(str(name)) <= width else "..." + str(name)[-(width - 3):]
+            lines.append(f"{name:<{width}} {total['calls']:>7} {total['wall']:>10.2f} {total['cpu']:>10.2f} {total['bytes'] / 1024**2:>10.1f} {total['peakRSS'] / 1024**2:>14.1f}")
+        lines.append("")
+
+    return "\n".join(lines)
+
+# Write all records and their aggregates to a JSON file and print the summary
+def report(outputFile, records=None):
+
+    records = _records if records is None else records
+
+    with open(outputFile, "w") as f:
+        json.dump({"stages"  : aggregate(records, "stage"),
+                   "files"   : aggregate(records, "file"),
+                   "specs"   : aggregate(records, "spec"),
+                   "records" : records}, f, indent=1)
+
+    print(summary(records))
+    print(f"Wrote profile to \"{outputFile}\"")
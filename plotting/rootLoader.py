@@ -0,0 +1,120 @@
+#! /bin/env/python
+
+import os
+import glob
+import multiprocessing as mp
+
+import profiling
+from formulaParser import FormulaError, compileFormula
+
+# Importing ROOT takes seconds, which --help, a bad argument or a mistake in
+# an options file should not have to wait for. Scripts refer to ROOT through a
+# LazyROOT, which only imports it when one of its attributes is first used and
+# then applies the batch mode and the given setup (style, Sumw2 defaults, ...)
+#    setup : function called with the ROOT module once it is imported
+class LazyROOT:
+
+    def __init__(self, setup=None):
+
+        self._module = None
+        self._setup  = setup
+
+    def load(self):
+
+        if self._module is None:
+            import ROOT
+            ROOT.PyConfig.IgnoreCommandLineOptions = True
+            ROOT.gROOT.SetBatch(True)
+            if self._setup is not None:
+                self._setup(ROOT)
+            self._module = ROOT
+
+        return self._module
+
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+# Forkserver workers start from a fresh import of every module rather than a
+# copy of the parent, so what the parent set up at run time is redone here:
+# profiling is enabled if it is in the parent and the given expressions are
+# parsed into the compileFormula cache, before the initializer of the caller
+def initWorker(profile, expressions, initializer, initargs):
+
+    if profile:
+        profiling.enable()
+
+    # Expressions that do not parse are reported where they are used
+    for expression in expressions:
+        try:
+            compileFormula(expression)
+        except FormulaError:
+            pass
+
+    if initializer is not None:
+        initializer(*initargs)
+
+# Pool of processes that are forked from a server process which imported and
+# initialized ROOT once (see rootPreload.py), so that every worker starts with
+# the same clean ROOT state rather than with a copy of whatever the parent did,
+# or paying for the import again. Without preload, workers that do not need
+# ROOT never import it. Where forkserver is not available, the default start
+# method is used
+#    expressions : formulas to parse in every worker up front
+def pool(processes, initializer=None, initargs=(), preload=True, expressions=()):
+
+    workerArgs = (profiling.enabled(), list(expressions), initializer, initargs)
+
+    if "forkserver" not in mp.get_all_start_methods():
+        return mp.Pool(processes=processes, initializer=initWorker, initargs=workerArgs)
+
+    context = mp.get_context("forkserver")
+    context.set_forkserver_preload(["rootPreload"] if preload else [])
+
+    return context.Pool(processes=processes, initializer=initWorker, initargs=workerArgs)
+
+# The .root files of an input directory, largest first so that a pool handing
+# them out in this order is not left waiting on one big file at the end, with
+# a warning when there are none
+def inputFiles(inputDir):
+
+    files = sorted(glob.glob(inputDir + "/*.root"), key=os.path.getsize, reverse=True)
+    if not files:
+        print(f"\033[1;31mWARNING: No input files found in \"{inputDir}\"\033[0m")
+
+    return files
+
+def fileTask(task):
+
+    function, inputFile, args = task
+    return function(inputFile, *args)
+
+# Run function(inputFile, *args) on every input file, in order, over a pool of
+# at most jobs processes without ROOT preloaded, yielding each result as soon
+# as its file is done
+def mapFiles(function, inputFiles, args, jobs):
+
+    tasks = [(function, inputFile, args) for inputFile in inputFiles]
+    with pool(max(1, min(jobs, len(tasks))), preload=False) as workers:
+        yield from workers.imap_unordered(fileTask, tasks)
+
+# Create the directory a file is to be written to
+def makeParentDir(path):
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+# Write histograms that have a name and a toROOT method, like BinnedHisto, to a new ROOT file
+def writeHistos(outputFile, histos):
+
+    import ROOT
+
+    makeParentDir(outputFile)
+
+    outFile = ROOT.TFile.Open(outputFile, "RECREATE")
+    for histo in histos:
+        histo.toROOT().Write(histo.name, ROOT.TObject.kOverwrite)
+    outFile.Close()
@@ -0,0 +1,11 @@
+#! /bin/env/python
+
+# Imported by the forkserver of rootLoader.pool, so that the pool processes
+# forked from it have ROOT imported and the libraries of the classes used by
+# ttreeDrawer and plotter already loaded
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+ROOT.gROOT.SetBatch(True)
+
+for className in ["TFile", "TTree", "TH1D", "TH2D", "TH3D", "TCanvas", "RDataFrame"]:
+    getattr(ROOT, className)
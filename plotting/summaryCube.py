@@ -0,0 +1,234 @@
+#! /bin/env/python
+
+import os
+import time
+import argparse
+
+import numpy as np
+
+import rootLoader
+from formulaParser import compileFormula, splitVariable
+from columnarEngine import NFG, BinnedHisto, histoAxes, finalHistos
+
+# Most questions about a tag only involve the tower, the two ETs and the fine
+# grain and found flags of each TP, so the tps tree is reduced once into counts
+# of TPs per distinct combination of them, kept in two sparse tables:
+#    et : per (ieta, iphi, et_packed, et_reemul)
+#    fg : per (ieta, iphi, found_packed, found_reemul, fg0..5_packed, fg0..5_reemul)
+# Each distinct combination is encoded into a single integer key, tables being
+# sorted by key with the number of TPs of each. A histogram of the side car file
+# whose expressions only use the columns of one table is then filled from the
+# table with the counts as weights, which gives exactly the histogram filled from
+# the tree, but with at most a few hundred thousand rows instead of billions
+class SummaryCube:
+
+    # TP ET is a multiple of the 0.5 GeV LSB, stored as an index of 9 bits
+    ETBITS   = 9
+    IETAMIN  = -64
+
+    TABLES = {"et" : ["ieta", "iphi", "et_packed", "et_reemul"],
+              "fg" : ["ieta", "iphi", "found_packed", "found_reemul"] + [f"fg{i}_packed" for i in range(NFG)] + [f"fg{i}_reemul" for i in range(NFG)]}
+
+    def __init__(self):
+
+        self.keys   = {table : np.zeros(0, dtype=np.int64) for table in self.TABLES}
+        self.counts = {table : np.zeros(0, dtype=np.int64) for table in self.TABLES}
+
+    # Tower part of the keys, with 8 bits for each of ieta and iphi
+    @classmethod
+    def towerKeys(cls, ieta, iphi):
+        return ((ieta.astype(np.int64) - cls.IETAMIN) << 8) | iphi.astype(np.int64)
+
+    # Keys of every entry of a chunk of the tps tree, per table
+    @classmethod
+    def encode(cls, chunk):
+
+        tower = cls.towerKeys(chunk["ieta"], chunk["iphi"])
+
+        etPacked = np.rint(2.0 * chunk["et_packed"]).astype(np.int64)
+        etReemul = np.rint(2.0 * chunk["et_reemul"]).astype(np.int64)
+
+        # A value outside of its bits would spill into the neighbouring field
+        for name, etIndex in [("et_packed", etPacked), ("et_reemul", etReemul)]:
+            outside = (etIndex < 0) | (etIndex >= 2**cls.ETBITS)
+            if np.any(outside):
+                raise ValueError(f"{name} of {chunk[name][outside][0]} is outside of the [0, {(2**cls.ETBITS - 1) / 2.0}] GeV range of the summary cube")
+        etKeys   = (((tower << cls.ETBITS) | etPacked) << cls.ETBITS) | etReemul
+
+        flags = cls.TABLES["fg"][2:]
+        fgKeys = tower
+        for name in flags:
+            fgKeys = (fgKeys << 1) | (chunk[name] != 0).astype(np.int64)
+
+        return {"et" : etKeys, "fg" : fgKeys}
+
+    # The columns of a table decoded from its keys, as floats ready for formula evaluation
+    @classmethod
+    def decode(cls, table, keys):
+
+        columns = {}
+        if table == "et":
+            columns["et_reemul"] = (keys & (2**cls.ETBITS - 1)) / 2.0
+            columns["et_packed"] = ((keys >> cls.ETBITS) & (2**cls.ETBITS - 1)) / 2.0
+            tower = keys >> (2 * cls.ETBITS)
+        else:
+            flags = cls.TABLES["fg"][2:]
+            for shift, name in enumerate(reversed(flags)):
+                columns[name] = ((keys >> shift) & 1).astype(np.float64)
+            tower = keys >> len(flags)
+
+        columns["iphi"] = (tower & 0xFF).astype(np.float64)
+        columns["ieta"] = ((tower >> 8) + cls.IETAMIN).astype(np.float64)
+
+        return columns
+
+    # Merge counts per key into a table
+    def merge(self, table, keys, counts):
+
+        keys, inverse = np.unique(np.concatenate([self.keys[table], keys]), return_inverse=True)
+        self.counts[table] = np.bincount(inverse, weights=np.concatenate([self.counts[table], counts]), minlength=len(keys)).astype(np.int64)
+        self.keys[table]   = keys
+
+    # Accumulate one chunk of the tps tree given as a dictionary of arrays
+    def fill(self, chunk):
+
+        for table, keys in self.encode(chunk).items():
+            keys, counts = np.unique(keys, return_counts=True)
+            self.merge(table, keys, counts)
+
+    def add(self, other):
+
+        for table in self.TABLES:
+            self.merge(table, other.keys[table], other.counts[table])
+
+    @property
+    def nEntries(self):
+        return int(self.counts["et"].sum())
+
+    def save(self, outputFile):
+
+        arrays = {}
+        for table in self.TABLES:
+            arrays[f"{table}_keys"]   = self.keys[table]
+            arrays[f"{table}_counts"] = self.counts[table]
+
+        np.savez_compressed(outputFile, **arrays)
+
+    @classmethod
+    def load(cls, inputFile):
+
+        arrays = np.load(inputFile)
+
+        cube = cls()
+        for table in cls.TABLES:
+            cube.keys[table]   = arrays[f"{table}_keys"]
+            cube.counts[table] = arrays[f"{table}_counts"]
+
+        return cube
+
+    # Name of the table able to fill a histogram of the side car file, or None
+    # if its expressions need columns that are in neither of the tables
+    def tableFor(self, histOps):
+
+        branches = set()
+        for expression in splitVariable(histOps["variable"]) + [histOps["weight"], histOps["selection"]]:
+            branches |= compileFormula(expression).branches
+
+        for table, columns in self.TABLES.items():
+            if branches <= set(columns):
+                return table
+
+        return None
+
+    # Fill one histogram of the side car file from the cube, returning the final
+    # (possibly projected) histograms by name, the same as the numpy engine of ttreeDrawer
+    def histos(self, histOps):
+
+        table = self.tableFor(histOps)
+        if table is None:
+            raise ValueError(f"Histogram \"{histOps['basename']}\" uses columns that are not in the summary cube")
+
+        columns   = self.decode(table, self.keys[table])
+        counts    = self.counts[table].astype(np.float64)
+        nRows     = len(counts)
+        variables = [compileFormula(expression).evaluate(columns, nRows) for expression in splitVariable(histOps["variable"])]
+        weights   = compileFormula(f"({histOps['weight']})*({histOps['selection']})").evaluate(columns, nRows)
+
+        # Every row stands for count TPs of the same weight
+        histo = BinnedHisto(histOps["basename"], histoAxes(histOps, len(variables)))
+        histo.fill(variables, counts * weights)
+
+        squared = BinnedHisto(histOps["basename"], histo.axes)
+        squared.fill(variables, counts * weights * weights)
+
+        histo.sumw2   = squared.sumw
+        histo.entries = int(counts[weights != 0.0].sum())
+
+        return {final.name : final for final in finalHistos(histo, histOps)}
+
+# Fill every histogram of the side car file that the cube can answer, warning
+# about the others, giving a list of dictionaries like columnarEngine.fillHistos
+def fillHistos(cube, histograms):
+
+    histos = []
+    for histOps in histograms:
+        if cube.tableFor(histOps) is None:
+            print(f"\033[1;31mWARNING: Histogram \"{histOps['basename']}\" cannot be made from the summary cube, skipping\033[0m")
+            continue
+        histos.append(cube.histos(histOps))
+
+    return histos
+
+# Reduce the tps tree of one input file, reading chunkSize entries at a time
+def buildFile(inputFile, treeName, chunkSize):
+
+    import uproot
+
+    start = time.time()
+    cube  = SummaryCube()
+    with uproot.open(inputFile) as file:
+        tree = file[treeName]
+        for chunk in tree.iterate(sorted({column for columns in SummaryCube.TABLES.values() for column in columns}), step_size=chunkSize, library="np"):
+            try:
+                cube.fill(chunk)
+            except ValueError as error:
+                raise ValueError(f"Cannot reduce \"{inputFile}\": {error}") from error
+
+    return inputFile, cube, time.time() - start
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--inputDir",   dest="inputDir",   help="Path to ntuples",       default=None             )
+    parser.add_argument("--cubeFile",   dest="cubeFile",   help="path for .npz file",    required=True            )
+    parser.add_argument("--rootFile",   dest="rootFile",   help="path for histos file",  default=None             )
+    parser.add_argument("--options",    dest="options",    help="histo options file",    default="ttreeDrawer_aux")
+    parser.add_argument("--tree",       dest="tree",       help="TTree name to reduce",  default="analyzeTPs/tps" )
+    parser.add_argument("--chunkSize",  dest="chunkSize",  help="entries per chunk",     default=5000000, type=int)
+    parser.add_argument("--jobs",       dest="jobs",       help="number of processes",   default=os.cpu_count(), type=int)
+    args = parser.parse_args()
+
+    # With an input directory the cube is built, otherwise an existing one is queried
+    if args.inputDir is not None:
+        inputFiles = rootLoader.inputFiles(args.inputDir)
+        if not inputFiles:
+            quit()
+
+        cube = SummaryCube()
+        for inputFile, fileCube, seconds in rootLoader.mapFiles(buildFile, inputFiles, (args.tree, args.chunkSize), args.jobs):
+            cube.add(fileCube)
+            print(f"Reduced \"{inputFile}\" with {fileCube.nEntries} TPs in {seconds:.1f} s")
+
+        rootLoader.makeParentDir(args.cubeFile)
+        cube.save(args.cubeFile)
+
+        print(f"Summary cube of {cube.nEntries} TPs has {len(cube.keys['et'])} ET and {len(cube.keys['fg'])} fine grain rows")
+    else:
+        cube = SummaryCube.load(args.cubeFile)
+
+    if args.rootFile:
+        start  = time.time()
+        histos = fillHistos(cube, __import__(args.options).histograms)
+        print(f"Made {sum(len(final) for final in histos)} histograms from the summary cube in {1000 * (time.time() - start):.0f} ms")
+
+        rootLoader.writeHistos(args.rootFile, [histo for final in histos for histo in final.values()])
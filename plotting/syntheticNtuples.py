@@ -0,0 +1,274 @@
+#! /bin/env/python
+
+import os
+import time
+import argparse
+
+import numpy as np
+
+from columnarEngine import NFG
+
+# Synthetic stand-ins for the ntuples written by AnalyzeTPs, for measuring the
+# drawing and plotting tools offline. The tps and occ trees have the exact
+# branch names and types of the analyzer, one tps entry per trigger tower per
+# event, and the occ tree is derived from the generated TPs the same way the
+# analyzer derives it, including the wrap around of its 8 bit occupancies
+
+NLINADCIN     = 10
+NLINADCOUT    = 4
+NTPETBINS     = 2 * 128 + 1
+TPETLSB       = 0.5
+TPETMAX       = 127.5
+
+# Branch types of the tps and occ trees, in the order the analyzer books them
+TPSBRANCHES = {"run"          : np.uint32,
+               "lumi"         : np.uint16,
+               "event"        : np.uint64,
+               "nVtx"         : np.int8,
+               "zeroBias"     : np.uint8,
+               "ieta"         : np.int8,
+               "iphi"         : np.uint8,
+               "et_packed"    : np.float32,
+               "et_reemul"    : np.float32,
+               "found_reemul" : np.uint8,
+               "found_packed" : np.uint8}
+TPSBRANCHES.update({f"fg{i}_packed"    : np.bool_  for i in range(NFG)})
+TPSBRANCHES.update({f"fg{i}_reemul"    : np.bool_  for i in range(NFG)})
+TPSBRANCHES.update({f"lin_adc_in{i}"   : np.uint16 for i in range(NLINADCIN)})
+TPSBRANCHES.update({f"lin_adc_out{i}"  : np.uint16 for i in range(NLINADCOUT)})
+TPSBRANCHES.update({f"tp_vetoed_ts{i}" : np.uint8  for i in range(NLINADCOUT)})
+
+OCCBRANCHES = {"nVtx"        : np.int8,
+               "ieta"        : np.int8,
+               "et_thresh"   : np.float32,
+               "occu_packed" : np.uint8,
+               "occu_reemul" : np.uint8}
+
+# All trigger towers kept by the analyzer: 72 in iphi up to |ieta| = 28, the
+# 1x1 HF towers at odd iphi and, for |ieta| 40 and 41, only those at iphi % 4 == 3
+def towers():
+
+    ietas, iphis = [], []
+    for aieta in range(1, 42):
+        if aieta == 29:
+            continue
+
+        if aieta <= 28:
+            phis = range(1, 73)
+        elif aieta <= 39:
+            phis = range(1, 73, 2)
+        else:
+            phis = range(3, 73, 4)
+
+        for sign in [-1, 1]:
+            ietas.extend([sign * aieta] * len(phis))
+            iphis.extend(phis)
+
+    return np.array(ietas, dtype=np.int8), np.array(iphis, dtype=np.uint8)
+
+# Rows of one event's occ tree, per threshold: the physical ieta rings and then
+# the HB, HE and HF pseudo-rings stored as ieta 42, 43 and 44
+OCCRINGS = np.array([ieta for ieta in range(-41, 42) if ieta != 0 and abs(ieta) != 29] + [42, 43, 44], dtype=np.int8)
+
+# Generates the events one chunk at a time, keeping the run, lumi and event
+# numbers increasing across chunks
+#    seed          : seed of the random numbers, so that files are reproducible
+#    pileup        : mean number of vertices
+#    eventsPerLumi : number of events in each lumi section
+class TPGenerator:
+
+    def __init__(self, seed=0, pileup=55.0, eventsPerLumi=100, run=386864):
+
+        self.rng           = np.random.default_rng(seed)
+        self.pileup        = pileup
+        self.eventsPerLumi = eventsPerLumi
+        self.run           = run
+        self.nEvents       = 0
+
+        self.ieta, self.iphi = towers()
+        self.aieta           = np.abs(self.ieta.astype(np.int64))
+        self.isHF            = self.aieta >= 30
+
+        # Rows of the per-ieta occupancy for each tower and of the pseudo-ring of its subdetector
+        ringIndex            = {ieta : i for i, ieta in enumerate(OCCRINGS)}
+        self.ringIndex       = np.array([ringIndex[ieta] for ieta in self.ieta])
+        self.subdetIndex     = np.array([ringIndex[42 + (aieta > 16) + (aieta >= 30)] for aieta in self.aieta])
+
+    @property
+    def nTowers(self):
+        return len(self.ieta)
+
+    # TP ETs for nEvents events: mostly zero, with the fraction of active towers
+    # growing with pileup and towards high |ieta| and a steeply falling spectrum
+    def makeET(self, nVtx):
+
+        rng     = self.rng
+        shape   = (len(nVtx), self.nTowers)
+
+        active  = 0.01 + 0.0006 * nVtx[:, None] * (1.0 + 4.0 * (self.aieta / 41.0)**4)
+        isHit   = rng.random(shape) < np.minimum(active, 0.9)
+        scale   = np.where(self.isHF, 1.5, 1.0)
+        energy  = rng.exponential(scale, shape) + 0.5 * rng.pareto(1.2, shape)
+
+        et = np.where(isHit, np.minimum(np.floor(energy / TPETLSB + 1) * TPETLSB, TPETMAX), 0.0)
+
+        return et.astype(np.float32)
+
+    # Re-emulated ETs agree with the unpacked ones but for a small fraction of
+    # towers that are off by an LSB or two, and a few where only one of them is zero
+    def makeReemulET(self, etPacked):
+
+        rng   = self.rng
+        shape = etPacked.shape
+
+        shift = rng.choice([-2, -1, 1, 2], size=shape) * TPETLSB
+        isOff = (rng.random(shape) < 0.005) & (etPacked > 0)
+        etReemul = np.where(isOff, np.clip(etPacked + shift, TPETLSB, TPETMAX), etPacked)
+
+        isLost = rng.random(shape) < 0.0005
+        etReemul = np.where(isLost & (etPacked > 0), 0.0, etReemul)
+        etReemul = np.where(isLost & (etPacked == 0), rng.integers(1, 8, size=shape) * TPETLSB, etReemul)
+
+        return etReemul.astype(np.float32)
+
+    # Fill one chunk of nEvents events, returning the tps and occ trees as dictionaries of arrays
+    def generate(self, nEvents):
+
+        rng     = self.rng
+        nTowers = self.nTowers
+        shape   = (nEvents, nTowers)
+
+        eventNumbers = self.nEvents + np.arange(nEvents)
+        self.nEvents += nEvents
+
+        nVtx     = np.clip(rng.poisson(self.pileup, nEvents), 0, 127)
+        zeroBias = rng.random(nEvents) < 0.2
+
+        etPacked = self.makeET(nVtx)
+        etReemul = self.makeReemulET(etPacked)
+
+        # Rarely a TP is found in only one of the collections
+        foundPacked = rng.random(shape) >= 0.0001
+        foundReemul = rng.random(shape) >= 0.0001
+        foundPacked |= ~foundReemul & ~foundPacked
+        etPacked = np.where(foundPacked, etPacked, 0.0).astype(np.float32)
+        etReemul = np.where(foundReemul, etReemul, 0.0).astype(np.float32)
+
+        tps = {"run"          : np.full(shape, self.run),
+               "lumi"         : np.broadcast_to((1 + eventNumbers // self.eventsPerLumi)[:, None], shape),
+               "event"        : np.broadcast_to((1000000 + 7 * eventNumbers)[:, None], shape),
+               "nVtx"         : np.broadcast_to(nVtx[:, None], shape),
+               "zeroBias"     : np.broadcast_to(zeroBias[:, None], shape),
+               "ieta"         : np.broadcast_to(self.ieta, shape),
+               "iphi"         : np.broadcast_to(self.iphi, shape),
+               "et_packed"    : etPacked,
+               "et_reemul"    : etReemul,
+               "found_reemul" : foundReemul,
+               "found_packed" : foundPacked}
+
+        # Fine grain bits: mostly the MIP and timing bits of energetic towers,
+        # the re-emulation flipping one now and then
+        for i in range(NFG):
+            rate = 0.3 if i == 0 else 0.02
+            fgPacked = (etPacked > 2.0) & (rng.random(shape) < rate)
+            fgReemul = fgPacked ^ (rng.random(shape) < 0.0005)
+            tps[f"fg{i}_packed"] = fgPacked & foundPacked
+            tps[f"fg{i}_reemul"] = fgReemul & foundReemul
+
+        # Linearized ADC of the input samples, pedestal noise with the pulse
+        # in the sample of interest and some spill over into the next one
+        peak = np.rint(8.0 * etReemul + rng.normal(0.0, 1.5, shape))
+        for i in range(NLINADCIN):
+            adc = rng.poisson(2.0, shape).astype(np.float64)
+            if i == 4:
+                adc += peak
+            elif i == 5:
+                adc += 0.2 * peak
+            tps[f"lin_adc_in{i}"] = np.where(foundReemul, np.clip(adc, 0, 1023), 0)
+
+        # The output samples are pedestal subtracted, with the sample of
+        # interest being the third one in HB and HE and the second one in HF
+        soi = np.where(self.isHF, 1, 2)
+        for i in range(NLINADCOUT):
+            adc = np.where(soi == i, peak, np.maximum(rng.poisson(0.5, shape) - 1, 0))
+            tps[f"lin_adc_out{i}"] = np.where(foundReemul, np.clip(adc, 0, 1023), 0)
+            tps[f"tp_vetoed_ts{i}"] = foundReemul & (rng.random(shape) < 0.001)
+
+        tps = {name : np.ascontiguousarray(tps[name], dtype=dtype).ravel() for name, dtype in TPSBRANCHES.items()}
+
+        return tps, self.occupancy(nVtx, etPacked, etReemul, foundPacked, foundReemul)
+
+    # The occ tree as the analyzer fills it: per event, threshold and ring, the
+    # number of TPs whose ET is at or above the threshold, kept in 8 bits
+    def occupancy(self, nVtx, etPacked, etReemul, foundPacked, foundReemul):
+
+        nEvents = len(nVtx)
+        nRings  = len(OCCRINGS)
+        events  = np.broadcast_to(np.arange(nEvents)[:, None], etPacked.shape)
+
+        occ = {}
+        for kind, et, found in [("packed", etPacked, foundPacked), ("reemul", etReemul, foundReemul)]:
+            etIndex = (et * 2.0).astype(np.int64)
+
+            counts = np.zeros(nEvents * nRings * NTPETBINS, dtype=np.int64)
+            for rings in [self.ringIndex, self.subdetIndex]:
+                rows = np.broadcast_to(rings, et.shape)
+                flat = np.ravel_multi_index([events[found], rows[found], etIndex[found]], (nEvents, nRings, NTPETBINS))
+                counts += np.bincount(flat, minlength=len(counts))
+
+            # A TP occupies every threshold up to and including its own ET
+            counts = np.cumsum(counts.reshape(nEvents, nRings, NTPETBINS)[:, :, ::-1], axis=2)[:, :, ::-1]
+            occ[f"occu_{kind}"] = counts.transpose(0, 2, 1).astype(np.uint8).ravel()
+
+        nRows = NTPETBINS * nRings
+        occ["nVtx"]      = np.repeat(nVtx, nRows).astype(np.int8)
+        occ["ieta"]      = np.tile(OCCRINGS, nEvents * NTPETBINS)
+        occ["et_thresh"] = np.tile(np.repeat(np.arange(NTPETBINS, dtype=np.float32) / 2.0, nRings), nEvents)
+
+        return {name : occ[name].astype(dtype) for name, dtype in OCCBRANCHES.items()}
+
+# Write one file with nEvents events, chunkEvents of them at a time
+def writeFile(outputFile, nEvents, seed=0, pileup=55.0, chunkEvents=50):
+
+    import uproot
+
+    start     = time.time()
+    generator = TPGenerator(seed, pileup)
+    with uproot.recreate(outputFile) as f:
+        tps = f.mktree("analyzeTPs/tps", TPSBRANCHES, title="Trigger primitives")
+        occ = f.mktree("analyzeTPs/occ", OCCBRANCHES, title="TP occupancy")
+
+        for first in range(0, nEvents, chunkEvents):
+            tpsChunk, occChunk = generator.generate(min(chunkEvents, nEvents - first))
+            tps.extend(tpsChunk)
+            occ.extend(occChunk)
+
+    return time.time() - start
+
+# Write nFiles files into outputDir, each with its own seed, named like the ntuples of the analyzer
+def writeFiles(outputDir, nFiles, nEvents, seed=0, pileup=55.0, chunkEvents=50):
+
+    os.makedirs(outputDir, exist_ok=True)
+
+    outputFiles = []
+    for iFile in range(nFiles):
+        outputFile = f"{outputDir}/analyze_tps_{iFile}.root"
+        seconds    = writeFile(outputFile, nEvents, seed + iFile, pileup, chunkEvents)
+        outputFiles.append(outputFile)
+
+        print(f"Wrote {nEvents} events to \"{outputFile}\" ({os.path.getsize(outputFile) / 1024**2:.1f} MB) in {seconds:.1f} s")
+
+    return outputFiles
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--outputDir",   dest="outputDir",   help="where to put the ntuples",  required=True            )
+    parser.add_argument("--files",       dest="files",       help="number of files",           default=4,     type=int  )
+    parser.add_argument("--events",      dest="events",      help="events per file",           default=200,   type=int  )
+    parser.add_argument("--pileup",      dest="pileup",      help="mean number of vertices",   default=55.0,  type=float)
+    parser.add_argument("--seed",        dest="seed",        help="seed of the first file",    default=0,     type=int  )
+    parser.add_argument("--chunkEvents", dest="chunkEvents", help="events generated at once",  default=50,    type=int  )
+    args = parser.parse_args()
+
+    writeFiles(args.outputDir, args.files, args.events, args.seed, args.pileup, args.chunkEvents)
@@ -1,111 +1,59 @@
 #! /bin/env/python
 
 import os
-import re
 import glob
+import time
 import random
 import argparse
-import datetime
-import subprocess
 from pathlib import Path
-import multiprocessing as mp
 
-import ROOT
-ROOT.PyConfig.IgnoreCommandLineOptions = True
-ROOT.gROOT.SetBatch(True)
-ROOT.TH1.SetDefaultSumw2()
-ROOT.TH2.SetDefaultSumw2()
-ROOT.TH3.SetDefaultSumw2()
+import profiling
+import rootLoader
+import histoCache
+import columnarEngine
+from formulaParser import FormulaError, splitVariable, resolveBranches, specExpressions
 
-# Routine that is called for each individual histogram that is to be 
-# drawn from the input tree. All information about what to draw, selections,
-# and weights is contained in the histOps dictionary
-def makeNDhisto(year, inputIndex, histOps, outfile, file):
+def setupROOT(ROOT):
 
-    treeName = histOps["tree"]
-    tree = file.Get(treeName)
+    ROOT.TH1.SetDefaultSumw2()
+    ROOT.TH2.SetDefaultSumw2()
+    ROOT.TH3.SetDefaultSumw2()
 
-    # To efficiently TTree->Draw(), we will only "activate"
-    # necessary branches. So first, disable all branches
-    tree.SetBranchStatus("*", 0)
+# Only imported once actually used, so that --help and mistakes in the
+# arguments or the options file are reported right away
+ROOT = rootLoader.LazyROOT(setupROOT)
 
-    basename  = histOps["basename"]
-    selection = histOps["selection"]
-    variable  = histOps["variable"]
-    weight    = histOps["weight"]
-    
-    # Make one big string to extract all relevant branch names from
-    concatStr = selection + "," + variable
-    concatStr = concatStr + "," + weight
-
-    # The idea is to turn the concatStr into a comma separated list of branches
-    # Parenthesis can simply be removed, operators are simply replace with a comma
-    # After all replacements, the string is split on the comma and filtered for empty strings
-    functions = set(re.findall(r'\b[a-zA-Z_]\w*(?=\()', concatStr))
-    keywords  = set(re.findall(r'\b[a-zA-Z_]\w*\b',     concatStr))
-
-    # Here, the branches list will be names of branches and strings of digits
-    # The digits are residual cut expressions like NGoodJets_pt30>=7 ==> "NGoodJets_pt30", "7"
-    # So if a supposed branch name can be turned into an int, then it is not a legit branch name
-    for possibleBranchName in keywords:
-        if possibleBranchName not in functions:
-            tree.SetBranchStatus(possibleBranchName, 1)
-
-    is1D = (variable.count(":") - 2*variable.count("::")) == 0
-    is2D = (variable.count(":") - 2*variable.count("::")) == 1
-    is3D = (variable.count(":") - 2*variable.count("::")) == 2
-
-    outfile.cd()
-
-    htemp = None
-    tempName = basename + f"{random.random():.8f}_{inputIndex}"
-    if   is1D:
-        temph = ROOT.TH1D(tempName, "", histOps["xbins"], histOps["xmin"], histOps["xmax"])
-    elif is2D:
-        temph = ROOT.TH2D(tempName, "", histOps["xbins"], histOps["xmin"], histOps["xmax"], histOps["ybins"], histOps["ymin"], histOps["ymax"])
-    elif is3D:
-        temph = ROOT.TH3D(tempName, "", histOps["xbins"], histOps["xmin"], histOps["xmax"], histOps["ybins"], histOps["ymin"], histOps["ymax"], histOps["zbins"], histOps["zmin"], histOps["zmax"])
+# Book an empty 1D, 2D or 3D histogram according to the binning in histOps
+def bookHisto(name, histOps, nDim):
 
-    # For MC, we multiply the selection string by our chosen weight in order
-    # to fill the histogram with an event's corresponding weight
-    drawExpression = f"{variable}>>{tempName}"
-    selectExpression = f"({weight})*({selection})"
+    if   nDim == 1:
+        return ROOT.TH1D(name, "", histOps["xbins"], histOps["xmin"], histOps["xmax"])
+    elif nDim == 2:
+        return ROOT.TH2D(name, "", histOps["xbins"], histOps["xmin"], histOps["xmax"], histOps["ybins"], histOps["ymin"], histOps["ymax"])
+    elif nDim == 3:
+        return ROOT.TH3D(name, "", histOps["xbins"], histOps["xmin"], histOps["xmax"], histOps["ybins"], histOps["ymin"], histOps["ymax"], histOps["zbins"], histOps["zmin"], histOps["zmax"])
 
-    tree.Draw(drawExpression, selectExpression)
-    temph = ROOT.gDirectory.Get(tempName)
-    temph.Sumw2()
+# Collect a filled histogram into the histos dictionary of final histograms,
+# possibly after processing the drawn histogram i.e. projecting out an axis
+# in slices. The ROOT histograms are turned into arrays so that they can be
+# shipped back from the pool processes and merged without any temporary files
+def collectHisto(temph, histOps, histos):
 
-    # Possibly need to process the drawn histogram i.e. project out an axis in slices
-    if "projections" in histOps and not is1D:
+    basename = histOps["basename"]
+    nDim     = temph.GetDimension()
+    is2D     = nDim == 2
+    is3D     = nDim == 3
+
+    if "projections" in histOps and nDim > 1:
         projections = histOps["projections"]
 
         # Example projection string: "Z;HB;[1,16]" or "Z;ieta;2"
         for projection in projections:
 
-            unpack   = projection.replace(" ", "").split(";")
-            axis     = unpack[0].upper()
-            label    = unpack[1]
-            binRange = unpack[2]
-
-            firstBin = -1
-            lastBin  = -1
-            labelExt = ""
-            if "," in binRange:
-                unpackRange = binRange.split(",")
-                firstBin = int(unpackRange[0][1:])
-                lastBin  = int(unpackRange[1][:-1])
-
-                if unpackRange[0][0] == "(":
-                    firstBin += 1
-                if unpackRange[1][-1] == ")":
-                    lastBin -= 1
-            else:
-                firstBin = int(binRange)
-                lastBin  = int(binRange)
-                labelExt = str(binRange)
+            iAxis, newHistName, firstBin, lastBin = columnarEngine.parseProjection(projection, basename)
+            axis = "XYZ"[iAxis]
 
             projh = None
-            newHistName = basename + f"_{label}{labelExt}"
             if   axis == "X":
                 if is2D:
                     projh = temph.ProjectionY(newHistName, firstBin, lastBin, "")
@@ -117,36 +65,361 @@ def makeNDhisto(year, inputIndex, histOps, outfile, file):
                 if is2D:
                     projh = temph.ProjectionX(newHistName, firstBin, lastBin, "")
                 elif is3D:
-                    temph.GetXaxis().SetRange(firstBin, lastBin)
-                    projh.Project3D("zx")
+                    temph.GetYaxis().SetRange(firstBin, lastBin)
+                    projh = temph.Project3D("zx")
                     projh.SetName(newHistName)
             elif axis == "Z":
                 if is3D:
                     temph.GetZaxis().SetRange(firstBin, lastBin)
                     projh = temph.Project3D("yx")
                     projh.SetName(newHistName)
-            projh.Write(newHistName, ROOT.TObject.kOverwrite)
+            projh.SetDirectory(ROOT.nullptr)
+            ROOT.SetOwnership(projh, True)
+            histos[newHistName] = columnarEngine.BinnedHisto.fromROOT(projh, newHistName)
+
+    else:
+        histos[basename] = columnarEngine.BinnedHisto.fromROOT(temph, basename)
+
+# Routine that is called for each individual histogram that is to be 
+# drawn from the input tree. All information about what to draw, selections,
+# and weights is contained in the histOps dictionary
+def makeNDhisto(year, inputIndex, histOps, histos, file, defaultTree, entryStart=None, entryStop=None, treeCacheSize=None):
+
+    treeName = histOps.get("tree", defaultTree)
+    tree = file.Get(treeName)
+
+    basename  = histOps["basename"]
+    selection = histOps["selection"]
+    variable  = histOps["variable"]
+    weight    = histOps["weight"]
+
+    with profiling.stage("branches", file.GetName(), basename):
+        # To efficiently TTree->Draw(), we will only "activate"
+        # necessary branches. So first, disable all branches
+        tree.SetBranchStatus("*", 0)
+
+        # The expressions are parsed (once per expression string) and the identifiers
+        # they use are resolved against the branches of the tree, so only branches
+        # that exist and are needed get activated. Should an expression use TFormula
+        # syntax beyond what the parser knows, simply fall back to all branches
+        branchNames = [branch.GetName() for branch in tree.GetListOfBranches()]
+        try:
+            branches, _ = resolveBranches(specExpressions(histOps), branchNames)
+        except FormulaError:
+            branches = branchNames
+
+        for branch in sorted(branches):
+            tree.SetBranchStatus(branch, 1)
 
+        # When reading remotely, the TTreeCache is trained on exactly the activated
+        # branches right away, so that their baskets are fetched in few vector reads
+        if treeCacheSize is not None:
+            tree.SetCacheSize(treeCacheSize)
+            for branch in branches:
+                tree.AddBranchToCache(branch, True)
+            tree.StopCacheLearningPhase()
+
+    nDim = len(splitVariable(variable))
+
+    ROOT.gROOT.cd()
+
+    tempName = basename + f"{random.random():.8f}_{inputIndex}"
+    temph = bookHisto(tempName, histOps, nDim)
+
+    # For MC, we multiply the selection string by our chosen weight in order
+    # to fill the histogram with an event's corresponding weight
+    drawExpression = f"{variable}>>{tempName}"
+    selectExpression = f"({weight})*({selection})"
+
+    # Only draw the requested range of entries when the file is sharded
+    firstEntry = 0 if entryStart is None else entryStart
+    nEntries   = ROOT.TTree.kMaxEntries if entryStop is None else entryStop - firstEntry
+
+    with profiling.stage("draw", file.GetName(), basename):
+        tree.Draw(drawExpression, selectExpression, "", nEntries, firstEntry)
+    temph = ROOT.gDirectory.Get(tempName)
+    temph.Sumw2()
+
+    with profiling.stage("project", file.GetName(), basename):
+        collectHisto(temph, histOps, histos)
+
+# Book a weighted 1D, 2D or 3D histogram of the given columns on an RDataFrame node
+def bookRDF(df, name, axes, columns, weightColumn):
+
+    args = [value for axis in axes for value in axis]
+    if   len(columns) == 1:
+        return df.Histo1D(ROOT.RDF.TH1DModel(name, "", *args), *columns, weightColumn)
+    elif len(columns) == 2:
+        return df.Histo2D(ROOT.RDF.TH2DModel(name, "", *args), *columns, weightColumn)
+    elif len(columns) == 3:
+        return df.Histo3D(ROOT.RDF.TH3DModel(name, "", *args), *columns, weightColumn)
+
+# Single pass alternative to calling makeNDhisto for each histogram. Every
+# histogram is booked on one RDataFrame computation graph per tree, so that
+# all of them are filled from the same event loop over the input file and
+# only the union of the branches they use is ever read. With directProjections,
+# the full histogram is not booked and each projection is filled directly
+# from the entries falling into its bin range of the projected axis
+def makeNDhistosRDF(year, inputIndex, histograms, histos, file, defaultTree, directProjections=False, entryStart=None, entryStop=None, treeCacheSize=None):
+
+    frames  = {}
+    results = []
+    for iHisto, histOps in enumerate(histograms):
+
+        treeName = histOps.get("tree", defaultTree)
+        if treeName not in frames:
+            # RDataFrame trains the TTreeCache on the branches it reads by itself,
+            # only its size needs adjusting when reading remotely
+            tree = file.Get(treeName)
+            if treeCacheSize is not None:
+                tree.SetCacheSize(treeCacheSize)
+            frames[treeName] = ROOT.RDataFrame(tree)
+            if entryStart is not None:
+                frames[treeName] = frames[treeName].Range(entryStart, entryStop)
+
+        basename  = histOps["basename"]
+        selection = histOps["selection"]
+        variable  = histOps["variable"]
+        weight    = histOps["weight"]
+
+        # Each histogram gets its own branch of the computation graph with uniquely
+        # named columns, mirroring the "(weight)*(selection)" used with TTree::Draw.
+        # Entries with a vanishing weight are filtered as Draw would not fill them
+        df = frames[treeName]
+        columns = []
+        for iAxis, expression in enumerate(splitVariable(variable)):
+            column = f"_h{iHisto}_{'xyz'[iAxis]}"
+            df = df.Define(column, f"(double)({expression})")
+            columns.append(column)
+
+        weightColumn = f"_h{iHisto}_w"
+        df = df.Define(weightColumn, f"(double)(({weight})*({selection}))").Filter(f"{weightColumn} != 0.0")
+
+        axes = columnarEngine.histoAxes(histOps, len(columns))
+        if directProjections and "projections" in histOps and len(columns) > 1:
+
+            # Same bin finding as TAxis::FindBin, clamped to the under/overflow bins
+            binColumns = {}
+            for projection in histOps["projections"]:
+                axis, name, firstBin, lastBin = columnarEngine.parseProjection(projection, basename)
+                if axis not in binColumns:
+                    nbins, low, high = axes[axis]
+                    binColumns[axis] = f"{columns[axis]}bin"
+                    df = df.Define(binColumns[axis], f"std::min(std::max(1.0 + std::floor({nbins}*({columns[axis]} - ({low}))/(({high}) - ({low}))), 0.0), {nbins + 1}.0)")
+
+                kept   = [iAxis for iAxis in range(len(columns)) if iAxis != axis]
+                sliced = df.Filter(f"{binColumns[axis]} >= {firstBin} && {binColumns[axis]} <= {lastBin}")
+                result = bookRDF(sliced, f"{name}_{inputIndex}", [axes[iAxis] for iAxis in kept], [columns[iAxis] for iAxis in kept], weightColumn)
+                results.append((iHisto, name, None, result))
+        else:
+            tempName = basename + f"{random.random():.8f}_{inputIndex}"
+            results.append((iHisto, basename, histOps, bookRDF(df, tempName, axes, columns, weightColumn)))
+
+    # Nothing has been read so far, trigger the event loop(s) all at once
+    with profiling.stage("eventLoop", file.GetName()):
+        ROOT.RDF.RunGraphs([result for _, _, _, result in results])
+
+    ROOT.gROOT.cd()
+    for iHisto, name, histOps, result in results:
+        with profiling.stage("project", file.GetName(), histograms[iHisto]["basename"]):
+            if histOps is None:
+                histos[iHisto][name] = columnarEngine.BinnedHisto.fromROOT(result.GetValue(), name)
+            else:
+                collectHisto(result.GetValue(), histOps, histos[iHisto])
+
+# Main function for a given input file, the input TTree is opened and the
+# list of requested histograms are filled, possibly for a range of entries only.
+# For each entry of histograms, the final histograms are returned by name
+def processFile(inputFile, inputIndex, year, histograms, engine, defaultTree, chunkSize, directProjections, entryStart=None, entryStop=None, remote=None, file=None):
+
+    redirector    = None if remote is None else remote["redirector"]
+    treeCacheSize = None if remote is None else remote["treeCacheSize"]
+
+    # The columnar engine reads the input file itself, chunk by chunk
+    if engine == "numpy":
+        return columnarEngine.fillHistos(readPath(inputFile, redirector), histograms, defaultTree, chunkSize, entryStart, entryStop, directProjections)
+
+    histos = [{} for _ in histograms]
+    if file is None:
+        with profiling.stage("open", readPath(inputFile, redirector)):
+            file = ROOT.TFile.Open(readPath(inputFile, redirector), "READONLY")
+
+    if engine == "rdf":
+        makeNDhistosRDF(year, inputIndex, histograms, histos, file, defaultTree, directProjections, entryStart, entryStop, treeCacheSize)
     else:
-        temph.Write(basename, ROOT.TObject.kOverwrite)
+        for histDict, specHistos in zip(histograms, histos):
+            makeNDhisto(year, inputIndex, histDict, specHistos, file, defaultTree, entryStart, entryStop, treeCacheSize)
+
+    file.Close()
+
+    return histos
 
-# Main function that a given pool process runs, the input TTree is opened
-# and the list of requested histograms are drawn to the output ROOT file
-def processFile(tempDir, inputFile, inputIndex, year, histograms):
+# Path to read an input file from. When reading remotely, files on the EOS
+# FUSE mount are read over XRootD instead, while listing, stat'ing and
+# caching keep using the local path
+def readPath(inputFile, redirector):
+
+    inputFile = inputFile if "://" in inputFile else os.path.abspath(inputFile)
+    if redirector is None or not inputFile.startswith("/eos/"):
+        return inputFile
+
+    return f"{redirector.rstrip('/')}/{inputFile}"
 
-    os.makedirs(tempDir, exist_ok=True)
+# Parse every expression of the side car file up front, before the pool is
+# forked, and report the minimal set of branches read from each tree as well
+# as any identifier that is not a branch of the first input file
+def reportBranches(inputFile, histograms, defaultTree, redirector=None):
 
-    file = ROOT.TFile.Open(inputFile, "READONLY")
+    file = ROOT.TFile.Open(readPath(inputFile, redirector), "READONLY")
 
-    datetimeStr = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    perTree = {}
+    for histOps in histograms:
+        treeName = histOps.get("tree", defaultTree)
+        tree     = file.Get(treeName)
+        if tree == None:
+            print(f"\033[1;31mWARNING: Tree \"{treeName}\" not found in file \"{inputFile}\"\033[0m")
+            continue
+
+        try:
+            branches, unknown = resolveBranches(specExpressions(histOps), [branch.GetName() for branch in tree.GetListOfBranches()])
+        except FormulaError as e:
+            print(f"\033[1;31mWARNING: Could not parse expressions of \"{histOps['basename']}\" with reason {e}\033[0m")
+            continue
+
+        for name in sorted(unknown):
+            print(f"\033[1;31mWARNING: \"{name}\" used by \"{histOps['basename']}\" is not a branch of \"{treeName}\"\033[0m")
+
+        perTree.setdefault(treeName, set()).update(branches)
+
+    file.Close()
+
+    for treeName, branches in perTree.items():
+        print(f"Reading {len(branches)} branches from \"{treeName}\": {', '.join(sorted(branches))}")
+
+# Add all histograms of histos into the merged dictionary, by name. New
+# entries are copies so that histos itself is never modified by later adds
+def mergeHistos(merged, histos):
+
+    for name, histo in histos.items():
+        if name in merged:
+            merged[name].add(histo)
+        else:
+            merged[name] = histo.copy()
+
+# Number of entries of a tree, read with uproot by the numpy engine so that
+# it never needs ROOT to split its input
+def countEntries(inputFile, treeName, engine, redirector=None):
+
+    if engine == "numpy":
+        import uproot
+
+        with uproot.open(readPath(inputFile, redirector)) as file:
+            return file[treeName].num_entries
+
+    file     = ROOT.TFile.Open(readPath(inputFile, redirector), "READONLY")
+    nEntries = file.Get(treeName).GetEntries()
+    file.Close()
+
+    return nEntries
+
+# Split the input files into units of work of roughly shardBytes each. Files
+# larger than that are split into ranges of entries of the tree to draw, while
+# small files are grouped together so that the per-task overhead is amortized.
+# Each shard is a list of (inputFile, inputIndex, entryStart, entryStop, specIndices)
+# pieces, where specIndices are the entries of the side car file still needed for
+# the file. The shards are returned largest first so that long tasks start early
+def makeShards(inputFiles, treeName, shardBytes, needed, engine, redirector=None):
+
+    sizes = {inputFile : os.path.getsize(inputFile) for inputFile in inputFiles}
+
+    shards = []
+    batch  = []
+    batchBytes = 0
+    for inputIndex, inputFile in sorted(enumerate(inputFiles), key=lambda item: -sizes[item[1]]):
+        size = sizes[inputFile]
+        specIndices = needed[inputFile]
+        if not specIndices:
+            continue
+
+        # Only split when all histograms are drawn from the same tree, as entry
+        # ranges of one tree do not mean anything for another one
+        if size > shardBytes and treeName is not None:
+            nEntries = countEntries(inputFile, treeName, engine, redirector)
+
+            nShards = min(-(-size // shardBytes), max(nEntries, 1))
+            edges   = [nEntries * iShard // nShards for iShard in range(nShards + 1)]
+            for entryStart, entryStop in zip(edges[:-1], edges[1:]):
+                shards.append(([(inputFile, inputIndex, entryStart, entryStop, specIndices)], size / nShards))
+
+        elif size > shardBytes:
+            shards.append(([(inputFile, inputIndex, None, None, specIndices)], size))
+
+        else:
+            batch.append((inputFile, inputIndex, None, None, specIndices))
+            batchBytes += size
+            if batchBytes >= shardBytes:
+                shards.append((batch, batchBytes))
+                batch      = []
+                batchBytes = 0
+
+    if batch:
+        shards.append((batch, batchBytes))
+
+    shards.sort(key=lambda shard: -shard[1])
+
+    return shards
+
+# Main function that a given pool process runs, all pieces of the shard are
+# processed and merged. The histograms are returned to the parent process,
+# which merges them as they arrive, together with timing information.
+# When caching, the histograms of complete files are stored right away while
+# those of a range of entries are returned for the parent to combine first.
+# When reading remotely, the next file of the shard is already being opened
+# asynchronously while the current one is processed
+def processShard(iShard, shard, shardBytes, year, histograms, engine, defaultTree, chunkSize, directProjections, cacheDir, remote):
+
+    start = time.perf_counter()
+
+    cache = None if cacheDir is None else histoCache.HistoCache(cacheDir, None)
+
+    histos   = {}
+    partials = []
+    handles  = {}
+    for iPiece, (inputFile, inputIndex, entryStart, entryStop, specIndices) in enumerate(shard):
+
+        file = None
+        if remote is not None and engine != "numpy":
+            if iPiece + 1 < len(shard):
+                nextFile = shard[iPiece + 1][0]
+                handles[nextFile] = ROOT.TFile.AsyncOpen(readPath(nextFile, remote["redirector"]), "READONLY")
+            if inputFile in handles:
+                with profiling.stage("open", readPath(inputFile, remote["redirector"])):
+                    file = ROOT.TFile.Open(handles.pop(inputFile))
+
+        perSpec = processFile(inputFile, inputIndex, year, [histograms[specIndex] for specIndex in specIndices], engine, defaultTree, chunkSize, directProjections, entryStart, entryStop, remote, file)
+
+        for specIndex, specHistos in zip(specIndices, perSpec):
+            mergeHistos(histos, specHistos)
+            if cache is None:
+                continue
+            if entryStart is None:
+                with profiling.stage("cache", readPath(inputFile, None if remote is None else remote["redirector"]), histograms[specIndex]["basename"]):
+                    cache.put(inputFile, histograms[specIndex], defaultTree, specHistos)
+            else:
+                partials.append((inputFile, specIndex, specHistos))
 
-    outfile = ROOT.TFile.Open(f"{tempDir}/{datetimeStr}_{inputIndex}.root", "RECREATE")
-    outfile.cd()
+    timing = {"shard" : iShard, "pieces" : len(shard), "bytes" : shardBytes, "seconds" : time.perf_counter() - start}
+    if len(shard) == 1 and shard[0][2] is not None:
+        timing["entries"] = shard[0][3] - shard[0][2]
 
-    for histDict in histograms:
-        makeNDhisto(year, inputIndex, histDict, outfile, file)
+    # Profiling records of this process go back to the parent with the timing
+    timing["profile"] = profiling.collect()
 
-    outfile.Close()
+    return histos, partials, timing
+
+# Unpack the arguments of a task for use with Pool.imap_unordered
+def processTask(task):
+    return processShard(*task)
 
 if __name__ == "__main__":
     usage = "%ttreeDrawer [options]"
@@ -156,47 +429,141 @@ if __name__ == "__main__":
     parser.add_argument("--tree",       dest="tree",       help="TTree name to draw",   default="analyzeTPs/tps" )
     parser.add_argument("--year",       dest="year",       help="which year",           default="2024"           )
     parser.add_argument("--options",    dest="options",    help="histo options file",   default="ttreeDrawer_aux")
+    parser.add_argument("--engine",     dest="engine",     help="how to fill histos",   default="rdf", choices=["rdf", "draw", "numpy"])
+    parser.add_argument("--chunkSize",  dest="chunkSize",  help="entries per chunk",    default=500000, type=int )
+    parser.add_argument("--directProjections", dest="directProjections", help="fill projections directly", default=False, action="store_true")
+    parser.add_argument("--jobs",       dest="jobs",       help="number of processes",  default=os.cpu_count(), type=int)
+    parser.add_argument("--shardSize",  dest="shardSize",  help="MB of input per task", default=512, type=float)
+    parser.add_argument("--cacheDir",   dest="cacheDir",   help="histo cache directory", default=None)
+    parser.add_argument("--cacheSize",  dest="cacheSize",  help="max MB of histo cache", default=10240, type=float)
+    parser.add_argument("--remote",     dest="remote",     help="optimize remote reads", default=False, action="store_true")
+    parser.add_argument("--redirector", dest="redirector", help="XRootD redirector for EOS", default="root://eosuser.cern.ch/")
+    parser.add_argument("--treeCacheSize", dest="treeCacheSize", help="MB of TTreeCache when remote", default=100, type=float)
+    parser.add_argument("--profile",    dest="profile",    help="report time per stage", default=False, action="store_true")
     args = parser.parse_args()
+
+    if args.profile:
+        profiling.enable()
+
+    if args.directProjections and args.engine == "draw":
+        parser.error("--directProjections is not available with --engine draw")
     
     # The auxiliary file contains many "hardcoded" items
     # describing which histograms to get and how to draw
     # them. These things are changed often by the user
     # and thus are kept in separate sidecar file.
-    importedGoods = __import__(args.options)
+    try:
+        importedGoods = __import__(args.options)
+    except (ImportError, SyntaxError) as e:
+        parser.error(f"Could not import options file \"{args.options}\" with reason {e}")
     
     # Names of histograms, rebinning
-    histograms = importedGoods.histograms
+    histograms = getattr(importedGoods, "histograms", None)
+    if not isinstance(histograms, list):
+        parser.error(f"Options file \"{args.options}\" has no histograms list")
+
+    problems = columnarEngine.validateHistograms(histograms)
+    for problem in problems:
+        print(f"\033[1;31mWARNING: {problem}\033[0m")
+    if problems:
+        parser.error(f"Options file \"{args.options}\" has {len(problems)} problems")
     
     inputDir   = args.inputDir
     outputFile = args.outputFile
     year       = args.year
     
-    base = os.getenv("CMSSW_BASE")
-    user = os.getenv("USER")
-
-    datetimeStr = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    tempDir = f"/tmp/{user}/{datetimeStr}"
-    
     inputFiles = glob.glob(inputDir + "/*.root")
 
-    # For speed, histogramming for each input ROOT file
-    # is run in a separate pool process. This is limited to 8 at a time to avoid abuse
-    manager = mp.Manager()
-    pool = mp.Pool(processes=min(8, len(inputFiles)))
+    # With a cache, the histograms of files and side car entries that were
+    # already processed are merged from it and only the rest is processed
+    merged = {}
+    needed = {inputFile : list(range(len(histograms))) for inputFile in inputFiles}
+
+    cache = None
+    if args.cacheDir is not None:
+        cache = histoCache.HistoCache(args.cacheDir, int(args.cacheSize * 1024**2))
+
+        nHits = 0
+        for inputFile in inputFiles:
+            missing = []
+            for specIndex, histOps in enumerate(histograms):
+                with profiling.stage("cache", readPath(inputFile, args.redirector if args.remote else None), histOps["basename"]):
+                    cached = cache.get(inputFile, histOps, args.tree)
+                if cached is None:
+                    missing.append(specIndex)
+                else:
+                    mergeHistos(merged, cached)
+                    nHits += 1
+            needed[inputFile] = missing
+
+        print(f"Found {nHits} of {len(inputFiles) * len(histograms)} input file and histogram combinations in the cache")
+
+    if inputFiles:
+        with profiling.stage("parse"):
+            reportBranches(inputFiles[0], histograms, args.tree, args.redirector if args.remote else None)
+
+    # Large files are split and small ones grouped into shards of similar size
+    treeNames = {histOps.get("tree", args.tree) for histOps in histograms}
+    remote    = {"redirector" : args.redirector, "treeCacheSize" : int(args.treeCacheSize * 1024**2)} if args.remote else None
+    shards    = makeShards(inputFiles, treeNames.pop() if len(treeNames) == 1 else None, int(args.shardSize * 1024**2), needed, args.engine, args.redirector if args.remote else None)
+
+    # Keep track of how many shards each split file has, to cache it once complete
+    nSplits  = {}
+    partials = {}
+    for shard, _ in shards:
+        if shard[0][2] is not None:
+            nSplits[shard[0][0]] = nSplits.get(shard[0][0], 0) + 1
+
+    # For speed, histogramming for each shard is run in a separate pool process.
+    # Shards are handed out one at a time, largest first, to whichever process is free
+    nProcesses = max(1, min(args.jobs, len(shards)))
+    pool = rootLoader.pool(nProcesses, preload=args.engine != "numpy", expressions=[expression for histOps in histograms for expression in specExpressions(histOps)])
     
-    # The processFile function is attached to each process
-    results = []
-    for inputFile in inputFiles:
-        inputIndex = inputFiles.index(inputFile)
-        result = pool.apply_async(processFile, args=(tempDir, inputFile, inputIndex, year, histograms))
-        results.append(result)
-
-    for result in results:
-        result.wait()
+    tasks = [(iShard, shard, shardBytes, year, histograms, args.engine, args.tree, args.chunkSize, args.directProjections, args.cacheDir, remote) for iShard, (shard, shardBytes) in enumerate(shards)]
+
+    # Histograms of each shard are added to the running total as soon
+    # as its pool process is done, so only one set of them is held in memory
+    start   = time.perf_counter()
+    timings = []
+    for histos, shardPartials, timing in pool.imap_unordered(processTask, tasks):
+        with profiling.stage("merge"):
+            mergeHistos(merged, histos)
+        profiling.add(timing.pop("profile"))
+        timings.append(timing)
+
+        for inputFile, specIndex, specHistos in shardPartials:
+            mergeHistos(partials.setdefault((inputFile, specIndex), {}), specHistos)
+        if shardPartials:
+            inputFile = shardPartials[0][0]
+            nSplits[inputFile] -= 1
+            if nSplits[inputFile] == 0:
+                for specIndex in needed[inputFile]:
+                    cache.put(inputFile, histograms[specIndex], args.tree, partials.pop((inputFile, specIndex)))
+
+    pool.close()
+    pool.join()
+
+    if cache is not None:
+        cache.evict()
+
+    wallTime = time.perf_counter() - start
+    busyTime = sum(timing["seconds"] for timing in timings)
+
+    if timings:
+        print(f"{'shard':>6} {'pieces':>7} {'entries':>12} {'MB':>10} {'seconds':>9}")
+        for timing in sorted(timings, key=lambda timing: timing["shard"]):
+            print(f"{timing['shard']:>6} {timing['pieces']:>7} {timing.get('entries', '-'):>12} {timing['bytes'] / 1024**2:>10.1f} {timing['seconds']:>9.2f}")
+        print(f"Processed {len(shards)} shards with {nProcesses} processes in {wallTime:.2f} s ({busyTime:.2f} s of work, speedup {busyTime / wallTime:.2f}x)")
 
     pathToOutput = Path(outputFile).parent
     os.makedirs(pathToOutput, exist_ok=True)
 
-    filesToHaddStr = " ".join(glob.glob(f"{tempDir}/*.root"))
-    subprocess.call(f"hadd -j 4 -f {outputFile} {filesToHaddStr}".split(" "))
-    subprocess.call(f"rm -rf {tempDir}".split(" "))
+    with profiling.stage("write", outputFile):
+        outfile = ROOT.TFile.Open(outputFile, "RECREATE")
+        for name, histo in merged.items():
+            outfile.cd()
+            histo.toROOT().Write(name, ROOT.TObject.kOverwrite)
+        outfile.Close()
+
+    if args.profile:
+        profiling.report(f"{os.path.splitext(outputFile)[0]}_profile.json")
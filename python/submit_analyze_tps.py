@@ -1,12 +1,270 @@
 #!/usr/bin/env python
 
 import os
+import re
 import sys
 import glob
+import json
+import time
+import hashlib
+import shlex
 import argparse
+import threading
 import subprocess
+import multiprocessing as mp
 import shutil
 from time import strftime
+from concurrent.futures import ThreadPoolExecutor
+
+# Local cache of DAS query results keyed by the query string, each
+# result is reused for ttl seconds so that resubmitting a tag does not
+# query DAS again. The cache is shared by the lookup threads
+class DASCache:
+
+    def __init__(self, cacheFile, ttl):
+
+        self.cacheFile = cacheFile
+        self.ttl       = ttl
+        self.lock      = threading.Lock()
+        self.entries   = {}
+
+        if self.cacheFile and os.path.exists(self.cacheFile):
+            try:
+                with open(self.cacheFile) as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def get(self, query):
+
+        with self.lock:
+            entry = self.entries.get(query)
+
+        if entry and time.time() - entry["time"] < self.ttl:
+            return entry["result"]
+
+        return None
+
+    def put(self, query, result):
+
+        with self.lock:
+            self.entries[query] = {"time" : time.time(), "result" : result}
+
+    def save(self):
+
+        if not self.cacheFile:
+            return
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.cacheFile)), exist_ok=True)
+        with self.lock:
+            now     = time.time()
+            entries = {query : entry for query, entry in self.entries.items() if now - entry["time"] < self.ttl}
+
+        tempFile = f"{self.cacheFile}.{os.getpid()}.tmp"
+        with open(tempFile, "w") as f:
+            json.dump(entries, f)
+        os.replace(tempFile, self.cacheFile)
+
+# Run a single DAS query with the given client command (dasgoclient by default,
+# or any stand-in script taking the same --query argument) and return the
+# non-empty output lines. Successful results are kept in the cache
+def query_das(query, dasClient, cache):
+
+    result = cache.get(query)
+    if result is not None:
+        return result
+
+    proc = subprocess.run(shlex.split(dasClient) + [f"--query={query}"], capture_output=True)
+    if proc.returncode != 0:
+        print(f"\033[1;31mWARNING: DAS query \"{query}\" failed with reason {proc.stderr.decode('utf-8').strip()}\033[0m")
+        return []
+
+    result = [line.strip() for line in proc.stdout.decode('utf-8').split("\n") if line.strip()]
+    cache.put(query, result)
+
+    return result
+
+# Pick the first dataset matching the (possibly wildcarded) dataset pattern
+def match_dataset(dataset, datasets):
+
+    chunks = dataset.split("/")
+    streamwild  = "*" in chunks[1]
+    configwild  = "*" in chunks[2]
+    tierwild    = "*" in chunks[3]
+
+    streamcards = chunks[1].split("*")
+    configcards = chunks[2].split("*")
+    tiercards   = chunks[3].split("*")
+
+    stream = chunks[1].replace("*", "")
+    config = chunks[2].replace("*", "")
+    tier   = chunks[3].replace("*", "")
+
+    for dset in datasets:
+        dsetchunks = dset.split("/")
+        if len(dsetchunks) < 4:
+            continue
+        dsetstream = dsetchunks[1]
+        dsetconfig = dsetchunks[2]
+        dsettier   = dsetchunks[3]
+        if ((streamwild and all(streamcard in dsetstream for streamcard in streamcards)) or (not streamwild and stream == dsetstream)) and \
+           ((configwild and all(configcard in dsetconfig for configcard in configcards)) or (not configwild and config == dsetconfig)) and \
+           ((tierwild   and all(tiercard   in dsettier   for tiercard   in tiercards))   or (not tierwild   and tier   == dsettier)):
+            return dset
+
+    return dataset
+
+# Find the input files of all runs with DAS. Identical queries are only made
+# once and all queries of a stage are issued concurrently by nWorkers threads:
+# first the dataset resolutions (if the dataset is wildcarded) and then the file lookups.
+# Returned are (name, size in bytes, number of events) tuples, where the size and
+# number of events are only looked up (otherwise None) when withSizes is set
+def find_das_files(dataset, runs, isMC, dasClient, cache, nWorkers, withSizes=False):
+
+    runStrs = [f"run={run}" if not isMC else "" for run in runs]
+
+    with ThreadPoolExecutor(max_workers=nWorkers) as pool:
+
+        explicitDatasets = [dataset] * len(runs)
+        if "*" in dataset:
+            queries = list(dict.fromkeys(f"dataset {runStr}".strip() for runStr in runStrs))
+            results = dict(zip(queries, pool.map(lambda query: query_das(query, dasClient, cache), queries)))
+
+            explicitDatasets = [match_dataset(dataset, results[f"dataset {runStr}".strip()]) for runStr in runStrs]
+
+        fileQueries = [f"file dataset={explicitDataset} {runStr}".strip() for explicitDataset, runStr in zip(explicitDatasets, runStrs)]
+        if withSizes:
+            fileQueries = [f"{query} | grep file.name, file.size, file.nevents" for query in fileQueries]
+        queries     = list(dict.fromkeys(fileQueries))
+        results     = dict(zip(queries, pool.map(lambda query: query_das(query, dasClient, cache), queries)))
+
+    cache.save()
+
+    # Keep the order of the runs and drop files listed more than once
+    files = {}
+    for query in fileQueries:
+        for line in results[query]:
+            fields = line.split()
+            if fields[0] not in files:
+                size    = int(fields[1]) if len(fields) > 1 and fields[1].isdigit() else None
+                nevents = int(fields[2]) if len(fields) > 2 and fields[2].isdigit() else None
+                files[fields[0]] = (fields[0], size, nevents)
+
+    return list(files.values())
+
+# Group the input files into jobs. With packBy "file" there is one file per job,
+# with "size" ("events") consecutive files are added to a job until their total
+# size in MB (number of events) reaches target. A file larger than the target
+# gets a job of its own. Files without the needed information count as a full job
+def pack_jobs(inputFiles, packBy, target):
+
+    if packBy == "file":
+        return [[name] for name, _, _ in inputFiles]
+
+    jobs   = []
+    job    = []
+    amount = 0.0
+    for name, size, nevents in inputFiles:
+        value = size if packBy == "size" else nevents
+        if value is None:
+            value = target
+        elif packBy == "size":
+            value /= 1024.0**2
+
+        if job and amount + value > target:
+            jobs.append(job)
+            job    = []
+            amount = 0.0
+
+        job.append(name)
+        amount += value
+
+    if job:
+        jobs.append(job)
+
+    return jobs
+
+# Directories left out of the sandbox, same as the tar excludes used to build it
+SANDBOX_EXCLUDES = ["tmp", "bin", ".git", ".svn", ".hg", ".bzr", "CVS"]
+
+# Hash the name, size and modification time of every file going into the
+# sandbox tarball of the CMSSW release, any rebuilt library or edited python
+# file gives a new hash. Only metadata is read so this is fast even for a large release
+def hash_sandbox(CMSSW_BASE):
+
+    sha = hashlib.sha256()
+    for directory, subdirs, fileNames in os.walk(CMSSW_BASE):
+        relDir = os.path.relpath(directory, CMSSW_BASE)
+
+        # Same as --exclude-caches-all, directories with a cache tag are skipped
+        if "CACHEDIR.TAG" in fileNames:
+            subdirs[:] = []
+            continue
+
+        subdirs[:] = sorted(subdir for subdir in subdirs if subdir not in SANDBOX_EXCLUDES and os.path.join(relDir, subdir) != "src/Debug")
+        for fileName in sorted(fileNames):
+            try:
+                stat = os.lstat(os.path.join(directory, fileName))
+            except OSError:
+                continue
+            sha.update(f"{os.path.join(relDir, fileName)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+
+    return sha.hexdigest()
+
+# Get the sandbox tarball of the CMSSW release from sandboxDir, where tarballs
+# are named after the hash of their content, and only build it if it is not there.
+# pigz is used to compress with all cores when it is available
+def build_sandbox(CMSSW_BASE, CMSSW_VERSION, sandboxDir):
+
+    start = time.time()
+
+    sandboxHash = hash_sandbox(CMSSW_BASE)
+    sandbox     = f"{sandboxDir}/{CMSSW_VERSION}_{sandboxHash[:16]}.tar.gz"
+
+    if os.path.exists(sandbox):
+        print(f"Reusing sandbox {sandbox} ({os.path.getsize(sandbox) / 1024.0**2:.1f} MB), hashed in {time.time() - start:.1f} s")
+        return sandbox
+
+    os.makedirs(sandboxDir, exist_ok=True)
+
+    compressor = "pigz" if shutil.which("pigz") else "gzip"
+    compress   = ["-I", "pigz"] if compressor == "pigz" else ["-z"]
+    tempFile = f"{sandbox}.{os.getpid()}.tmp"
+    excludes = [f"--exclude={exclude}" for exclude in ["tmp", "bin", "src/Debug"]]
+    code = subprocess.call(["tar", "--exclude-caches-all", "--exclude-vcs"] + compress + ["-cf", tempFile] + excludes + ["-C", f"{CMSSW_BASE}/..", CMSSW_VERSION])
+    if code != 0:
+        if os.path.exists(tempFile):
+            os.remove(tempFile)
+        print(f"\033[1;31mWARNING: Could not build sandbox for \"{CMSSW_BASE}\"\033[0m")
+        sys.exit(1)
+    os.replace(tempFile, sandbox)
+
+    print(f"Built sandbox {sandbox} ({os.path.getsize(sandbox) / 1024.0**2:.1f} MB) with {compressor} in {time.time() - start:.1f} s")
+
+    return sandbox
+
+# Placeholders in templates look like __GLOBALTAG__
+PLACEHOLDER = re.compile(r"__([A-Z0-9]+)__")
+
+# Substitute all placeholders of the template in a single pass. Placeholders
+# without a value and values without a placeholder are errors, so a typo
+# on either side stops the submission before anything is written
+def render_template(templateFile, outputFile, values):
+
+    with open(templateFile) as f:
+        template = f.read()
+
+    found   = set(PLACEHOLDER.findall(template))
+    missing = found - set(values)
+    unused  = set(values) - found
+    if missing or unused:
+        print(f"\033[1;31mWARNING: Cannot render \"{templateFile}\", no value for {sorted(missing)} and no placeholder for {sorted(unused)}\033[0m")
+        sys.exit(1)
+
+    rendered = PLACEHOLDER.sub(lambda match: str(values[match.group(1)]), template)
+
+    with open(outputFile, "w") as f:
+        f.write(rendered)
 
 # Write .sh script to be run by Condor on the worker node
 def generate_job_steerer(workingDir, outputDir, l1TrgObjsFile, CMSSW_VERSION):
@@ -23,8 +281,6 @@ def generate_job_steerer(workingDir, outputDir, l1TrgObjsFile, CMSSW_VERSION):
     scriptFile.write("voms-proxy-info -all\n")
     scriptFile.write("voms-proxy-info -all -file $PROXY\n\n")
 
-    scriptFile.write("sed -i \"s#__FILE__#$FILE#g\" analyze_tps.py\n\n")
-
     scriptFile.write("export SCRAM_ARCH=el9_amd64_gcc12\n")
     scriptFile.write("source /cvmfs/cms.cern.ch/cmsset_default.sh\n") 
     scriptFile.write(f"eval `scramv1 project CMSSW {CMSSW_VERSION}`\n\n")
@@ -37,7 +293,8 @@ def generate_job_steerer(workingDir, outputDir, l1TrgObjsFile, CMSSW_VERSION):
     scriptFile.write("scramv1 b ProjectRename\n")
     scriptFile.write("eval `scramv1 runtime -sh`\n\n")
 
-    scriptFile.write("cmsRun analyze_tps.py\n\n")
+    # FILE is a comma separated list of input files
+    scriptFile.write("cmsRun analyze_tps.py inputFiles=$FILE\n\n")
     scriptFile.write(f"xrdcp -f analyze_tps.root {outputDir}/analyze_tps_$JOB.root 2>&1\n\n")
     scriptFile.write("cd ${_CONDOR_SCRATCH_DIR}\n")
     
@@ -46,9 +303,13 @@ def generate_job_steerer(workingDir, outputDir, l1TrgObjsFile, CMSSW_VERSION):
     scriptFile.close()
 
 # Write Condor submit file 
-def generate_condor_submit(workingDir, filelist, l1TrgObjsFile, CMSSW_VERSION, USER, onEOS):
+#   jobs    : dictionary of job index to the list of input files of the job
+#   jdlName : name of the submit file in the working directory
+# The jobs are queued from a table next to the submit file with
+# one line per job holding its index and its input files
+def generate_condor_submit(workingDir, jobs, l1TrgObjsFile, CMSSW_VERSION, USER, onEOS, jobFlavour, jdlName="condorSubmit.jdl"):
 
-    condorSubmit = open(f"{workingDir}/condorSubmit.jdl", "w")
+    condorSubmit = open(f"{workingDir}/{jdlName}", "w")
     condorSubmit.write(f"Executable            = {workingDir}/run_analyze_tps.sh\n")
     condorSubmit.write("Universe              =  vanilla\n")
     condorSubmit.write("Requirements          =  (OpSysAndVer =?= \"AlmaLinux9\")\n")
@@ -57,7 +318,7 @@ def generate_condor_submit(workingDir, filelist, l1TrgObjsFile, CMSSW_VERSION, U
     condorSubmit.write(f"Output                =  {workingDir}/logs/$(Cluster)_$(Process).stdout\n")
     condorSubmit.write(f"Error                 =  {workingDir}/logs/$(Cluster)_$(Process).stderr\n")
     condorSubmit.write(f"Log                   =  {workingDir}/logs/$(Cluster)_$(Process).log\n")
-    condorSubmit.write("+JobFlavour           = \"microcentury\"\n")
+    condorSubmit.write(f"+JobFlavour           = \"{jobFlavour}\"\n")
     condorSubmit.write("MY.SendCredential     = true\n")
     condorSubmit.write("when_to_transfer_output = on_success\n")
     condorSubmit.write(f"output_destination = root://eosuser.cern.ch///eos/user/{USER[0]}/{USER}/HcalTrigger/\n")
@@ -65,18 +326,93 @@ def generate_condor_submit(workingDir, filelist, l1TrgObjsFile, CMSSW_VERSION, U
     condorSubmit.write("Should_Transfer_Files = YES\n")
     condorSubmit.write(f"Transfer_Input_Files = {workingDir}/{l1TrgObjsFile}, {workingDir}/analyze_tps.py, {workingDir}/run_analyze_tps.sh, {workingDir}/{CMSSW_VERSION}.tar.gz\n")
    
-    iJob = 0 
-    for file in filelist:
-        fullFilePath = f"root://cms-xrd-global.cern.ch/{file}"
-        if onEOS:
-            fullFilePath = f"root://eosuser.cern.ch/{file}"
-           
-        condorSubmit.write(f"Arguments = $(Proxy_path) {iJob} {fullFilePath}\n")
-        condorSubmit.write("Queue\n\n")
-        iJob += 1
+    jobTable = f"{workingDir}/{os.path.splitext(jdlName)[0]}_jobs.txt"
+    with open(jobTable, "w") as f:
+        for iJob, files in jobs.items():
+            fullFilePaths = [f"root://cms-xrd-global.cern.ch/{file}" for file in files]
+            if onEOS:
+                fullFilePaths = [f"root://eosuser.cern.ch/{file}" for file in files]
+
+            f.write(f"{iJob} {','.join(fullFilePaths)}\n")
+
+    condorSubmit.write("Arguments = $(Proxy_path) $(JOB) $(FILES)\n")
+    condorSubmit.write(f"Queue JOB, FILES from {jobTable}\n")
     
     condorSubmit.close()
 
+# Write the manifest of the submission, holding the job index to input files
+# mapping and what is needed to write a submit file for a subset of the jobs
+def write_manifest(workingDir, manifest):
+
+    with open(f"{workingDir}/manifest.json", "w") as f:
+        json.dump(manifest, f, indent=2)
+
+# Check the output of a single job: the file has to exist, be non-empty and
+# be a ROOT file that closed properly with a readable analyzeTPs/tps tree.
+# Returns the job index and the reason the output is bad, or None if it is good
+def check_output(task):
+
+    iJob, outputFile = task
+
+    try:
+        if os.path.getsize(outputFile) == 0:
+            return iJob, "empty file"
+    except OSError:
+        return iJob, "missing file"
+
+    import ROOT
+
+    file = ROOT.TFile.Open(outputFile, "READONLY")
+    if not file or file.IsZombie():
+        return iJob, "unreadable file"
+
+    reason = None
+    if file.TestBit(ROOT.TFile.kRecovered):
+        reason = "truncated file"
+    else:
+        tree = file.Get("analyzeTPs/tps")
+        if not tree or not tree.InheritsFrom("TTree"):
+            reason = "missing analyzeTPs/tps tree"
+    file.Close()
+
+    return iJob, reason
+
+# Check the outputs of all jobs of a submission in parallel and return the
+# failed or missing ones as a dictionary of job index to reason
+def find_failed_jobs(manifest, nWorkers):
+
+    outputDir = manifest["outputDir"].split(".ch//")[-1]
+    tasks     = [(int(iJob), f"{outputDir}/analyze_tps_{iJob}.root") for iJob in manifest["jobs"]]
+
+    failed = {}
+    with mp.Pool(processes=max(1, min(nWorkers, len(tasks)))) as pool:
+        for iJob, reason in pool.imap_unordered(check_output, tasks, chunksize=16):
+            if reason is not None:
+                failed[iJob] = reason
+
+    return dict(sorted(failed.items()))
+
+# Write a submit file with only the failed or missing jobs of a
+# previous submission, reusing its job steerer, config and sandbox
+def resubmit_missing(workingDir, nWorkers, submit):
+
+    with open(f"{workingDir}/manifest.json") as f:
+        manifest = json.load(f)
+
+    failed = find_failed_jobs(manifest, nWorkers)
+    for iJob, reason in failed.items():
+        print(f"Job {iJob}: {reason}")
+    print(f"{len(failed)} of {len(manifest['jobs'])} jobs to resubmit")
+
+    if not failed:
+        return
+
+    jdlName = f"condorResubmit_{strftime('%Y%m%d_%H%M%S')}.jdl"
+    jobs    = {iJob : manifest["jobs"][str(iJob)] for iJob in failed}
+    generate_condor_submit(workingDir, jobs, manifest["l1TrgObjs"], manifest["CMSSW_VERSION"], manifest["USER"], manifest["onEOS"], manifest["jobFlavour"], jdlName)
+
+    if submit: os.system(f"condor_submit {workingDir}/{jdlName}")
+
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
@@ -89,8 +425,22 @@ if __name__ == '__main__':
     parser.add_argument("--era"      , dest="era"      , help="Era to use"                , type=str , default="Run3")
     parser.add_argument("--globalTag", dest="globalTag", help="Global tag to use"         , type=str , default="140X_dataRun3_Prompt_v4")
     parser.add_argument("--l1TrgObjs", dest="l1TrgObjs", help="Override GT with L1TrgObj" , type=str , default="")
+    parser.add_argument("--dasClient", dest="dasClient", help="Command to query DAS"      , type=str , default="dasgoclient")
+    parser.add_argument("--dasJobs"  , dest="dasJobs"  , help="Concurrent DAS queries"    , type=int , default=8)
+    parser.add_argument("--dasCache" , dest="dasCache" , help="DAS query cache file"      , type=str , default=os.path.expanduser("~/.cache/hcaldebug/das_cache.json"))
+    parser.add_argument("--dasTTL"   , dest="dasTTL"   , help="Hours to reuse DAS results", type=float, default=24.0)
+    parser.add_argument("--packBy"   , dest="packBy"   , help="How to group files in jobs", type=str , default="file", choices=["file", "size", "events"])
+    parser.add_argument("--packTarget", dest="packTarget", help="MB or events per job"    , type=float, default=4096.0)
+    parser.add_argument("--jobFlavour", dest="jobFlavour", help="Condor job flavour"      , type=str , default="microcentury")
+    parser.add_argument("--sandboxDir", dest="sandboxDir", help="Where to keep sandboxes" , type=str , default=None)
+    parser.add_argument("--resubmit-missing", dest="resubmitMissing", help="Task dir to resubmit failed jobs of", type=str, default=None)
+    parser.add_argument("--checkJobs", dest="checkJobs", help="Processes to check outputs", type=int , default=os.cpu_count())
     args = parser.parse_args()
 
+    if args.resubmitMissing:
+        resubmit_missing(args.resubmitMissing, args.checkJobs, args.submit)
+        sys.exit(0)
+
     tag       = args.tag
     runs      = args.runs
     era       = args.era
@@ -121,48 +471,18 @@ if __name__ == '__main__':
 
     # Need to query das and find relevant dataset and list of files
     if not onEOS:
-        chunks = dataset.split("/")
-        streamwild  = "*" in chunks[1]
-        configwild  = "*" in chunks[2]
-        tierwild    = "*" in chunks[3]
-
-        streamcards = chunks[1].split("*")
-        configcards = chunks[2].split("*")
-        tiercards   = chunks[3].split("*")
-
-        stream = chunks[1].replace("*", "")
-        config = chunks[2].replace("*", "")
-        tier   = chunks[3].replace("*", "")
-
-        for run in runs:
-
-            runStr = f"run={run}"
-            if isMC:
-                runStr = ""
-
-            explicitDataset = dataset
-            if "*" in dataset:
-                proc = subprocess.run(f'dasgoclient --query="dataset {runStr}"', capture_output=True, shell=True) 
-                datasets = proc.stdout.decode('utf-8').split("\n")
-                for dset in datasets:
-                    dsetchunks = dset.split("/")
-                    dsetstream = dsetchunks[1]
-                    dsetconfig = dsetchunks[2]
-                    dsettier   = dsetchunks[3]
-                    if ((streamwild and all(streamcard in dsetstream for streamcard in streamcards)) or (not streamwild and stream == dsetstream)) and \
-                       ((configwild and all(configcard in dsetconfig for configcard in configcards)) or (not configwild and config == dsetconfig)) and \
-                       ((tierwild   and all(tiercard   in dsettier   for tiercard   in tiercards))   or (not tierwild   and tier   == dsettier)):
-                        explicitDataset = dset
-                        break
-            
-            proc = subprocess.run(f'dasgoclient --query="file dataset={explicitDataset} {runStr}"', capture_output=True, shell=True)
-            files = proc.stdout.decode('utf-8').split("\n")
-            for file in files:
-                inputFiles.append(file.rstrip())
-
-            inputFiles = list(filter(None, inputFiles))
+        cache      = DASCache(args.dasCache, args.dasTTL * 3600.0)
+        inputFiles = find_das_files(dataset, runs, isMC, args.dasClient, cache, args.dasJobs, args.packBy != "file")
     else:
-        inputFiles = glob.glob(dataset + "/*.root")
+        inputFiles = [(file, os.path.getsize(file), None) for file in sorted(glob.glob(dataset + "/*.root"))]
+
+    packBy = args.packBy
+    if packBy == "events" and any(nevents is None for _, _, nevents in inputFiles):
+        print("\033[1;31mWARNING: Number of events not known for all input files, packing jobs by size instead\033[0m")
+        packBy = "size"
+
+    jobs = dict(enumerate(pack_jobs(inputFiles, packBy, args.packTarget)))
+    print(f"Packed {len(inputFiles)} input files into {len(jobs)} jobs")
 
     taskDir = strftime("%Y%m%d_%H%M%S")
 
@@ -183,7 +503,7 @@ if __name__ == '__main__':
     # then we don't need to run hcalDigis (to unpack RAW etc.)
     # and can just grab the packedTP collection literally
     # Likewise, the process name is HLT is this case
-    commentOutChar        = ""
+    noUnpackChar          = ""
     packedTPtag           = "hcalDigis"
     inputDigisTag         = "hcalDigis" 
     inputUpgradeDigisTag1 = "hcalDigis" 
@@ -191,26 +511,26 @@ if __name__ == '__main__':
     packedTPsProcessName  = "processName"
     generateLUTs          = "False"
     if isMC:
-        commentOutChar        = "#"
+        noUnpackChar          = "#"
         packedTPtag           = "simHcalTriggerPrimitiveDigis"
         inputDigisTag         = "simHcalUnsuppressedDigis"
         inputUpgradeDigisTag1 = "simHcalUnsuppressedDigis:HBHEQIE11DigiCollection"
         inputUpgradeDigisTag2 = "simHcalUnsuppressedDigis:HFQIE10DigiCollection"
-        packedTPsProcessName  = "\\\"HLT\\\""
+        packedTPsProcessName  = "\"HLT\""
         generateLUTs          = "True"
 
 
-    subprocess.call([f'sed -e "s#__ERA__#{era}#g" \
-                           -e "s#__GLOBALTAG__#{globalTag}#g" \
-                           -e "s#__OVERRIDE__#{overrideL1TrgObjs}#g" \
-                           -e "s#__DIGISTAG__#{inputDigisTag}#g" \
-                           -e "s#__UPGRADEDIGISTAG1__#{inputUpgradeDigisTag1}#g" \
-                           -e "s#__UPGRADEDIGISTAG2__#{inputUpgradeDigisTag2}#g" \
-                           -e "s#__PACKEDTPTAG__#{packedTPtag}#g" \
-                           -e "s#__PACKEDTPPROCESSNAME__#{packedTPsProcessName}#g" \
-                           -e "s#__GENLUTS__#{generateLUTs}#g" \
-                           -e "s@process.hcalDigis@{commentOutChar}process.hcalDigis@g" \
-                           {hcalDir}/test/analyze_tps_template.py > {workingDir}/analyze_tps.py'], shell=True)
+    render_template(f"{hcalDir}/test/analyze_tps_template.py", f"{workingDir}/analyze_tps.py",
+                    {"ERA"                  : era,
+                     "GLOBALTAG"            : globalTag,
+                     "OVERRIDE"             : overrideL1TrgObjs,
+                     "DIGISTAG"             : inputDigisTag,
+                     "UPGRADEDIGISTAG1"     : inputUpgradeDigisTag1,
+                     "UPGRADEDIGISTAG2"     : inputUpgradeDigisTag2,
+                     "PACKEDTPTAG"          : packedTPtag,
+                     "PACKEDTPPROCESSNAME"  : packedTPsProcessName,
+                     "GENLUTS"              : generateLUTs,
+                     "NOUNPACK"             : noUnpackChar})
     
     # Create directories to save logs
     os.makedirs(f"{workingDir}/logs")
@@ -219,10 +539,26 @@ if __name__ == '__main__':
     generate_job_steerer(workingDir, outputDir, l1TrgObjs, CMSSW_VERSION)
 
     # Write the condor submit file for condor to do its thing
-    generate_condor_submit(workingDir, inputFiles, l1TrgObjs, CMSSW_VERSION, USER, onEOS)    
+    generate_condor_submit(workingDir, jobs, l1TrgObjs, CMSSW_VERSION, USER, onEOS, args.jobFlavour)    
+
+    write_manifest(workingDir, {"tag"           : tag,
+                                "outputDir"     : outputDir,
+                                "l1TrgObjs"     : l1TrgObjs,
+                                "CMSSW_VERSION" : CMSSW_VERSION,
+                                "USER"          : USER,
+                                "onEOS"         : onEOS,
+                                "jobFlavour"    : args.jobFlavour,
+                                "jobs"          : jobs})
 
     subprocess.call(["chmod", "+x", f"{workingDir}/run_analyze_tps.sh"])
 
-    subprocess.call(["tar", "--exclude-caches-all", "--exclude-vcs", "-zcf", f"{workingDir}/{CMSSW_VERSION}.tar.gz", "--exclude=tmp", "--exclude=bin", "--exclude=src/Debug", "-C", f"{CMSSW_BASE}/..", CMSSW_VERSION])
+    # The sandbox is shared by all submissions from the same release state,
+    # the task directory gets a hard link to it (or a copy across file systems)
+    sandboxDir = args.sandboxDir if args.sandboxDir else f"{hcalDir}/condor/sandboxes"
+    sandbox    = build_sandbox(CMSSW_BASE, CMSSW_VERSION, sandboxDir)
+    try:
+        os.link(sandbox, f"{workingDir}/{CMSSW_VERSION}.tar.gz")
+    except OSError:
+        shutil.copy2(sandbox, f"{workingDir}/{CMSSW_VERSION}.tar.gz")
     
     if submit: os.system(f"condor_submit {workingDir}/condorSubmit.jdl")
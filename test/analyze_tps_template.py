@@ -1,8 +1,14 @@
 import FWCore.ParameterSet.Config as cms
+from FWCore.ParameterSet.VarParsing import VarParsing
 
 from Configuration.AlCa.GlobalTag import GlobalTag
 from Configuration.StandardSequences.Eras import eras
 
+# The input files are given per job on the command line,
+# i.e. cmsRun analyze_tps.py inputFiles=file1.root,file2.root
+options = VarParsing("analysis")
+options.parseArguments()
+
 processName = "ANATPS"
 process = cms.Process(processName, eras.__ERA__)
 
@@ -14,7 +20,7 @@ process.GlobalTag = GlobalTag(process.GlobalTag, "__GLOBALTAG__", '__OVERRIDE__'
 process.maxEvents = cms.untracked.PSet(input=cms.untracked.int32(-1))
 
 process.source = cms.Source("PoolSource",
-    fileNames = cms.untracked.vstring("__FILE__"),
+    fileNames = cms.untracked.vstring(options.inputFiles),
     secondaryFileNames = cms.untracked.vstring()
 )
 
@@ -34,7 +40,7 @@ process.HcalTPGCoderULUT.LUTGenerationMode = cms.bool(__GENLUTS__)
 process.simHcalTriggerPrimitiveDigis.inputLabel        = cms.VInputTag("__DIGISTAG__", "__DIGISTAG__")
 process.simHcalTriggerPrimitiveDigis.inputUpgradeLabel = cms.VInputTag("__UPGRADEDIGISTAG1__", "__UPGRADEDIGISTAG2__")
 
-process.hcalDigis.silent = cms.untracked.bool(False)
+__NOUNPACK__process.hcalDigis.silent = cms.untracked.bool(False)
 
 process.analyzeTPs = cms.EDAnalyzer("AnalyzeTPs",
                                  packedTriggerPrimitives=cms.InputTag("__PACKEDTPTAG__", "", __PACKEDTPPROCESSNAME__),
@@ -42,6 +48,6 @@ process.analyzeTPs = cms.EDAnalyzer("AnalyzeTPs",
                                  )
 
 process.p = cms.Path(
-    process.hcalDigis *
+    __NOUNPACK__process.hcalDigis *
     process.simHcalTriggerPrimitiveDigis *
     process.analyzeTPs)
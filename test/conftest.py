@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The scripts import each other as top level modules from their own directories
+for directory in ["plotting", "python"]:
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), directory))
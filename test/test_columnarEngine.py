@@ -0,0 +1,49 @@
+import numpy as np
+import uproot
+
+import columnarEngine
+import columnarStore
+import histoServer
+
+NENTRIES = 1000
+
+COUNT = {"basename" : "h_count", "variable" : "1", "weight" : "1", "selection" : "1", "xbins" : 3, "xmin" : 0, "xmax" : 3}
+ET    = {"basename" : "h_et", "variable" : "et_packed", "weight" : "1", "selection" : "ieta<0", "xbins" : 10, "xmin" : 0, "xmax" : 10}
+
+def writeNtuple(path):
+
+    ieta = np.where(np.arange(NENTRIES) % 2 == 0, -1, 1).astype(np.int8)
+    with uproot.recreate(path) as file:
+        file.mktree("tps", {"ieta" : np.int8, "et_packed" : np.float32})
+        file["tps"].extend({"ieta" : ieta, "et_packed" : (np.arange(NENTRIES) % 10).astype(np.float32)})
+
+def counts(histo):
+
+    return histo.sumw.sum(), histo.entries
+
+def test_constant_expression_counts_entries(tmp_path):
+
+    inputFile = str(tmp_path / "ntuple.root")
+    writeNtuple(inputFile)
+
+    count, et = columnarEngine.fillHistos(inputFile, [COUNT, ET], "tps", chunkSize=300)
+    assert counts(count["h_count"]) == (NENTRIES, NENTRIES)
+    assert counts(et["h_et"]) == (NENTRIES // 2, NENTRIES // 2)
+
+    count, = columnarEngine.fillHistos(inputFile, [COUNT], "tps", chunkSize=300, entryStart=100, entryStop=650)
+    assert counts(count["h_count"]) == (550, 550)
+
+def test_constant_expression_counts_dataset_entries(tmp_path):
+
+    inputFile = str(tmp_path / "ntuple.root")
+    writeNtuple(inputFile)
+    columnarStore.convertFiles([inputFile], "tps", str(tmp_path / "columns"), 300, 1)
+
+    dataset = columnarStore.ColumnarDataset(str(tmp_path / "columns"))
+    for chunkSize in [None, 300]:
+        count, = columnarStore.fillHistos(dataset, [COUNT], chunkSize)
+        assert counts(count["h_count"]) == (NENTRIES, NENTRIES)
+
+    store  = histoServer.ColumnStore({"test" : str(tmp_path)}, 1024**2)
+    count, = histoServer.fillHistos(store, "test", [COUNT], "tps", 300)
+    assert counts(count["h_count"]) == (NENTRIES, NENTRIES)
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from formulaParser import FormulaError, compileFormula
+from columnarEngine import validateHistograms
+
+COLUMNS = {"a" : np.array([1.0, 2.0, 3.0, 0.5]), "b" : np.array([1.0, 1.0, 2.0, 1.0])}
+
+def test_bitwise_operators():
+
+    assert compileFormula("a&b").evaluate(COLUMNS, 4).tolist() == [1.0, 0.0, 2.0, 0.0]
+    assert compileFormula("a|b").evaluate(COLUMNS, 4).tolist() == [1.0, 3.0, 3.0, 1.0]
+    assert compileFormula("(a>1)&(b>1)").evaluate(COLUMNS, 4).tolist() == [0.0, 0.0, 1.0, 0.0]
+
+def test_caret_is_rejected():
+
+    with pytest.raises(FormulaError):
+        compileFormula("a^2")
+
+    histOps  = {"basename" : "h_power", "variable" : "et_packed^2", "weight" : "1", "selection" : "1", "xbins" : 10, "xmin" : 0, "xmax" : 10}
+    problems = validateHistograms([histOps])
+
+    assert len(problems) == 1 and "h_power" in problems[0] and "pow(a, b)" in problems[0]
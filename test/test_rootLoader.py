@@ -0,0 +1,49 @@
+import profiling
+import rootLoader
+from formulaParser import compileFormula
+
+def recordStage(name):
+
+    with profiling.stage(name):
+        pass
+
+    return profiling.enabled(), compileFormula.cache_info().currsize, profiling.collect()
+
+def test_pool_profiles_workers():
+
+    profiling.enable()
+    try:
+        with rootLoader.pool(2, preload=False, expressions=["et_packed>0", "(1)*(ieta<0)"]) as pool:
+            results = pool.map(recordStage, ["first", "second", "third", "fourth"])
+    finally:
+        profiling._enabled = False
+        profiling.collect()
+
+    assert all(enabled for enabled, _, _ in results)
+    assert all(cached >= 2 for _, cached, _ in results)
+    assert sorted(record["stage"] for _, _, records in results for record in records) == ["first", "fourth", "second", "third"]
+
+def test_pool_without_profiling():
+
+    with rootLoader.pool(2, preload=False) as pool:
+        results = pool.map(recordStage, ["first", "second"])
+
+    assert not any(enabled for enabled, _, _ in results)
+    assert not any(records for _, _, records in results)
+
+def fileSize(inputFile, offset):
+
+    return inputFile, len(open(inputFile, "rb").read()) + offset
+
+def test_map_files_largest_first(tmp_path):
+
+    for name, size in [("small", 10), ("large", 30), ("medium", 20)]:
+        (tmp_path / f"{name}.root").write_bytes(b"x" * size)
+    (tmp_path / "other.txt").write_bytes(b"x")
+
+    inputFiles = rootLoader.inputFiles(str(tmp_path))
+    assert [name.split("/")[-1] for name in inputFiles] == ["large.root", "medium.root", "small.root"]
+
+    results = dict(rootLoader.mapFiles(fileSize, inputFiles, (1,), 2))
+    assert results == {inputFile : size + 1 for inputFile, size in zip(inputFiles, [30, 20, 10])}
+    assert rootLoader.inputFiles(str(tmp_path / "missing")) == []
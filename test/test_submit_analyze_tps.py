@@ -0,0 +1,21 @@
+from submit_analyze_tps import pack_jobs
+
+MB = 1024**2
+
+def test_pack_jobs_by_size():
+
+    inputFiles = [("a.root", 300 * MB, None), ("b.root", 300 * MB, None), ("c.root", 500 * MB, None), ("d.root", 50 * MB, None)]
+
+    assert pack_jobs(inputFiles, "size", 1000) == [["a.root", "b.root"], ["c.root", "d.root"]]
+
+def test_pack_jobs_without_size():
+
+    inputFiles = [("a.root", 300 * MB, None), ("b.root", None, None), ("c.root", 200 * MB, None), ("d.root", 100 * MB, None)]
+
+    assert pack_jobs(inputFiles, "size", 1000) == [["a.root"], ["b.root"], ["c.root", "d.root"]]
+
+def test_pack_jobs_without_events():
+
+    inputFiles = [("a.root", None, 400), ("b.root", None, None), ("c.root", None, 700)]
+
+    assert pack_jobs(inputFiles, "events", 1000) == [["a.root"], ["b.root"], ["c.root"]]
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from columnarEngine import NFG
+from summaryCube import SummaryCube
+
+def makeChunk(etPacked, etReemul):
+
+    nRows = len(etPacked)
+    chunk = {"ieta" : np.full(nRows, -41, dtype=np.int8), "iphi" : np.full(nRows, 72, dtype=np.uint8),
+             "et_packed" : np.array(etPacked, dtype=np.float32), "et_reemul" : np.array(etReemul, dtype=np.float32),
+             "found_packed" : np.ones(nRows, dtype=np.uint8), "found_reemul" : np.ones(nRows, dtype=np.uint8)}
+    for i in range(NFG):
+        chunk[f"fg{i}_packed"] = np.zeros(nRows, dtype=np.bool_)
+        chunk[f"fg{i}_reemul"] = np.zeros(nRows, dtype=np.bool_)
+
+    return chunk
+
+def test_et_round_trip():
+
+    cube = SummaryCube()
+    cube.fill(makeChunk([0.0, 255.5, 10.5], [255.5, 0.0, 10.5]))
+
+    columns = SummaryCube.decode("et", cube.keys["et"])
+    assert sorted(zip(columns["et_packed"], columns["et_reemul"])) == [(0.0, 255.5), (10.5, 10.5), (255.5, 0.0)]
+    assert set(columns["ieta"]) == {-41.0} and set(columns["iphi"]) == {72.0}
+
+@pytest.mark.parametrize("etPacked, etReemul", [([256.0], [1.0]), ([1.0], [-0.5])])
+def test_et_out_of_range(etPacked, etReemul):
+
+    with pytest.raises(ValueError, match="outside"):
+        SummaryCube().fill(makeChunk(etPacked, etReemul))
@@ -0,0 +1,20 @@
+import os
+
+import numpy as np
+import uproot
+
+import ttreeDrawer
+
+def test_numpy_shards_without_root(tmp_path):
+
+    inputFile = str(tmp_path / "ntuple.root")
+    with uproot.recreate(inputFile) as file:
+        file["tps"] = {"et_packed" : np.arange(1000, dtype=np.float32)}
+
+    shardBytes = os.path.getsize(inputFile) // 3
+    shards     = ttreeDrawer.makeShards([inputFile], "tps", shardBytes, {inputFile : [0]}, "numpy")
+
+    assert not ttreeDrawer.ROOT.loaded()
+    ranges = sorted((piece[2], piece[3]) for shard, _ in shards for piece in shard)
+    assert len(ranges) > 1 and ranges[0][0] == 0 and ranges[-1][1] == 1000
+    assert all(stop == start for (_, stop), (start, _) in zip(ranges[:-1], ranges[1:]))